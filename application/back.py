@@ -1,21 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 import time
-import vertexai
 import os
-from back_report import generate_client_report, generate_html, save_html, save_json, load_json, save_pdf
-from vertexai.generative_models import GenerativeModel, Tool
-from vertexai import rag
+from contextlib import asynccontextmanager
+from back_report import build_report, generate_client_report, render_report, restore_cached_report, cache_report, load_json, client_report_folder, report_cache_key
 import asyncio
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from back_segmentation import run_segmentation
-from front.public.mri.slice import extract_files
+from back_sessions import ChatSession, SessionStore, DEFAULT_USER
+from back_greeting import GreetingCache, report_hash
+from back_context import needs_compaction, compaction_split, summary_prompt, chat_history
+from back_executor import get_pool, pending_work, run_blocking, shutdown as shutdown_executor
+from back_jobs import JobQueue, QUEUED, RUNNING
+from back_storage import ChatConflict, SQLiteStateStore
+from back_metrics import REGISTRY, Gauge, call_with_metrics, LLM_CALL_SECONDS, LLM_FIRST_TOKEN_SECONDS, SEGMENTATION_SECONDS
+from back_slice_render import SliceRenderer, MEDIA_TYPES, SHEET_FORMAT, SLICE_MAX_AGE
 # from back_chat import cite_json_like
-import json
-import os
+# Heavy dependencies (vertexai, nibabel, scipy, cv2, weasyprint, the slice module)
+# are imported on first use to keep the server startup fast.
 
 # --- Configuration ---
 PROJECT_ID        = "gemma-hcls25par-722"
@@ -30,6 +38,8 @@ RAG_CORPUS        = (
     "/ragCorpora/4611686018427387904"
 )
 
+WORKERS = int(os.environ.get("MEDGEMMA_WORKERS", "1")) # Server processes (they share the state store)
+
 SYSTEM_PROMPT_CHAT = """You are a highly skilled clinical radiology assistant specializing in supporting doctors who monitor patients undergoing anti-amyloid treatment for Alzheimer's disease. 
 Your primary role is to assist in analyzing the progress of treatment, identifying potential issues, and providing insights based on the patient's latest MRI scans and reports. 
 You are expected to:
@@ -47,11 +57,14 @@ Always maintain a professional and empathetic tone, ensuring your responses are
 Use Markdown to format your responses.
 """
 
-FIRST_USER_MESSAGE = """Here are the client data:
+# Appended to the system prompt: the report is a fixed prefix shared by every session on it
+REPORT_CONTEXT = """
+Here are the client data:
 - Client Name: {client_name}
 - Data: {json_data}
+"""
 
-Please reply to this message as if it was the first message the doctor sees and with the following format:
+FIRST_USER_MESSAGE = """Please reply to this message as if it was the first message the doctor sees and with the following format:
 I’m your clinical radiology assistant, here to support you in caring for client {client_name} as they continue anti‑amyloid therapy for Alzheimer’s disease. 
 I have reviewed the most recent MRI sequences and accompanying reports, and I have real‑time access to the latest peer‑reviewed research on amyloid‑related imaging abnormalities (ARIA, including ARIA‑E).
 [You can include some more info here]
@@ -59,7 +72,19 @@ I have reviewed the most recent MRI sequences and accompanying reports, and I ha
 DO NOT USE RAG TO RESPOND TO THIS FIRST MESSAGE
 """
 
-app = FastAPI(title="MedGemma API", description="Medical imaging and chat API")
+@asynccontextmanager
+async def lifespan(app):
+    """Startup: resume interrupted jobs and warm Vertex AI up in the background. Shutdown: stop the pools."""
+    jobs.start()
+    start_vertex_warmup()
+    yield
+    jobs.shutdown(wait=False)
+    shutdown_executor(wait=False)
+
+app = FastAPI(title="MedGemma API", description="Medical imaging and chat API", lifespan=lifespan)
+
+# Chats, report metadata and jobs shared by every worker process
+state = SQLiteStateStore()
 
 # Add CORS middleware to allow frontend connections
 app.add_middleware(
@@ -73,9 +98,12 @@ app.add_middleware(
 # Pydantic models for request/response
 class ChatStartRequest(BaseModel):
     client_name: str
+    user_id: str = DEFAULT_USER
 
 class ChatSendRequest(BaseModel):
+    client_name: str
     message: str
+    user_id: str = DEFAULT_USER
 
 class ReportRequest(BaseModel):
     client_name: str
@@ -93,9 +121,25 @@ class SegmentationResponse(BaseModel):
 class ReportResponse(BaseModel):
     response: str
 
-# Global variables for mock chat state
-last_client: str = ""
-chat_history: List[ChatMessage] = []
+class ReportStatusResponse(BaseModel):
+    client_name: str
+    report_hash: str
+    generated_at: float
+    cached: bool = False
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    stage: Optional[str] = None
+    stages: Dict[str, str] = {}
+    progress: float = 0.0
+    detail: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+def job_response(job):
+    return JobResponse(job_id=job["id"], **{k: v for k, v in job.items() if k in JobResponse.model_fields})
 
 @app.get("/")
 async def root():
@@ -103,7 +147,7 @@ async def root():
     return {
         "message": "MedGemma API",
         "version": "1.0.0",
-        "endpoints": ["/seg", "/report", "/chat/start", "/chat/send"]
+        "endpoints": ["/seg", "/report", "/metrics", "/jobs/seg", "/jobs/report", "/jobs/{job_id}", "/mri/{patient}/{scan}/{layer}/{slice}.jpg", "/mri/{patient}/{scan}/{layer}/sheet", "/chat/start", "/chat/send", "/chat/start/stream", "/chat/send/stream"]
     }
 
 # Generate Segmentations
@@ -187,103 +231,629 @@ async def generate_report(request: ReportRequest):
         
         # print("Segmentation and extraction completed successfully!")
 
-    # Generate the report
+    # Generate the report (metrics, HTML and PDF) in the report worker pool
     print(f"Generating report for client: {client_name}")
-    info_json = generate_client_report(client_name)
-    save_json(info_json)
-    html_content = generate_html(info_json)
-    save_html(html_content)
-    save_pdf(html_content)
+    _, snapshot = await run_blocking("report", call_with_metrics, build_report, client_name)
+    REGISTRY.merge(snapshot)
+    await run_blocking("storage", record_report, client_name)
+    schedule_greeting(client_name)
 
     return ReportResponse(
         response=f"Report generated for client: {client_name}"
     )
 
-last_client = ""
-chat_history = []
-gemma_model = None
-gemma_chat = None
+def record_report(client_name, cached=False):
+    """Store which report a client now has, for every worker (blocking)"""
+    state.save_report_meta(client_name, {
+        "report_hash": report_hash(load_client_report(client_name)),
+        "generated_at": time.time(),
+        "cached": cached,
+    })
+
+def load_client_report(client_name):
+    """Report information of a client, which its chats are grounded on (blocking)"""
+    return load_json(client_report_folder(client_name))
+
+async def client_report(client_name):
+    """Report information of a client, 404 when the client has no report yet"""
+    try:
+        return await run_blocking("storage", load_client_report, client_name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No report for client: {client_name}")
+
+@app.get("/report/{client_name}", response_model=ReportStatusResponse)
+async def get_report_status(client_name: str):
+    """
+    Report status
+    Input: client name
+    Output: hash and generation time of the current report of the client
+    """
+    meta = await run_blocking("storage", state.load_report_meta, client_name)
+    if meta is None:
+        raise HTTPException(status_code=404, detail=f"No report for client: {client_name}")
+    return ReportStatusResponse(client_name=client_name, **meta)
+
+# Background jobs ##################
+def run_seg_job(ctx):
+    """Segment both MRIs on the remote nnU-Net endpoint (segmentation pool), then extract the slices"""
+    for id in ("0", "1"):
+        ctx.stage("upload", f"MRI {id}")
+        with SEGMENTATION_SECONDS.time():
+            success = get_pool("segmentation").submit(
+                run_segmentation, id, on_stage=lambda stage: ctx.stage(stage, f"MRI {id}")
+            ).result()
+        if not success:
+            raise RuntimeError(f"Segmentation failed for ID {id}")
+
+    ctx.stage("slicing")
+    from front.public.mri.slice import extract_files
+    if not extract_files():
+        raise RuntimeError("File extraction failed")
+
+    return {"response": "Segmentation and extraction completed successfully."}
+
+def run_in_report_pool(fn, *args):
+    """Run fn in the report process pool (from a job thread) and keep the metrics it recorded"""
+    result, snapshot = get_pool("report").submit(call_with_metrics, fn, *args).result()
+    REGISTRY.merge(snapshot)
+    return result
+
+def run_report_job(ctx):
+    """Compute the metrics, then render the report, in the report process pool"""
+    client_name = ctx.params["client_name"]
+
+    ctx.stage("metrics")
+    # Key of the inputs before they are read, so a report is never cached under newer inputs
+    key = report_cache_key(client_name)
+    if restore_cached_report(client_name, key) is not None:
+        record_report(client_name, cached=True)
+        get_pool("llm").submit(prepare_greeting, client_name)
+        return {"response": f"Report generated for client: {client_name}", "cached": True}
+    info_json = run_in_report_pool(generate_client_report, client_name)
+
+    ctx.stage("render")
+    run_in_report_pool(render_report, info_json, client_report_folder(client_name))
+    cache_report(client_name, key)
+    record_report(client_name)
+    get_pool("llm").submit(prepare_greeting, client_name)
+
+    return {"response": f"Report generated for client: {client_name}"}
+
+jobs = JobQueue({"seg": run_seg_job, "report": run_report_job}, store=state)
+
+@app.post("/jobs/seg", response_model=JobResponse)
+async def submit_segmentation_job():
+    """
+    Queue the segmentation of the MRIs
+    Output: the job (poll GET /jobs/{job_id} for progress)
+    """
+    return job_response(jobs.submit("seg"))
+
+@app.post("/jobs/report", response_model=JobResponse)
+async def submit_report_job(request: ReportRequest):
+    """
+    Queue the report generation of a client
+    Input: client name
+    Output: the job (poll GET /jobs/{job_id} for progress)
+    """
+    return job_response(jobs.submit("report", client_name=request.client_name))
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    Job status
+    Output: status, current stage and progress of the job
+    """
+    job = await run_blocking("storage", jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job_response(job)
+
+# Vertex AI ##################
+rag_tool = None
+vertex_warmup = None # asyncio.Task running init_vertex
+_vertex_lock = threading.Lock()
+
+def init_vertex():
+    """Initialise Vertex AI and the RAG retrieval tool (blocking, runs once)"""
+    global rag_tool
+    with _vertex_lock:
+        if rag_tool is not None:
+            return
+        import vertexai
+        from vertexai.generative_models import Tool
+        from vertexai import rag
+
+        vertexai.init(project=PROJECT_ID, location=REGION)
+
+        # 1. Create a RAG retrieval tool.
+        # This tool connects to your RAG Corpus and handles the search.
+        # The model will call this tool automatically when it needs external knowledge.
+        rag_tool = Tool.from_retrieval(
+            retrieval=rag.Retrieval(
+                source=rag.VertexRagStore(
+                    rag_resources=[
+                        rag.RagResource(rag_corpus=RAG_CORPUS),
+                    ],
+                )
+            )
+        )
+        print("Vertex AI initialised.")
+
+def start_vertex_warmup():
+    """Start init_vertex in the background (the server does not wait for it)"""
+    global vertex_warmup
+    vertex_warmup = asyncio.get_running_loop().create_task(run_blocking("llm", init_vertex))
+    return vertex_warmup
+
+async def ensure_vertex():
+    """Wait for the Vertex AI warm-up, retrying it if it failed"""
+    if vertex_warmup is None or (vertex_warmup.done() and vertex_warmup.exception() is not None):
+        start_vertex_warmup()
+    await asyncio.shield(vertex_warmup)
+
+# Chat models and greetings ##################
+CHAT_MODEL_CACHE_SIZE = 16 # Number of (client, report) models kept
+chat_models = OrderedDict()
+_chat_models_lock = threading.Lock()
+greetings = GreetingCache()
+greeting_tasks = set() # Keeps a reference to the background greeting tasks
+
+def get_gemma_model(client_name, json_data, digest):
+    """
+    Return the MedGemma model of a (client, report): the system prompt followed by the report.
+    Every session on the same report shares this prefix instead of resending the report as a message.
+    """
+    key = (client_name, digest)
+    with _chat_models_lock:
+        model = chat_models.get(key)
+        if model is not None:
+            chat_models.move_to_end(key)
+            return model
+
+    from vertexai.generative_models import GenerativeModel
+    model = GenerativeModel(
+        model_name=MEDGEMMA_ENDPOINT,
+        system_instruction=SYSTEM_PROMPT_CHAT + REPORT_CONTEXT.format(client_name=client_name, json_data=json_data),
+        tools=[rag_tool],
+    )
+    with _chat_models_lock:
+        chat_models[key] = model
+        while len(chat_models) > CHAT_MODEL_CACHE_SIZE:
+            chat_models.popitem(last=False)
+    return model
+
+def start_chat_from(model, turns):
+    """Start a chat on model whose history is the given (role, text) turns"""
+    from vertexai.generative_models import Content, Part
+    history = [Content(role=role, parts=[Part.from_text(text)]) for role, text in turns]
+    return model.start_chat(history=history)
+
+def new_session(client_name, user_id, json_data, digest, greeting):
+    """Session whose chat already holds the first message and its (cached) greeting"""
+    model = get_gemma_model(client_name, json_data, digest)
+    turns = [("user", FIRST_USER_MESSAGE.format(client_name=client_name)), ("model", greeting)]
+    session = ChatSession(client_name, user_id, start_chat_from(model, turns), report_hash=digest, model=model)
+    session.history.append(ChatMessage(role="assistant", content=greeting))
+    return session
+
+def generate_greeting(client_name, json_data, digest):
+    """Ask MedGemma for the greeting of a (client, report) and cache it (blocking)"""
+    chat = get_gemma_model(client_name, json_data, digest).start_chat()
+    with LLM_CALL_SECONDS.time(call="first_message", rag="false"):
+        response = chat.send_message(FIRST_USER_MESSAGE.format(client_name=client_name), tools=[])
+    greetings.put(client_name, digest, response.text)
+    return response.text
+
+def prepare_greeting(client_name):
+    """Generate the greeting of the current report in the background, unless it is cached (blocking)"""
+    try:
+        init_vertex()
+        json_data = load_client_report(client_name)
+        digest = report_hash(json_data)
+        if greetings.get(client_name, digest) is None:
+            generate_greeting(client_name, json_data, digest)
+            print(f"Greeting ready for client: {client_name}")
+    except Exception as e:
+        print(f"Error preparing greeting for {client_name}: {e}")
+
+def schedule_greeting(client_name):
+    """Run prepare_greeting on the llm pool without waiting for it"""
+    task = asyncio.get_running_loop().create_task(run_blocking("llm", prepare_greeting, client_name))
+    greeting_tasks.add(task)
+    task.add_done_callback(greeting_tasks.discard)
+
+# Chat sessions, one per (patient, user): stored in the shared state, with the
+# Vertex chat objects of this worker kept warm in `sessions`
+sessions = SessionStore()
+compaction_tasks = set() # Keeps a reference to the background compactions
+
+def summarize(session, messages):
+    """Fold messages into the session summary with MedGemma (blocking)"""
+    chat = session.model.start_chat()
+    with LLM_CALL_SECONDS.time(call="summary", rag="false"):
+        response = chat.send_message(summary_prompt(session.summary, messages), tools=[])
+    return response.text.strip()
+
+async def compact_session(session):
+    """
+    Keep the context of a session under its token budget: fold the older turns into
+    the rolling summary and restart the Vertex chat on summary + recent turns.
+    """
+    async with session.lock:
+        if session.model is None or not needs_compaction(session):
+            return
+        keep_from = compaction_split(session)
+        if keep_from <= session.summarized_upto:
+            return
+        try:
+            summary = await run_blocking("llm", summarize, session, session.history[session.summarized_upto:keep_from])
+        except Exception as e:
+            print(f"Error summarizing chat of {session.client_name}: {e}")
+            return
+        session.summary = summary
+        session.summarized_upto = keep_from
+        turns = chat_history(FIRST_USER_MESSAGE.format(client_name=session.client_name), session)
+        session.chat = start_chat_from(session.model, turns)
+        await run_blocking("storage", save_session, session)
+
+def schedule_compaction(session):
+    """Run compact_session after the answer was returned, so it does not delay the turn"""
+    if not needs_compaction(session):
+        return
+    task = asyncio.get_running_loop().create_task(compact_session(session))
+    compaction_tasks.add(task)
+    task.add_done_callback(compaction_tasks.discard)
+
+def save_session(session):
+    """
+    Store the session in the shared state so any worker can continue it (blocking).
+    If another worker saved the chat since it was loaded here, its state is reloaded and
+    the turns of this worker are applied on top of it, so no turn is lost.
+    """
+    while True:
+        try:
+            session.version = state.save_chat(session.client_name, session.user_id, {
+                "report_hash": session.report_hash,
+                "history": [m.model_dump() for m in session.history],
+                "summary": session.summary,
+                "summarized_upto": session.summarized_upto,
+            }, session.version)
+            session.saved_turns = len(session.history)
+            return
+        except ChatConflict:
+            merge_stored_session(session)
+
+def merge_stored_session(session):
+    """Rebase the unsaved turns of session on the chat currently stored (blocking)"""
+    saved = state.load_chat(session.client_name, session.user_id)
+    if saved is None:
+        # Deleted meanwhile: store this session as a new chat
+        session.version = 0
+        return
+    saved_state, version = saved
+    # A new session that lost the race to create the chat adopts the stored one
+    new_turns = session.history[session.saved_turns:] if session.version else []
+    session.history = [ChatMessage(**m) for m in saved_state["history"]] + new_turns
+    session.summary = saved_state["summary"]
+    session.summarized_upto = saved_state["summarized_upto"]
+    session.version = version
+    session.saved_turns = len(saved_state["history"])
+    session.chat = start_chat_from(session.model, chat_history(FIRST_USER_MESSAGE.format(client_name=session.client_name), session))
+
+def restore_session(client_name, user_id, json_data, saved, version):
+    """Rebuild a stored session, and its Vertex chat, on this worker"""
+    model = get_gemma_model(client_name, json_data, saved["report_hash"])
+    session = ChatSession(client_name, user_id, None, report_hash=saved["report_hash"], model=model)
+    session.history = [ChatMessage(**m) for m in saved["history"]]
+    session.summary = saved["summary"]
+    session.summarized_upto = saved["summarized_upto"]
+    session.chat = start_chat_from(model, chat_history(FIRST_USER_MESSAGE.format(client_name=client_name), session))
+    session.version = version
+    session.saved_turns = len(session.history)
+    return session
+
+async def current_session(client_name, user_id, digest=None):
+    """
+    Session of (client, user) from the shared state, unless it was started on another report.
+    The warm session of this worker is reused while no other worker changed it.
+    """
+    saved = await run_blocking("storage", state.load_chat, client_name, user_id)
+    if saved is None:
+        sessions.remove(client_name, user_id)
+        return None
+    saved_state, version = saved
+
+    session = sessions.get(client_name, user_id)
+    if session is not None and session.version == version:
+        if digest is None or digest == session.report_hash:
+            return session
+    else:
+        # Started or continued on another worker (or before a restart): rebuild the chat here
+        json_data = await client_report(client_name)
+        if saved_state["report_hash"] == (digest or report_hash(json_data)):
+            await ensure_vertex()
+            return sessions.put(restore_session(client_name, user_id, json_data, saved_state, version))
+
+    # Started on a previous report
+    sessions.remove(client_name, user_id)
+    await run_blocking("storage", state.delete_chat, client_name, user_id)
+    return None
+
+def send_turn(session, content, tools, call="chat"):
+    """Blocking chat turn (runs in the llm pool): returns the assistant ChatMessage"""
+    with LLM_CALL_SECONDS.time(call=call, rag=str(bool(tools)).lower()):
+        response = session.chat.send_message(content, tools=tools)
+    msg_content = response.text # cite_json_like(response.text)
+    # print(response)
+    # with open("dumpresp.txt", "w") as f:
+    #     f.write(str(response))
+    return ChatMessage(role="assistant", content=msg_content)
 
 @app.post("/chat/start", response_model=ChatResponse)
 async def start_chat(request: ChatStartRequest):
     """
     Start chat session
-    Input: client name
+    Input: client name (and optional user id)
     Output: all chat messages for this client
     """
-    global last_client, chat_history, gemma_model, gemma_chat, rag_tool, SYSTEM_PROMPT_CHAT, FIRST_USER_MESSAGE
-    
     client_name = request.client_name
-    
-    if client_name != last_client:
-        chat_history = []
-        last_client = client_name
-        json_data = load_json()
-        
-        gemma_model = GenerativeModel(
-            model_name=MEDGEMMA_ENDPOINT,
-            system_instruction=SYSTEM_PROMPT_CHAT,
-            tools=[rag_tool],
-        )
-        gemma_chat = gemma_model.start_chat()
+    json_data = await client_report(client_name)
+    digest = report_hash(json_data)
 
-        initial_message = ChatMessage(
-            role="user",
-            content=FIRST_USER_MESSAGE.format(client_name=client_name, json_data=json_data)
-        )
-        response = gemma_chat.send_message(initial_message.content, tools=[])
+    session = await current_session(client_name, request.user_id, digest)
+    if session is None:
+        await ensure_vertex()
+        # Greeting precomputed after /report: no LLM round trip
+        greeting = await run_blocking("storage", greetings.get, client_name, digest)
+        if greeting is None:
+            greeting = await run_blocking("llm", generate_greeting, client_name, json_data, digest)
 
-        chat_history.append(ChatMessage(role="assistant", content=response.text))
-    
-    return ChatResponse(messages=chat_history)
+        session = new_session(client_name, request.user_id, json_data, digest, greeting)
+        await run_blocking("storage", save_session, session)
+        sessions.put(session)
+
+    return ChatResponse(messages=session.history)
 
 @app.post("/chat/send", response_model=ChatMessage)
 async def send_chat_message(request: ChatSendRequest):
     """
     Send message in chat
-    Input: message
+    Input: client name, message (and optional user id)
     Output: new response (updated chat history)
     """
-    global chat_history, gemma_chat, gemma_model, rag_tool
-    
-    if not gemma_chat:
+    session = await current_session(request.client_name, request.user_id)
+    if session is None:
         return ChatMessage(
             role="assistant",
             content="There was an error. Please start a new chat session."
         )
 
-    # Add user message to history
+    # The user message is added to the history with the answer, so a failed turn leaves no orphan
     user_message = ChatMessage(role="user", content=request.message)
-    chat_history.append(user_message)
-    
-    response = gemma_chat.send_message(
-        user_message.content, tools=[rag_tool]
-    )
-    msg_content = response.text # cite_json_like(response.text)
-    message = ChatMessage(role="assistant", content=msg_content)
-    # print(response)
-    # with open("dumpresp.txt", "w") as f:
-    #     f.write(str(response))
-    chat_history.append(message)
+    async with session.lock:
+        message = await run_blocking("llm", send_turn, session, user_message.content, [rag_tool])
+        session.history.extend([user_message, message])
+        await run_blocking("storage", save_session, session)
+    schedule_compaction(session)
 
     return message
 
-if __name__ == "__main__":
-    import uvicorn
+@app.get("/chat/history", response_model=ChatResponse)
+async def get_chat_history(client_name: str, user_id: str = DEFAULT_USER):
+    """
+    Chat history, as stored in the shared state (no LLM call)
+    Input: client name (and optional user id)
+    Output: all chat messages for this client
+    """
+    saved = await run_blocking("storage", state.load_chat, client_name, user_id)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="No chat session. Please start a new chat session.")
+    return ChatResponse(messages=saved[0]["history"])
+
+# Streaming (Server-Sent Events) ##################
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def chunk_text(chunk):
+    """Text of a streamed chunk ('' for chunks carrying only tool calls or metadata)"""
+    try:
+        return chunk.text
+    except (ValueError, AttributeError):
+        return ""
+
+async def stream_reply(session, content, tools, on_done=None, user_message=None):
+    """
+    Send a message on the session chat with stream=True and forward the tokens as SSE.
+    Each blocking read of the Vertex stream runs in the llm pool.
+    user_message (the ChatMessage of content, if it is kept in the history) and the
+    answer are only appended once the stream completed, so a failed stream leaves no trace.
+    on_done(session) is called once the full message has been stored.
+
+    Events:
+        token: {"content": <text delta>}
+        done:  the final ChatMessage, also appended to the session history
+        error: {"detail": <error message>}
+    """
+    labels = {"call": "stream", "rag": str(bool(tools)).lower()}
+    async with session.lock:
+        parts = []
+        start = time.perf_counter()
+        try:
+            stream = await run_blocking("llm", session.chat.send_message, content, tools=tools, stream=True)
+            while True:
+                chunk = await run_blocking("llm", next, stream, None)
+                if chunk is None:
+                    break
+                text = chunk_text(chunk)
+                if text:
+                    if not parts:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, **labels)
+                    parts.append(text)
+                    yield sse_event("token", {"content": text})
+            LLM_CALL_SECONDS.observe(time.perf_counter() - start, **labels)
+        except Exception as e:
+            print(f"Error while streaming chat response: {e}")
+            yield sse_event("error", {"detail": str(e)})
+            return
+
+        message = ChatMessage(role="assistant", content="".join(parts))
+        if user_message is not None:
+            session.history.append(user_message)
+        session.history.append(message)
+        await run_blocking("storage", save_session, session)
+    if on_done is not None:
+        on_done(session)
+    schedule_compaction(session)
+    yield sse_event("done", message.model_dump())
+
+@app.post("/chat/start/stream")
+async def start_chat_stream(request: ChatStartRequest):
+    """
+    Start chat session, streaming the first assistant message
+    Input: client name (and optional user id)
+    Output: SSE stream ("history" event with the stored messages when the session already exists)
+    """
+    client_name = request.client_name
+    json_data = await client_report(client_name)
+    digest = report_hash(json_data)
 
-    vertexai.init(project=PROJECT_ID, location=REGION)
-
-    # 1. Create a RAG retrieval tool.
-    # This tool connects to your RAG Corpus and handles the search.
-    # The model will call this tool automatically when it needs external knowledge.
-    rag_tool = Tool.from_retrieval(
-        retrieval=rag.Retrieval(
-            source=rag.VertexRagStore(
-                rag_resources=[
-                    rag.RagResource(rag_corpus=RAG_CORPUS),
-                ],
-            )
-        )
+    def replay(session):
+        yield sse_event("history", {"messages": [m.model_dump() for m in session.history]})
+
+    session = await current_session(client_name, request.user_id, digest)
+    if session is not None:
+        return StreamingResponse(replay(session), media_type="text/event-stream")
+
+    await ensure_vertex()
+    greeting = await run_blocking("storage", greetings.get, client_name, digest)
+    if greeting is not None:
+        session = new_session(client_name, request.user_id, json_data, digest, greeting)
+        await run_blocking("storage", save_session, session)
+        sessions.put(session)
+        return StreamingResponse(replay(session), media_type="text/event-stream")
+
+    def on_done(session):
+        greetings.put(client_name, digest, session.history[0].content)
+        sessions.put(session)
+
+    model = get_gemma_model(client_name, json_data, digest)
+    session = ChatSession(client_name, request.user_id, model.start_chat(), report_hash=digest, model=model)
+    content = FIRST_USER_MESSAGE.format(client_name=client_name)
+
+    return StreamingResponse(stream_reply(session, content, tools=[], on_done=on_done), media_type="text/event-stream")
+
+@app.post("/chat/send/stream")
+async def send_chat_message_stream(request: ChatSendRequest):
+    """
+    Send message in chat, streaming the answer
+    Input: client name, message (and optional user id)
+    Output: SSE stream of tokens, then the final message
+    """
+    session = await current_session(request.client_name, request.user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="No chat session. Please start a new chat session.")
+
+    user_message = ChatMessage(role="user", content=request.message)
+    return StreamingResponse(
+        stream_reply(session, user_message.content, tools=[rag_tool], user_message=user_message),
+        media_type="text/event-stream",
+    )
+
+# MRI slices ##################
+# Slices rendered on demand from the memory-mapped scans, encoded bytes kept in an LRU
+slice_renderer = SliceRenderer()
+
+async def cached_image(if_none_match, media_type, key_fn, render_fn, *args):
+    """Rendered image with its ETag (304 when the browser copy is current), 404 for unknown series"""
+    try:
+        key = await run_blocking("storage", key_fn, *args)
+        etag = f'"{key[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": f"private, max-age={SLICE_MAX_AGE}"}
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+        data, _ = await run_blocking("slices", render_fn, *args)
+    except (KeyError, IndexError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@app.get("/mri/{patient}/{scan}/{layer}/{slice}.jpg")
+async def get_slice(patient: str, scan: str, layer: str, slice: int, view: str = "axial", size: Optional[int] = None,
+                    if_none_match: Optional[str] = Header(None)):
+    """
+    One slice of a scan
+    Input: patient, scan id, layer (image, seg or difference), slice index (and view: axial, coronal or
+        sagittal; size: displayed size in pixels, to get the smallest pyramid level at least that large)
+    Output: JPEG (304 when the ETag sent by the browser still matches)
+    """
+    return await cached_image(
+        if_none_match, "image/jpeg", slice_renderer.slice_key, slice_renderer.render,
+        patient, scan, layer, slice, view, size,
     )
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+@app.get("/mri/{patient}/{scan}/{layer}/sheet.json")
+async def get_sheet_index(patient: str, scan: str, layer: str, view: str = "axial", size: Optional[int] = None):
+    """
+    Layout of the sprite sheet of a series
+    Input: patient, scan id, layer (and view, size of a slice)
+    Output: slice count, columns, rows, pyramid level, tile size and image format
+    """
+    try:
+        return await run_blocking("slices", slice_renderer.sheet_index, patient, scan, layer, view, size)
+    except (KeyError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/mri/{patient}/{scan}/{layer}/sheet")
+async def get_sheet(patient: str, scan: str, layer: str, view: str = "axial", size: Optional[int] = None,
+                    if_none_match: Optional[str] = Header(None)):
+    """
+    Every slice of a series in one image (grid of sheet.json)
+    Input: patient, scan id, layer (and view, size of a slice)
+    Output: WebP sprite sheet (304 when the ETag sent by the browser still matches)
+    """
+    return await cached_image(
+        if_none_match, MEDIA_TYPES[SHEET_FORMAT], slice_renderer.sheet_key, slice_renderer.render_sheet,
+        patient, scan, layer, view, size,
+    )
+
+# Metrics ##################
+def job_counts():
+    counts = {(status,): 0 for status in ("queued", "running")}
+    for job in jobs.store.list_jobs((QUEUED, RUNNING)):
+        if (job["status"],) in counts:
+            counts[(job["status"],)] += 1
+    return counts
+
+REGISTRY.register(Gauge(
+    "medgemma_jobs", "Background jobs waiting or running",
+    labels=("status",), callback=job_counts,
+))
+REGISTRY.register(Gauge(
+    "medgemma_pool_pending_tasks", "Tasks waiting for a worker, per service pool",
+    labels=("service",), callback=lambda: {(service,): n for service, n in pending_work().items()},
+))
+REGISTRY.register(Gauge(
+    "medgemma_chat_sessions", "Warm chat sessions of this worker",
+    callback=lambda: {(): len(sessions)},
+))
+REGISTRY.register(Gauge(
+    "medgemma_slice_cache_bytes", "Encoded slices kept in memory by this worker",
+    callback=lambda: {(): slice_renderer.cache.size},
+))
+REGISTRY.register(Gauge(
+    "medgemma_stored_chat_sessions", "Chat sessions in the shared state store",
+    callback=lambda: {(): state.count_chats()},
+))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms, cache counters and queue depths in the Prometheus text format"""
+    content = await run_blocking("storage", REGISTRY.render)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Several workers need the app as an import string
+    uvicorn.run("back:app", host="0.0.0.0", port=8000, workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,145 @@
+'''
+Content-addressed cache of report artifacts (report.json, report.html, report.pdf).
+Entries are written to a unique temporary folder and published (or evicted) with a
+single rename, so readers in any process see a complete entry or none.
+'''
+# Dependencies
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+# --- Configuration ---
+REPORT_CACHE_FOLDER = "./cache/reports"
+REPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Size cap of the cache, least recently used entries are evicted above it
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# (path, size, mtime) -> digest, so unchanged files are not read again
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    '''
+    SHA-256 of a file content (memoised on path, size and modification time).
+    '''
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+    if digest is not None:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def cache_key(*parts, files=()):
+    '''
+    Key of a cache entry: hash of the given parts (e.g. pipeline version, client name)
+    and of the content of the given files.
+    '''
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(str(part).encode("utf-8"))
+        sha.update(b"\0")
+    for path in files:
+        sha.update(file_digest(path).encode("ascii"))
+    return sha.hexdigest()
+
+
+class ArtifactCache:
+    '''
+    Directory of cache entries, one sub folder per key holding the artifact files.
+    Entries are evicted least recently used first once the cache is above max_bytes.
+
+    Args:
+        folder (str): Root folder of the cache
+        max_bytes (int): Size cap of the cache
+    '''
+
+    def __init__(self, folder=REPORT_CACHE_FOLDER, max_bytes=REPORT_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.folder, key)
+
+    def restore(self, key, names, destination):
+        '''
+        Copy the artifacts of an entry to destination.
+
+        Returns:
+            bool: True on a hit, False if the entry (or one of its files) is missing
+        '''
+        entry = self._entry(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in names):
+            return False
+        os.makedirs(destination, exist_ok=True)
+        try:
+            for name in names:
+                # Each file is replaced in one step, so destination never holds a partial copy
+                tmp_path = os.path.join(destination, f".{name}.{uuid.uuid4().hex}.tmp")
+                shutil.copyfile(os.path.join(entry, name), tmp_path)
+                os.replace(tmp_path, os.path.join(destination, name))
+            # Last access time used for LRU eviction
+            os.utime(entry)
+        except FileNotFoundError:
+            # Evicted while being read
+            return False
+        return True
+
+    def store(self, key, names, source):
+        '''
+        Copy the artifacts from source into a new entry, then evict old entries.
+        An entry already stored under the same key (same content) is kept as is.
+        '''
+        entry = self._entry(key)
+        tmp_entry = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.folder)
+        for name in names:
+            shutil.copyfile(os.path.join(source, name), os.path.join(tmp_entry, name))
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Published meanwhile by another worker
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            os.utime(entry)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for key in os.listdir(self.folder):
+            entry = self._entry(key)
+            if key.endswith(".tmp") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except FileNotFoundError:
+                continue # Evicted by another worker
+            total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # Unpublish in one step, then delete: a reader never finds a half deleted entry
+            doomed = f"{entry}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.rename(entry, doomed)
+            except FileNotFoundError:
+                total -= size # Evicted by another worker
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+            print(f"Evicted report cache entry {os.path.basename(entry)}")
@@ -0,0 +1,121 @@
+'''
+Change map between two segmentations: new and resolved lesion voxels, computed
+once and kept bit-packed per slice (1/8 of a bool volume), with the change
+count of every slice. The report gallery, the viewer and the difference slice
+renderer all read the same map
+'''
+# Dependencies
+import os
+import threading
+
+import numpy as np
+
+# --- Configuration ---
+TOP_CHANGE_SLICES = 6 # Slices of the report gallery
+
+
+class ChangeMap:
+    '''
+    New (lesion at t1 only) and resolved (lesion at t0 only) voxels of two masks.
+
+    Args:
+        shape (tuple): Shape of the masks
+        new, resolved (np.ndarray): (slices, bytes per slice) bit-packed masks (np.packbits of each slice)
+        new_per_slice, resolved_per_slice (np.ndarray): Number of changed voxels in each slice
+    '''
+
+    def __init__(self, shape, new, resolved, new_per_slice, resolved_per_slice):
+        self.shape = tuple(int(n) for n in shape)
+        self.new = new
+        self.resolved = resolved
+        self.new_per_slice = new_per_slice
+        self.resolved_per_slice = resolved_per_slice
+
+    @classmethod
+    def from_masks(cls, mask_t0, mask_t1):
+        '''
+        Change map of two boolean masks (or label volumes, lesion where > 0).
+        '''
+        mask_t0, mask_t1 = np.asarray(mask_t0) > 0, np.asarray(mask_t1) > 0
+        slices = mask_t0.shape[0]
+        new = (mask_t1 & ~mask_t0).reshape(slices, -1)
+        resolved = (mask_t0 & ~mask_t1).reshape(slices, -1)
+        return cls(
+            mask_t0.shape,
+            np.packbits(new, axis=1),
+            np.packbits(resolved, axis=1),
+            np.count_nonzero(new, axis=1),
+            np.count_nonzero(resolved, axis=1),
+        )
+
+    @property
+    def changed_per_slice(self):
+        return self.new_per_slice + self.resolved_per_slice
+
+    def _unpack(self, packed):
+        # Rows of np.packbits (one per slice) back to boolean slices
+        size = int(np.prod(self.shape[1:]))
+        return np.unpackbits(packed, axis=-1, count=size).view(bool).reshape(*packed.shape[:-1], *self.shape[1:])
+
+    def new_mask(self):
+        '''Boolean volume of the new voxels'''
+        return self._unpack(self.new)
+
+    def resolved_mask(self):
+        '''Boolean volume of the resolved voxels'''
+        return self._unpack(self.resolved)
+
+    def new_slice(self, index):
+        '''Boolean mask of the new voxels of one slice'''
+        return self._unpack(self.new[index])
+
+    def resolved_slice(self, index):
+        '''Boolean mask of the resolved voxels of one slice'''
+        return self._unpack(self.resolved[index])
+
+    def top_slices(self, k=TOP_CHANGE_SLICES):
+        '''
+        Slices with the most changed voxels, most changed first (slices without change are left out).
+
+        Returns:
+            list: dicts with slice, new and resolved (voxels)
+        '''
+        changed = self.changed_per_slice
+        # Stable sort: equal counts keep the slice order
+        order = np.argsort(-changed, kind="stable")[:k]
+        return [{"slice": int(i), "new": int(self.new_per_slice[i]), "resolved": int(self.resolved_per_slice[i])}
+                for i in order if changed[i] > 0]
+
+    def biggest_slice(self):
+        '''Index of the slice with the most changed voxels'''
+        return int(np.argmax(self.changed_per_slice))
+
+    def summary(self, k=TOP_CHANGE_SLICES):
+        '''
+        JSON-serialisable per-slice counts and top slices (for the viewer).
+        '''
+        return {
+            "shape": list(self.shape),
+            "new_per_slice": self.new_per_slice.tolist(),
+            "resolved_per_slice": self.resolved_per_slice.tolist(),
+            "top_slices": self.top_slices(k),
+        }
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path, shape=np.array(self.shape), new=self.new, resolved=self.resolved,
+            new_per_slice=self.new_per_slice, resolved_per_slice=self.resolved_per_slice,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Change map saved with save, None when missing or unreadable.
+        '''
+        try:
+            with np.load(path) as data:
+                return cls(data["shape"], data["new"], data["resolved"], data["new_per_slice"], data["resolved_per_slice"])
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
@@ -1,9 +1,13 @@
 # Dependencies
 import re
-from back_get_rag_metadata import get_reference_dict
+from functools import lru_cache
 
 
-CITATION_DICT = get_reference_dict()
+@lru_cache(maxsize=1)
+def get_citation_dict():
+    # Listing the RAG documents hits GCS: done on first use, not at import time
+    from back_get_rag_metadata import get_reference_dict
+    return get_reference_dict()
 
 # Replace source by citation ID in the text, and add citation ID and title at the end
 def cite_json_like(response):
@@ -25,8 +29,9 @@ def cite_json_like(response):
     body = re.sub(pattern, repl, text)
 
     # 2) build reference block
+    citation_dict = get_citation_dict()
     refs = [
-        f'[{n}] {CITATION_DICT.get(fname, "Unknown title")}'
+        f'[{n}] {citation_dict.get(fname, "Unknown title")}'
         for fname, n in sorted(seen.items(), key=lambda x: x[1])
     ]
 
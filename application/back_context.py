@@ -0,0 +1,85 @@
+'''
+Bounded chat context: older turns are folded into a rolling summary so every
+turn sends about the same number of tokens to MedGemma.
+The report itself stays pinned in the system prompt (see get_gemma_model in back.py).
+'''
+
+# --- Configuration ---
+CONTEXT_TOKEN_BUDGET = 4000 # Tokens of conversation (summary + recent turns) sent with each turn
+COMPACTED_TOKEN_TARGET = 2000 # Tokens of recent turns kept after a compaction
+MIN_RECENT_MESSAGES = 4 # Always keep the last two exchanges verbatim
+CHARS_PER_TOKEN = 4 # Rough estimate, no tokenizer is available for the endpoint
+
+SUMMARY_PROMPT = """You maintain the memory of a conversation between a doctor and a clinical radiology assistant about one patient.
+Merge the previous memory and the new conversation excerpt into an updated memory.
+Keep every clinical fact, question, decision and cited reference; drop greetings and formatting.
+Answer with a short bullet list only.
+
+Previous memory:
+{summary}
+
+New conversation excerpt:
+{excerpt}
+"""
+
+MEMORY_MESSAGE = """Memory of our earlier conversation about this patient:
+{summary}"""
+
+MEMORY_ACK = "Understood, I will take this earlier conversation into account."
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def context_tokens(session):
+    '''
+    Tokens sent with the next turn: the summary plus the messages not folded into it.
+    '''
+    recent = session.history[session.summarized_upto:]
+    return estimate_tokens(session.summary) + sum(estimate_tokens(m.content) for m in recent)
+
+
+def needs_compaction(session):
+    return context_tokens(session) > CONTEXT_TOKEN_BUDGET
+
+
+def compaction_split(session):
+    '''
+    Index of the first message kept verbatim after a compaction.
+    Messages between session.summarized_upto and this index are folded into the summary.
+    The split always lands on a user message so exchanges are not cut in half.
+    '''
+    history = session.history
+    keep_from = len(history)
+    kept_tokens = 0
+    # Walk back from the newest message while under the target
+    for i in range(len(history) - 1, session.summarized_upto - 1, -1):
+        kept_tokens += estimate_tokens(history[i].content)
+        kept = len(history) - i
+        if kept > MIN_RECENT_MESSAGES and kept_tokens > COMPACTED_TOKEN_TARGET:
+            break
+        keep_from = i
+    while keep_from < len(history) and history[keep_from].role != "user":
+        keep_from += 1
+    return max(keep_from, session.summarized_upto)
+
+
+def summary_prompt(summary, messages):
+    excerpt = "\n".join(f"{m.role.upper()}: {m.content}" for m in messages)
+    return SUMMARY_PROMPT.format(summary=summary or "(empty)", excerpt=excerpt)
+
+
+def chat_history(first_message, session):
+    '''
+    (role, text) pairs to start a Vertex chat with: the pinned first exchange,
+    the memory block, then the recent messages.
+    '''
+    # history[0] is the greeting, answer to the first message
+    turns = [("user", first_message), ("model", session.history[0].content)]
+    if session.summary:
+        turns.append(("user", MEMORY_MESSAGE.format(summary=session.summary)))
+        turns.append(("model", MEMORY_ACK))
+    for message in session.history[max(session.summarized_upto, 1):]:
+        turns.append(("user" if message.role == "user" else "model", message.content))
+    return turns
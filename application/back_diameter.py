@@ -0,0 +1,63 @@
+'''
+Exact maximum (Feret) diameter of a lesion: the largest distance between two
+points of the lesion, in physical spacing.
+Only the boundary voxels can be the ends of that segment, and only the vertices
+of their convex hull, so the pairwise distances are taken on a few hundred points
+instead of the whole lesion.
+'''
+# Dependencies
+import numpy as np
+# scipy is imported on first use (fast server startup)
+
+# Corners of a voxel around its center, in voxel units
+VOXEL_CORNERS = np.array([[dz, dy, dx] for dz in (-0.5, 0.5) for dy in (-0.5, 0.5) for dx in (-0.5, 0.5)])
+
+
+def boundary_voxels(lesion):
+    '''
+    Coordinates (voxels) of the lesion voxels that touch the background.
+
+    Args:
+        lesion (np.ndarray): Boolean mask of one lesion (e.g. its padded bounding box)
+    Returns:
+        np.ndarray: (n, 3) voxel coordinates
+    '''
+    from scipy.ndimage import binary_erosion
+    interior = binary_erosion(lesion, border_value=0)
+    return np.argwhere(lesion & ~interior)
+
+
+def hull_points(points):
+    '''
+    Vertices of the convex hull of points (all the points when they are coplanar
+    or too few for a hull).
+    '''
+    from scipy.spatial import ConvexHull, QhullError
+    if len(points) < 5:
+        return points
+    try:
+        return points[ConvexHull(points).vertices]
+    except QhullError:
+        # Flat lesion (one slice thick, or a line): no 3D hull
+        return points
+
+
+def feret_diameter(lesion, spacing=(1.0, 1.0, 1.0)):
+    '''
+    Maximum extent of a lesion (mm), measured between the outer corners of its voxels.
+
+    Args:
+        lesion (np.ndarray): Boolean mask of one lesion
+        spacing (tuple): Voxel size (mm) along each axis
+    Returns:
+        float: Feret diameter (mm), 0.0 for an empty mask
+    '''
+    from scipy.spatial.distance import pdist
+    voxels = boundary_voxels(lesion)
+    if len(voxels) == 0:
+        return 0.0
+    # For any pair of corner offsets the farthest voxel centers are hull vertices,
+    # so the corners of the hull vertices are enough
+    centers = hull_points(voxels.astype(float))
+    corners = (centers[:, None, :] + VOXEL_CORNERS[None, :, :]).reshape(-1, 3) * np.asarray(spacing)
+    return float(pdist(hull_points(corners)).max())
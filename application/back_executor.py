@@ -0,0 +1,92 @@
+'''
+Execution layer: runs the blocking work of the API (Vertex calls, segmentation,
+report rendering) on bounded pools so the FastAPI event loop stays free
+'''
+# Dependencies
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- Configuration ---
+# Maximum number of concurrent calls per downstream service
+SERVICE_LIMITS = {
+    "llm": 8,           # MedGemma chat / RAG calls (network bound)
+    "segmentation": 2,  # Remote nnU-Net segmentation and slice extraction
+    "storage": 4,       # GCS and local file I/O
+    "report": 2,        # Metrics, HTML and PDF rendering (CPU bound)
+    "slices": 4,        # On-demand slice rendering (numpy and JPEG encoding release the GIL)
+}
+# Services whose work is CPU bound and therefore runs in separate processes
+PROCESS_SERVICES = {"report"}
+
+_pools = {}
+_pools_lock = threading.Lock() # Pools are created lazily from the event loop and from job threads
+
+
+def get_pool(service):
+    '''
+    Return the pool of a service, creating it on first use.
+    Each service has its own pool so a busy one can not starve the others.
+    '''
+    if service not in SERVICE_LIMITS:
+        raise ValueError(f"Unknown service: {service}")
+
+    pool = _pools.get(service)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(service)
+        if pool is None:
+            if service in PROCESS_SERVICES:
+                # spawn: forking the threaded server process is unsafe
+                pool = ProcessPoolExecutor(
+                    max_workers=SERVICE_LIMITS[service],
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                pool = ThreadPoolExecutor(
+                    max_workers=SERVICE_LIMITS[service],
+                    thread_name_prefix=f"{service}-worker",
+                )
+            _pools[service] = pool
+    return pool
+
+
+async def run_blocking(service, fn, *args, **kwargs):
+    '''
+    Run fn(*args, **kwargs) on the pool of the given service and await its result.
+
+    Args:
+        service (str): One of SERVICE_LIMITS (e.g. "llm", "report")
+        fn (callable): Blocking function. Must be picklable (module level) for process services.
+    Returns:
+        The return value of fn
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(service), functools.partial(fn, *args, **kwargs))
+
+
+def pending_work():
+    '''
+    Number of tasks waiting for a worker, per started pool.
+    '''
+    pending = {}
+    for service, pool in _pools.items():
+        if isinstance(pool, ThreadPoolExecutor):
+            pending[service] = pool._work_queue.qsize()
+        else:
+            pending[service] = len(pool._pending_work_items)
+    return pending
+
+
+def shutdown(wait=True):
+    '''
+    Shut every pool down (called when the server stops).
+    '''
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait, cancel_futures=not wait)
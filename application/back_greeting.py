@@ -0,0 +1,63 @@
+'''
+Chat greetings precomputed per (patient, report), so /chat/start does not wait on the LLM
+'''
+# Dependencies
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# --- Configuration ---
+GREETING_CACHE_FOLDER = "./cache/greetings"
+
+
+def report_hash(json_data):
+    '''
+    Stable hash of the report information a chat is grounded on.
+    '''
+    return hashlib.sha256(json.dumps(json_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class GreetingCache:
+    '''
+    Greeting of each (client_name, report hash), kept in memory and on disk.
+
+    Args:
+        folder (str): Folder holding one JSON file per greeting
+    '''
+
+    def __init__(self, folder=GREETING_CACHE_FOLDER):
+        self.folder = folder
+        self._greetings = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, client_name, digest):
+        name = hashlib.sha256(f"{client_name}\0{digest}".encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, f"{name}.json")
+
+    def get(self, client_name, digest):
+        with self._lock:
+            greeting = self._greetings.get((client_name, digest))
+        if greeting is not None:
+            return greeting
+
+        try:
+            with open(self._path(client_name, digest), "r") as f:
+                greeting = json.load(f)["greeting"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        with self._lock:
+            self._greetings[(client_name, digest)] = greeting
+        return greeting
+
+    def put(self, client_name, digest, greeting):
+        path = self._path(client_name, digest)
+        # Unique temporary file in the same folder, so concurrent writers (threads or workers) never share it
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"client_name": client_name, "report_hash": digest, "greeting": greeting}, f, indent=4)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._greetings[(client_name, digest)] = greeting
@@ -3,31 +3,65 @@ Script to handle analysis of patient IRM and seg
 '''
 # Dependencies
 import base64
-import nibabel as nib
-import numpy as np
-import cv2
-import io
-from PIL import Image
-from google.cloud import aiplatform
 
-from back_environment import PROJECT_ID, REGION, MEDGEMMA_FT_ENDPOINT_ID, MEDGEMMA_FT_ENDPOINT_REGION, MEDGEMMA_ENDPOINT_ID, MEDGEMMA_ENDPOINT_REGION
+from back_localization import LOBE_ATLAS_FILE, atlas_source, localize_lesions
+from back_environment import PROJECT_ID, REGION, MEDGEMMA_FT_ENDPOINT_ID, MEDGEMMA_FT_ENDPOINT_REGION
 
-def run_analysis_location(id):
+# ARIA-E grading thresholds on the size of a site of involvement (cm), adapted from Cogswell et al. (2022)
+MILD_MAX_DIAMETER_CM = 5
+SEVERE_MIN_DIAMETER_CM = 10
 
+def run_analysis_location(id, segmentation=None, atlas_path=LOBE_ATLAS_FILE):
     '''
-    Give the id of the IRM and run the analysis to determine the location of the edema using the MedGemma FineTuned model.
+    Determine the location of the edema: lesion volume per lobe from the lobe atlas, and the
+    MedGemma FineTuned model only when the atlas answer is ambiguous.
     Args:
         id (str): The MRI ID (e.g., "0" or "1")
+        segmentation (str, optional): Segmentation of the MRI (default: ./front/public/mri/{id}.seg/mri_file.nii)
+        atlas_path (str, optional): Lobe atlas in the space of the scans
     Returns:
-        str: The predicted brain region where the edema is located (e.g., "frontal", "occipital", "parietal", "temporal")
+        dict: "lobe", the predicted brain region where the edema is located (e.g., "frontal", "occipital", "parietal",
+            "temporal") or None when the segmentation has no lesion or the location could not be determined,
+            the atlas "fractions" per lobe and the "source" of the answer ("atlas", "geometric_atlas" for the
+            approximate bundled atlas, "medgemma", or "fallback" when neither could locate the lesions)
+    '''
+    segmentation = segmentation or f"./front/public/mri/{id}.seg/mri_file.nii"
+    location = localize_lesions(segmentation, atlas_path)
+    if not location["ambiguous"]:
+        source = atlas_source(atlas_path) if location["lobe"] else "atlas"
+        return dict(location, source=source)
+
+    try:
+        lobe = run_medgemma_location(segmentation)
+    except Exception as e:
+        print(f"MedGemma localization failed: {e}")
+        lobe = None
+    if lobe is not None:
+        return dict(location, lobe=lobe, source="medgemma")
+    if location["lobe"] is not None:
+        # Ambiguous atlas answer, still better than no answer
+        return dict(location, source=atlas_source(atlas_path))
+    return dict(location, lobe=None, source="fallback")
+
+
+def run_medgemma_location(mri_file_path):
+    '''
+    Run the MedGemma FineTuned model on every slice of the MRI and keep the most predicted region.
+    Args:
+        mri_file_path (str): NIfTI file of the MRI
+    Returns:
+        str: The predicted brain region where the edema is located (e.g., "frontal", "occipital", "parietal", "temporal"),
+            None when no slice gave an answer
     '''
-
-    # MOCK FOR DEMO
-    return "frontal"
 
     # Run MedGemma FineTuned on all images
     #          Images in seg are supposed to be pre-processed to already have the segmentations applied
 
+    # Heavy dependencies, imported on first use
+    import cv2
+    from google.cloud import aiplatform
+    from back_volumes import load_image
+
     # INIT PLATFORM AND ENDPOINT
     aiplatform.init(project=PROJECT_ID, location=REGION)
 
@@ -37,12 +71,8 @@ def run_analysis_location(id):
         location=MEDGEMMA_FT_ENDPOINT_REGION,
     )
 
-    # Load MRI data using nibabel and process each slice
-    mri_file_path = f"./front/public/mri/{id}.seg/mri_file.nii"
-    
-    # Load the NIfTI file
-    img = nib.load(mri_file_path)
-    data = img.get_fdata()
+    # Load the NIfTI file (float32)
+    data = load_image(mri_file_path).data
 
     # Prompt 
     BRAIN_CLASSES = [
@@ -91,86 +121,44 @@ def run_analysis_location(id):
 
     # Get the most common prediction across all slices
     if slice_predictions == []:
-        return "frontal"
+        return None
     most_common_prediction = max(set(slice_predictions), key=slice_predictions.count)
     return {"A": "frontal", "B": "occipital", "C": "parietal", "D": "temporal"}[most_common_prediction]
 
 
 
 
-def run_analysis(json_data):
+def grade_severity(diameters_cm):
     '''
-    Run the MedGemma model to analyze the severity of ARIA-E lesions based on the provided JSON data.
+    Grade ARIA-E severity from the maximum (Feret) diameter of each site of involvement.
     Args:
-        json_data (str): JSON string containing the radiology report data.
+        diameters_cm (list): Diameter of each lesion (cm)
     Returns:
-        str: The severity of ARIA-E lesions (MILD, MODERATE, or SEVERE).
+        tuple: (NONE when there is no lesion, MILD, MODERATE or SEVERE, reason)
     '''
+    if not diameters_cm:
+        return "NONE", "The report indicates no site of involvement: no ARIA-E is detected on this scan, so the severity is NONE."
+    sites = len(diameters_cm)
+    largest = max(diameters_cm)
+    if largest > SEVERE_MIN_DIAMETER_CM:
+        decision, rule = "SEVERE", f"at least 1 site of involvement measuring more than {SEVERE_MIN_DIAMETER_CM} cm"
+    elif sites > 1:
+        decision, rule = "MODERATE", f"more than 1 site of involvement where each lesion is less than {SEVERE_MIN_DIAMETER_CM} cm"
+    elif largest >= MILD_MAX_DIAMETER_CM:
+        decision, rule = "MODERATE", f"1 site of involvement measuring {MILD_MAX_DIAMETER_CM}-{SEVERE_MIN_DIAMETER_CM} cm"
+    else:
+        decision, rule = "MILD", f"1 site of involvement measuring less than {MILD_MAX_DIAMETER_CM} cm"
+    return decision, f"The report indicates {sites} site{'s' if sites != 1 else ''} of involvement and a maximum lesion diameter of {largest:.1f} cm. According to the grading criteria, {rule} classifies the severity as {decision}."
 
-    # MOCK FOR DEMO
-    decision = "MILD"
-    return decision, f"The report indicates 6 sites of involvement and a maximum lesion diameter of 1.1 cm. According to the grading criteria, more than 1 site of involvement where each lesion is less than 10 cm classifies the severity as {decision}."
-
-    # Run MedGemma on json_data
-
-    # INIT PLATFORM AND ENDPOINT
-    aiplatform.init(project=PROJECT_ID, location=REGION)
-
-    endpoint = aiplatform.Endpoint(
-        endpoint_name=MEDGEMMA_ENDPOINT_ID,
-        project=PROJECT_ID,
-        location=MEDGEMMA_ENDPOINT_REGION,
-    )
-
-    # Prompt
-    PROMPT = f'''
-    You are a clinical radiology assistant specialized in grading the severity of ARIA-E (Amyloid-Related Imaging Abnormalities – Edema) in patients undergoing anti-amyloid treatment.
-    ARIA-E severity is classified by radiologists based on the number and size of sites of involvement showing vasogenic edema and/or sulcal effusion on FLAIR imaging.
-    Use the following grading criteria:
 
-    MILD
-    • Exactly 1 site of involvement
-    • Lesion size < 5 cm
-
-    MODERATE
-    • 1 site of involvement measuring 5–10 cm
-    OR
-    • More than 1 site of involvement, each < 10 cm
-
-    SEVERE
-    • At least 1 site of involvement measuring > 10 cm
-
-    You may extract information about lesion size or number of sites of involvement from the attached JSON radiology report.
-    
-    Source: Adapted from Cogswell et al. (2022)
-    
-    <start_of_json>
-    {json_data}
-    <end_of_json>
-
-    
-    Always respond with one of the following severity labels, based strictly on the criteria above:
-    MILD, MODERATE, or SEVERE.
-
-    ALWAYS SAY MILD IF THE REPORT DOES NOT MENTION ANY ARIA-E LESIONS.
-
-    Your response should be of the form:
-    DIAGNOSIS  |  REASON
+def run_analysis(json_data):
+    '''
+    Analyze the severity of ARIA-E lesions based on the report data.
+    Args:
+        json_data (dict): Report information, with the Feret diameter of each lesion ("lesion_diameters_t1", cm).
+    Returns:
+        tuple: The severity of ARIA-E lesions (NONE, MILD, MODERATE, or SEVERE) and the reason.
     '''
 
-    # Instance and Message
-    instances = [
-        {
-            "prompt": PROMPT,
-            "max_tokens": 500,
-            "temperature": 0,
-            "raw_response": False,
-        },
-    ]
-
-    # Run Inference
-    response = endpoint.predict(
-        instances=instances, use_dedicated_endpoint=True
-    )
-
-    return response.predictions[0]
\ No newline at end of file
+    # Grade from the measured diameters
+    return grade_severity(json_data.get("lesion_diameters_t1", []))
@@ -0,0 +1,214 @@
+'''
+Background jobs (segmentation, report) with stage-level progress persisted in the
+shared state store, so any server worker can report on a job and only one runs it
+'''
+# Dependencies
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from back_storage import JobLeaseLost, SQLiteStateStore
+
+# --- Configuration ---
+JOB_WORKERS = 4 # Number of jobs processed at the same time
+JOB_LEASE_SECONDS = 60 # A running job whose worker stopped renewing its lease can be taken over
+JOB_HEARTBEAT_SECONDS = 15 # How often a worker renews the leases of its running jobs
+
+# Ordered stages of each kind of job
+JOB_STAGES = {
+    "seg": ["upload", "inference", "download", "slicing"],
+    "report": ["metrics", "render"],
+}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobContext:
+    '''
+    Handed to the job function to report stage progress.
+    '''
+
+    def __init__(self, queue, job):
+        self._queue = queue
+        self.job = job
+
+    @property
+    def params(self):
+        return self.job["params"]
+
+    def stage(self, name, detail=None):
+        '''
+        Mark `name` as the running stage (every stage before it is marked done).
+        '''
+        self._queue._set_stage(self.job, name, detail)
+
+
+class JobQueue:
+    '''
+    Runs registered job functions on a pool of worker threads.
+
+    Args:
+        handlers (dict): kind -> function(ctx) returning a JSON serialisable result
+        store (StateStore): Where job records are persisted (shared by the server workers)
+        workers (int): Number of jobs run concurrently
+        lease_seconds (float): Lease of a claimed job, renewed by the heartbeat
+        heartbeat_seconds (float): Period of the lease renewal and of the scan for abandoned jobs
+    '''
+
+    def __init__(self, handlers, store=None, workers=JOB_WORKERS,
+                 lease_seconds=JOB_LEASE_SECONDS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+        self.handlers = handlers
+        self.store = store or SQLiteStateStore()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._lock = threading.Lock()
+        self._pending = set() # Ids submitted to the pool of this worker and not finished yet
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def submit(self, kind, **params):
+        '''
+        Create a job and queue it. Returns the job record.
+        '''
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "status": QUEUED,
+            "stage": None,
+            "stages": {name: "pending" for name in JOB_STAGES.get(kind, [])},
+            "progress": 0.0,
+            "detail": None,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.save_job(job)
+        self._queue(job["id"])
+        return job
+
+    def get(self, job_id):
+        return self.store.load_job(job_id)
+
+    def queue_depth(self):
+        '''
+        Number of jobs waiting or running (on every worker).
+        '''
+        return len(self.store.list_jobs((QUEUED, RUNNING)))
+
+    def start(self):
+        '''
+        Start the heartbeat (lease renewal and periodic resume) and resume the
+        jobs left behind by stopped workers (called at startup).
+        '''
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_leases, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+        return self.resume()
+
+    def resume(self):
+        '''
+        Queue the jobs left queued, or running with an expired lease (the worker
+        that ran them stopped). Called at startup and on every heartbeat; each
+        worker may try, the claim in _run makes sure only one runs a job.
+        '''
+        resumed = [job_id for job_id in self.store.list_claimable_jobs() if self._queue(job_id)]
+        if resumed:
+            print(f"Resuming {len(resumed)} job(s): {resumed}")
+        return resumed
+
+    def shutdown(self, wait=False):
+        self._stopped.set()
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _queue(self, job_id):
+        # Submit once per worker: a job already waiting in the pool is not queued again by resume
+        with self._lock:
+            if job_id in self._pending:
+                return False
+            self._pending.add(job_id)
+        self._pool.submit(self._run, job_id)
+        return True
+
+    def _renew_leases(self):
+        while not self._stopped.wait(self.heartbeat_seconds):
+            try:
+                self.store.renew_job_leases(self.owner, self.lease_seconds)
+                self.resume()
+            except Exception as e:
+                print(f"Error renewing job leases: {e}")
+
+    def _set_stage(self, job, name, detail=None):
+        with self._lock:
+            stages = job["stages"]
+            if name not in stages:
+                stages[name] = "pending"
+            names = list(stages)
+            for previous in names[:names.index(name)]:
+                stages[previous] = "done"
+            stages[name] = "running"
+            job["stage"] = name
+            job["detail"] = detail
+            job["progress"] = names.index(name) / len(names)
+            self.store.save_job(job, self.owner)
+
+    def _run(self, job_id):
+        try:
+            self._execute(job_id)
+        finally:
+            with self._lock:
+                self._pending.discard(job_id)
+
+    def _execute(self, job_id):
+        # Claim the job so that no other worker runs it at the same time
+        job = self.store.claim_job(job_id, self.owner, self.lease_seconds)
+        if job is None:
+            return
+
+        try:
+            self._attempt(job)
+        except JobLeaseLost:
+            # Lease expired and the job was claimed by another worker: its run wins
+            print(f"Job {job_id} ({job['kind']}) was taken over by another worker, dropping this run")
+
+    def _attempt(self, job):
+        job["attempts"] += 1
+        job["error"] = None
+        job["stages"] = {name: "pending" for name in job["stages"]}
+        self.store.save_job(job, self.owner)
+
+        try:
+            result = self.handlers[job["kind"]](JobContext(self, job))
+        except JobLeaseLost:
+            raise
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            traceback.print_exc()
+            with self._lock:
+                if job["stage"] is not None:
+                    job["stages"][job["stage"]] = "failed"
+                job["status"] = FAILED
+                job["error"] = str(e)
+                self.store.save_job(job, self.owner)
+            return
+
+        with self._lock:
+            job["stages"] = {name: "done" for name in job["stages"]}
+            job["stage"] = None
+            job["detail"] = None
+            job["progress"] = 1.0
+            job["status"] = DONE
+            job["result"] = result
+            self.store.save_job(job, self.owner)
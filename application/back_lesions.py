@@ -0,0 +1,80 @@
+'''
+Lesion metrics engine: each segmentation mask is labelled once, then every
+per-lesion measure (size, diameter, centroid) is computed inside the bounding
+box of the lesion instead of on the full volume
+'''
+# Dependencies
+import numpy as np
+
+from back_diameter import feret_diameter
+# scipy is imported on first use (fast server startup)
+
+
+def lesion_mask(segmentation):
+    '''
+    Boolean mask of the lesion voxels (any label > 0).
+    '''
+    if segmentation.dtype == np.bool_:
+        return segmentation
+    return np.asarray(segmentation) > 0
+
+
+def label_lesions(mask):
+    '''
+    Label the connected lesions of a mask (face connectivity, as scipy.ndimage.label).
+
+    Returns:
+        tuple: (labels array, number of lesions, bounding box slices of each lesion)
+    '''
+    from scipy.ndimage import label, find_objects
+    labels, count = label(mask)
+    return labels, count, find_objects(labels)
+
+
+def _padded_box(box, shape):
+    # Grow the box by one voxel (inside the volume) so the whole lesion border is inside it
+    return tuple(slice(max(s.start - 1, 0), min(s.stop + 1, n)) for s, n in zip(box, shape))
+
+
+def lesion_metrics(segmentation, spacing=(1.0, 1.0, 1.0), labelled=None):
+    '''
+    Volume, number of lesions, per-lesion measures and maximum diameter of a segmentation,
+    in one labelling pass.
+
+    Args:
+        segmentation (np.ndarray): Segmentation volume or mask (lesion where > 0)
+        spacing (tuple): Voxel size (mm) along each axis, from the NIfTI header
+        labelled (tuple, optional): Output of label_lesions for this mask, to reuse a labelling
+    Returns:
+        dict: volume (mm^3), count, max_diameter (mm) and lesions (voxels, volume,
+            Feret diameter, centroid in voxels, bbox of each lesion)
+    '''
+    voxel_volume = float(np.prod(spacing))
+    labels, count, boxes = labelled or label_lesions(lesion_mask(segmentation))
+    # Voxels of every lesion in one pass over the labels
+    voxels = np.bincount(labels.ravel(), minlength=count + 1)
+
+    lesions = []
+    for index, box in enumerate(boxes, start=1):
+        if box is None:
+            continue
+        padded = _padded_box(box, labels.shape)
+        lesion = labels[padded] == index
+        coords = np.nonzero(lesion)
+        centroid = [float(c.mean() + s.start) for c, s in zip(coords, padded)]
+        lesions.append({
+            "label": index,
+            "voxels": int(voxels[index]),
+            "volume": float(voxels[index] * voxel_volume),
+            "diameter": feret_diameter(lesion, spacing),
+            "centroid": centroid,
+            "bbox": [[s.start, s.stop] for s in box],
+        })
+
+    total_voxels = int(voxels[1:].sum())
+    return {
+        "volume": float(total_voxels * voxel_volume),
+        "count": count,
+        "max_diameter": max((lesion["diameter"] for lesion in lesions), default=0.0),
+        "lesions": lesions,
+    }
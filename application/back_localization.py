@@ -0,0 +1,135 @@
+'''
+Lobe localization of the lesions from a lobe label map (atlas) in the space of
+the scans: the lesion volume in each lobe is counted with a single bincount,
+so only ambiguous cases need the MedGemma localization
+'''
+# Dependencies
+import os
+
+import numpy as np
+
+from back_volumes import load_mask
+
+# --- Configuration ---
+LOBE_ATLAS_FILE = os.environ.get("MEDGEMMA_LOBE_ATLAS", "./atlas/lobes.nii.gz")
+LOBES = ("frontal", "occipital", "parietal", "temporal") # Atlas labels 1..4, 0 outside the lobes
+AMBIGUITY_MARGIN = 0.2      # Minimum lead (fraction of the lesion volume) of the first lobe over the second
+MIN_ATLAS_COVERAGE = 0.5    # Minimum fraction of the lesion volume inside the lobes of the atlas
+GEOMETRIC_ATLAS_DESCRIP = "geometric lobe atlas" # NIfTI description of the atlases built by geometric_lobe_atlas
+
+_atlases = {}
+
+
+def load_atlas(path=LOBE_ATLAS_FILE):
+    '''
+    Lobe label map (uint8), read once per process.
+    '''
+    atlas = _atlases.get(path)
+    if atlas is None:
+        import nibabel as nb
+        atlas = np.asarray(nb.load(path).dataobj, dtype=np.uint8)
+        _atlases[path] = atlas
+    return atlas
+
+
+def atlas_source(path=LOBE_ATLAS_FILE):
+    '''
+    Source of the answers of an atlas: "geometric_atlas" for the approximate atlases built by
+    geometric_lobe_atlas (marked in their NIfTI description), "atlas" for a registered atlas.
+    '''
+    import nibabel as nb
+    descrip = nb.load(path).header["descrip"].tobytes().rstrip(b"\0").decode(errors="replace")
+    return "geometric_atlas" if descrip == GEOMETRIC_ATLAS_DESCRIP else "atlas"
+
+
+def lobe_fractions(mask, atlas):
+    '''
+    Fraction of the lesion volume in each lobe and outside the lobes ("other").
+    '''
+    counts = np.bincount(atlas[mask], minlength=len(LOBES) + 1)
+    total = counts.sum()
+    fractions = counts / total if total else counts.astype(float)
+    return {"other": float(fractions[0]), **{lobe: float(f) for lobe, f in zip(LOBES, fractions[1:])}}
+
+
+def atlas_location(fractions):
+    '''
+    Lobe of the lesions from their lobe fractions.
+
+    Returns:
+        tuple: (lobe with the largest fraction, whether the atlas answer is ambiguous)
+    '''
+    ranked = sorted(LOBES, key=lambda lobe: -fractions[lobe])
+    coverage = 1.0 - fractions["other"]
+    ambiguous = (coverage < MIN_ATLAS_COVERAGE
+                 or fractions[ranked[0]] - fractions[ranked[1]] < AMBIGUITY_MARGIN * coverage)
+    return ranked[0], ambiguous
+
+
+def localize_lesions(segmentation_path, atlas_path=LOBE_ATLAS_FILE):
+    '''
+    Atlas localization of the lesions of a segmentation.
+
+    Returns:
+        dict: lobe, fractions (per lobe and "other") and ambiguous. No lobe and not
+            ambiguous when there is no lesion (nothing to localize); ambiguous without
+            fractions when there is no atlas for the space of the scan.
+    '''
+    mask = load_mask(segmentation_path).data
+    if not mask.any():
+        return {"lobe": None, "fractions": {}, "ambiguous": False}
+    if not os.path.exists(atlas_path):
+        return {"lobe": None, "fractions": {}, "ambiguous": True}
+    atlas = load_atlas(atlas_path)
+    if atlas.shape != mask.shape:
+        return {"lobe": None, "fractions": {}, "ambiguous": True}
+    fractions = lobe_fractions(mask, atlas)
+    lobe, ambiguous = atlas_location(fractions)
+    return {"lobe": lobe, "fractions": fractions, "ambiguous": ambiguous}
+
+
+def geometric_lobe_atlas(shape):
+    '''
+    Coarse lobe label map of an axial field of view centered on the head (axis 0
+    inferior to superior, axis 1 anterior to posterior, axis 2 left-right), from
+    fixed proportions of the field of view. Used to build the bundled atlas; replace
+    LOBE_ATLAS_FILE with a registered anatomical atlas in the same space for finer boundaries.
+
+    Args:
+        shape (tuple): Shape of the scans
+    Returns:
+        np.ndarray: uint8 labels (0 outside the lobes, i + 1 for LOBES[i])
+    '''
+    # Normalised position: up (inferior 0 -> superior 1), back (anterior 0 -> posterior 1),
+    # side (midline 0 -> lateral 1)
+    up = np.linspace(0, 1, shape[0])[:, None, None]
+    back = np.linspace(0, 1, shape[1])[None, :, None]
+    side = np.abs(np.linspace(-1, 1, shape[2]))[None, None, :]
+
+    brain = np.broadcast_to((up > 0.15) & (back > 0.05) & (back < 0.95) & (side < 0.85), shape)
+    temporal = brain & (up < 0.5) & (back > 0.3) & (back < 0.75) & (side > 0.35)
+    cerebellum = brain & (up < 0.4) & (back >= 0.6)
+    atlas = np.zeros(shape, dtype=np.uint8)
+    atlas[brain & (back < 0.45)] = LOBES.index("frontal") + 1
+    atlas[brain & (back >= 0.45) & (back < 0.75) & (up >= 0.5)] = LOBES.index("parietal") + 1
+    atlas[brain & (back >= 0.75)] = LOBES.index("occipital") + 1
+    atlas[temporal] = LOBES.index("temporal") + 1
+    atlas[cerebellum & ~temporal] = 0
+    return atlas
+
+
+if __name__ == "__main__":
+    import argparse
+    import nibabel as nb
+
+    parser = argparse.ArgumentParser(description="Build the bundled lobe atlas in the space of a reference scan")
+    parser.add_argument("reference", help="NIfTI scan giving the shape and affine of the atlas")
+    parser.add_argument("--output", default=LOBE_ATLAS_FILE)
+    args = parser.parse_args()
+
+    reference = nb.load(args.reference)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    atlas = nb.Nifti1Image(geometric_lobe_atlas(reference.shape[:3]), reference.affine)
+    atlas.header["descrip"] = GEOMETRIC_ATLAS_DESCRIP
+    nb.save(atlas, args.output)
+    print(f"Lobe atlas saved to {args.output}")
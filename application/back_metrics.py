@@ -0,0 +1,234 @@
+'''
+Latency histograms, counters and gauges of the application, exposed on /metrics
+in the Prometheus text format
+'''
+# Dependencies
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Configuration ---
+# Histogram buckets in seconds, from a fast metric to a remote segmentation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, math.inf)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metric:
+    '''
+    Base class: a named metric with a fixed set of label names.
+    '''
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    '''
+    Gauge set explicitly, or computed at scrape time by a callback returning
+    {label values tuple: value}.
+    '''
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"Error computing gauge {self.name}: {e}")
+                values = {}
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def _empty(self):
+        return {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, self._empty())
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        '''
+        Observe the duration of the with block (also when it raises).
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, state):
+        lines = []
+        for bound, count in zip(self.buckets, state["buckets"]):
+            labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        '''
+        Values of the counters and histograms (picklable, to send them back from a worker process).
+        '''
+        out = {}
+        for name, metric in self._metrics.items():
+            if isinstance(metric, (Counter, Histogram)):
+                with metric._lock:
+                    out[name] = {key: (dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value)
+                                 for key, value in metric._values.items()}
+        return out
+
+    def reset(self):
+        for metric in self._metrics.values():
+            if isinstance(metric, (Counter, Histogram)):
+                with metric._lock:
+                    metric._values = {}
+
+    def merge(self, snapshot):
+        '''
+        Add a snapshot taken in another process to the current values.
+        '''
+        for name, values in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            with metric._lock:
+                for key, value in values.items():
+                    if isinstance(metric, Histogram):
+                        state = metric._values.setdefault(key, metric._empty())
+                        state["buckets"] = [a + b for a, b in zip(state["buckets"], value["buckets"])]
+                        state["sum"] += value["sum"]
+                        state["count"] += value["count"]
+                    else:
+                        metric._values[key] = metric._values.get(key, 0) + value
+
+
+REGISTRY = Registry()
+
+
+def call_with_metrics(fn, *args, **kwargs):
+    '''
+    Run fn in a worker process and return (result, metrics snapshot), so the
+    parent can merge the measurements with REGISTRY.merge.
+    '''
+    REGISTRY.reset()
+    result = fn(*args, **kwargs)
+    return result, REGISTRY.snapshot()
+
+
+# --- Application metrics ---
+LLM_CALL_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_llm_call_seconds", "Duration of MedGemma chat calls",
+    labels=("call", "rag"),
+))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_llm_first_token_seconds", "Time to the first streamed token of MedGemma",
+    labels=("call", "rag"),
+))
+NIFTI_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_nifti_load_seconds", "Duration of NIfTI volume loads",
+))
+REPORT_METRIC_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_report_metric_seconds", "Duration of each metric computed for the report",
+    labels=("metric",),
+))
+REPORT_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_report_render_seconds", "Duration of the report rendering",
+    labels=("format",),
+))
+SEGMENTATION_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_segmentation_seconds", "Duration of remote nnU-Net segmentation round trips",
+))
+SLICE_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "medgemma_slice_render_seconds", "Duration of on-demand slice renders (cache misses)",
+    labels=("layer",),
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "medgemma_cache_requests_total", "Cache lookups",
+    labels=("cache", "result"),
+))
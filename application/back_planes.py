@@ -0,0 +1,86 @@
+'''
+Axial, coronal and sagittal planes of a volume. The voxel axis and direction of
+each plane come from the affine (RAS world axes); every plane is a transposed,
+flipped view of the same array, so a memory-mapped volume is resliced without
+copying it
+'''
+# Dependencies
+import numpy as np
+# nibabel is imported on first use (fast server startup)
+
+# --- Configuration ---
+# World axes (RAS: 0 = x to the right, 1 = y to the front, 2 = z up) of each view: slice normal, rows, columns
+VIEWS = {
+    "axial": (2, 1, 0),
+    "coronal": (1, 2, 0),
+    "sagittal": (0, 2, 1),
+}
+# Voxel axis -> (world axis, direction) when the affine is the identity (orientation not recorded,
+# as in the bundled scans): axis 0 inferior to superior, axis 1 anterior to posterior, axis 2
+# patient right to left (the axial viewer shows data[i] as is)
+DEFAULT_ORIENTATION = ((2, 1), (1, -1), (0, -1))
+
+
+def volume_orientation(affine):
+    '''
+    World axis and direction of each voxel axis of a volume.
+
+    Args:
+        affine (np.ndarray): Voxel to world (RAS, mm) transform
+    Returns:
+        np.ndarray: (3, 2) rows of (world axis, +1 or -1), as nibabel.orientations.io_orientation
+    '''
+    if affine is None or np.allclose(affine, np.eye(4)):
+        return np.array(DEFAULT_ORIENTATION)
+    from nibabel.orientations import io_orientation
+    return io_orientation(affine)
+
+
+def plane_transform(orientation, view):
+    '''
+    Voxel axes of the (slice, row, column) axes of a view, and whether each is read backwards.
+    Slices go toward +world (inferior to superior, posterior to anterior, left to right), rows
+    from the top (superior, or anterior for axial) and columns from the patient right (anterior
+    for sagittal), as a radiology viewer.
+    '''
+    voxel_axes = {int(world): (axis, int(direction)) for axis, (world, direction) in enumerate(orientation)}
+    axes, flips = [], []
+    for position, world in enumerate(VIEWS[view]):
+        axis, direction = voxel_axes[world]
+        axes.append(axis)
+        flips.append(direction < 0 if position == 0 else direction > 0)
+    return tuple(axes), tuple(flips)
+
+
+def to_plane(volume, orientation, view):
+    '''
+    Volume seen along a view: a (slices, rows, columns, ...) view of the array (no copy).
+
+    Args:
+        volume (np.ndarray): Volume (extra trailing axes, e.g. color channels, are kept)
+        orientation (np.ndarray): See volume_orientation
+        view (str): One of VIEWS
+    '''
+    axes, flips = plane_transform(orientation, view)
+    planes = np.transpose(volume, axes + tuple(range(3, volume.ndim)))
+    return planes[tuple(slice(None, None, -1) if flip else slice(None) for flip in flips)]
+
+
+def voxel_slice(orientation, view, index, shape):
+    '''
+    Index along voxel axis 0 of slice index of a view when the view slices along axis 0
+    (so a per-slice store can be read directly, see orient_slice), None otherwise.
+    '''
+    axes, flips = plane_transform(orientation, view)
+    if axes[0] != 0:
+        return None
+    return shape[0] - 1 - index if flips[0] else index
+
+
+def orient_slice(image, orientation, view):
+    '''
+    Rows and columns of a voxel axis 0 slice (see voxel_slice) in the order of the view.
+    '''
+    axes, flips = plane_transform(orientation, view)
+    image = np.transpose(image, tuple(axis - 1 for axis in axes[1:]) + tuple(range(2, image.ndim)))
+    return image[tuple(slice(None, None, -1) if flip else slice(None) for flip in flips[1:])]
@@ -1,22 +1,20 @@
 import json
-import numpy as np
-import nibabel as nb
-from scipy.ndimage import label
-from scipy.ndimage import center_of_mass, distance_transform_edt
-import cv2
 import os
+import re
 from back_irm_analysis import run_analysis_location, run_analysis
-
-try:
-    from weasyprint import HTML, CSS
-    WEASYPRINT_AVAILABLE = True
-except ImportError:
-    print("Warning: weasyprint not installed. PDF generation will not be available.")
-    print("Install with: pip install weasyprint")
-    WEASYPRINT_AVAILABLE = False
-
-MRI_FOLDER = "./front/public/mri"
-REPORT_FOLDER = "./front/public/report"
+from back_localization import LOBE_ATLAS_FILE
+from back_timeline import TIMELINE_FILE, load_timeline, build_timeline, empty_changes
+from back_cache import ArtifactCache, cache_key
+from back_metrics import REPORT_METRIC_SECONDS, REPORT_RENDER_SECONDS, CACHE_REQUESTS
+# scipy and weasyprint are imported on first use (fast server startup)
+
+REPORT_FOLDER = "./front/public/report" # One sub-folder per client (see client_report_folder)
+REPORT_FILES = ["report.json", "report.html", "report.pdf"]
+# Bump when the metrics or the template change, so cached reports are not reused
+PIPELINE_VERSION = "1.7.3"
+# Units shown in the report (metrics are computed in mm and mm^3 from the NIfTI spacing)
+MM3_PER_ML = 1000
+MM_PER_CM = 10
 
 REPORT_TEMPLATE = """<!DOCTYPE html>
 <html>
@@ -210,6 +208,64 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
             color: #2c3e50; 
             font-weight: 600;
         }}
+
+        /* Lesion changes table */
+        .lesion-table {{
+            width: 100%;
+            border-collapse: collapse;
+            background: white;
+            border-radius: 12px;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.08);
+            page-break-inside: avoid;
+        }}
+
+        .lesion-table th, .lesion-table td {{
+            padding: 10px 14px;
+            text-align: left;
+            border-bottom: 1px solid #ecf0f1;
+        }}
+
+        .lesion-table th {{
+            font-size: 14px;
+            color: #34495e;
+            text-transform: uppercase;
+            letter-spacing: 0.5px;
+        }}
+
+        .status-new, .status-growing {{
+            color: #c0392b;
+            font-weight: 600;
+        }}
+
+        .status-resolved, .status-shrinking {{
+            color: #27ae60;
+            font-weight: 600;
+        }}
+
+        /* Most changed slices */
+        .change-gallery {{
+            display: flex;
+            flex-wrap: wrap;
+            gap: 12px;
+            page-break-inside: avoid;
+        }}
+
+        .change-gallery figure {{
+            width: 31%;
+            margin: 0;
+        }}
+
+        .change-gallery img {{
+            width: 100%;
+            border-radius: 8px;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+        }}
+
+        .change-gallery figcaption {{
+            text-align: center;
+            font-size: 14px;
+            color: #666;
+        }}
     </style>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/Chart.js/3.9.1/chart.min.js"></script>
 </head>
@@ -272,9 +328,28 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
                 <h4>Radiographic Grading</h4>
                 <div class="metric-value" style="font-size: 20px;">{radiographic_grading}</div>
             </div>
+            <div class="metric-card">
+                <h4>Lesion Location</h4>
+                <div class="metric-value" style="font-size: 20px;">{location}</div>
+            </div>
         </div>
     </div>
 
+    <h2>Lesion Changes</h2>
+    <table class="lesion-table">
+        <thead>
+            <tr><th>Site</th><th>Status</th><th>Slice</th><th>Volume (mL)</th><th>Change</th><th>Diameter (cm)</th><th>Change</th></tr>
+        </thead>
+        <tbody>
+{lesion_rows}
+        </tbody>
+    </table>
+
+    <h2>Most Changed Slices</h2>
+    <div class="change-gallery">
+{change_gallery}
+    </div>
+
     <div class="chart-section">
         <div class="chart-title">Volumes Evolution</div>
         <div class="chart-container">
@@ -287,10 +362,10 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
         const chart = new Chart(ctx, {{
             type: 'line',
             data: {{
-                labels: ['{date_previous}', '{date_tp0}', '{date_tp1}'],
+                labels: {chart_dates},
                 datasets: [{{
                     label: 'Max Diameter (cm)',
-                    data: [{previous_diameter:.2f}, {tp0_diameter:.2f}, {tp1_diameter:.2f}],
+                    data: {chart_diameters},
                     borderColor: '#3498db',
                     backgroundColor: 'transparent',
                     borderWidth: 3,
@@ -300,6 +375,19 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
                     pointRadius: 6,
                     fill: false,
                     tension: 0.3
+                }}, {{
+                    label: 'Total Volume (mL)',
+                    data: {chart_volumes},
+                    borderColor: '#e67e22',
+                    backgroundColor: 'transparent',
+                    borderWidth: 3,
+                    pointBackgroundColor: '#e67e22',
+                    pointBorderColor: '#fff',
+                    pointBorderWidth: 2,
+                    pointRadius: 6,
+                    fill: false,
+                    tension: 0.3,
+                    yAxisID: 'volume'
                 }}]
             }},
             options: {{
@@ -311,7 +399,7 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
                 }},
                 plugins: {{
                     legend: {{
-                        display: false
+                        display: true
                     }}
                 }},
                 scales: {{
@@ -328,6 +416,20 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
                             color: 'rgba(0,0,0,0.05)'
                         }}
                     }},
+                    volume: {{
+                        position: 'right',
+                        beginAtZero: true,
+                        title: {{
+                            display: true,
+                            text: 'Volume (mL)',
+                            font: {{
+                                weight: 'bold'
+                            }}
+                        }},
+                        grid: {{
+                            display: false
+                        }}
+                    }},
                     x: {{
                         title: {{
                             display: true,
@@ -348,68 +450,111 @@ REPORT_TEMPLATE = """<!DOCTYPE html>
 </html>
 """
 
-PIXEL_AREA_ON_MRI = 0.004 # in cm^2
-DISTANCE_BETWEEN_SLICES = 0.1 # in cm
-
-def compute_volume(segmentation):
-    num_voxels = np.sum(segmentation > 0)
-    voxel_volume = PIXEL_AREA_ON_MRI * DISTANCE_BETWEEN_SLICES
-    return num_voxels * voxel_volume
-
-def compute_number_of_oedemas(segmentation):
-    _, num_features = label(segmentation > 0)
-    return num_features
-
-def compute_max_diameter(segmentation):
-    coords = np.argwhere(segmentation > 0)
-    if coords.size == 0:
-        return 0.0 
-
-    com = center_of_mass(segmentation)
-
-    dist_transform = distance_transform_edt(segmentation > 0)
+def measure(metric, fn, *args):
+    """Run fn(*args), recording its duration in the report metric histogram"""
+    with REPORT_METRIC_SECONDS.time(metric=metric):
+        return fn(*args)
+
+def site_in_report_units(site):
+    """Tracked lesion site with volumes in mL and diameters in cm"""
+    site = dict(site)
+    for key in ("volume_t0", "volume_t1", "volume_change"):
+        site[key] = site[key] / MM3_PER_ML
+    for key in ("diameter_t0", "diameter_t1", "diameter_change"):
+        site[key] = site[key] / MM_PER_CM
+    return site
+
+def timeline_point(point):
+    """Metrics of one scan of the timeline, in report units"""
+    metrics = point["metrics"]
+    return {
+        "id": point["id"],
+        "date": point["date"],
+        "volume": metrics["volume"] / MM3_PER_ML,
+        "oedemas": metrics["count"],
+        "max_diameter": metrics["max_diameter"] / MM_PER_CM,
+    }
 
-    max_distance = np.max(dist_transform[tuple(coords.T)])
-    
-    return max_distance * 2 * PIXEL_AREA_ON_MRI**0.5
+def generate_client_report(client_name, timeline_file=TIMELINE_FILE, scans=None):
+    """
+    Report information over every scan of the timeline: the latest scan is compared
+    with the one before it, and the charts cover the whole timeline.
+    Scans already measured are read from the scan metrics store.
 
-def find_biggest_difference_slice(segmentation_t0, segmentation_t1):
-    diff = np.abs(segmentation_t1 - segmentation_t0)
-    max_diff_index = np.argmax(np.sum(diff, axis=(1, 2)))
-    return max_diff_index
+    Args:
+        client_name (str): Name of the client
+        timeline_file (str): Timeline of the client (see back_timeline.load_timeline)
+        scans (list, optional): Scans to use instead of reading timeline_file
+    """
+    scans = scans or load_timeline(timeline_file)
+    timeline = measure("timeline", build_timeline, scans)
+    points = timeline["points"]
+    current = points[-1]
+    prior = points[-2] if len(points) > 1 else current
+    changes = timeline["changes"][-1] if timeline["changes"] else empty_changes()
 
-def generate_client_report(client_name):
     info = {
         "client_name": client_name,
-        "time0": "2025-03-24",
-        "time1": "2025-04-18",
-        "rmi_location": run_analysis_location(1),
+        "time0": prior["date"],
+        "time1": current["date"],
+        "scan_t0": prior["id"],
+        "scan_t1": current["id"],
+        "baseline_date": points[0]["date"],
     }
-
-    seg_t0_slices = nb.load("./front/public/mri/0.seg/mri_file.nii").get_fdata()
-    seg_t1_slices = nb.load("./front/public/mri/1.seg/mri_file.nii").get_fdata()
-
-    volume_t0 = float(compute_volume(seg_t0_slices))
-    volume_t1 = float(compute_volume(seg_t1_slices))
-    volume_change = volume_t1 - volume_t0
-    biggest_diff_slice = int(find_biggest_difference_slice(seg_t0_slices, seg_t1_slices))
-    info["biggest_diff_slice"] = biggest_diff_slice
+    # Lobe of the lesions of the latest scan (atlas, MedGemma when the atlas is ambiguous)
+    location = measure("location", run_analysis_location, current["id"], scans[-1]["segmentation"])
+    info["rmi_location"] = location["lobe"]
+    info["lobe_fractions"] = location["fractions"]
+    info["location_source"] = location["source"]
+
+    lesions_t0 = prior["metrics"]
+    lesions_t1 = current["metrics"]
+    volume_t0 = lesions_t0["volume"] / MM3_PER_ML
+    volume_t1 = lesions_t1["volume"] / MM3_PER_ML
+    info["biggest_diff_slice"] = changes["biggest_diff_slice"]
+    # Slices with the most new and resolved voxels (report gallery)
+    info["change_slices"] = changes.get("change_slices", [])
     info["volume_t0"] = volume_t0
     info["volume_t1"] = volume_t1
-    info["volume_change"] = volume_change
-    info["oedemas_t0"] = float(compute_number_of_oedemas(seg_t0_slices))
-    info["oedemas_t1"] = float(compute_number_of_oedemas(seg_t1_slices))
-    info["max_diameter_t0"] = float(compute_max_diameter(seg_t0_slices))
-    info["max_diameter_t1"] = float(compute_max_diameter(seg_t1_slices))
-
-    info["previous_volumes"] = {
-        "2025-02-27": float(volume_t0 - (volume_change / 2)),
-    }
-
-    info["severity"], info["severity_reason"] = run_analysis(1)
+    info["volume_change"] = volume_t1 - volume_t0
+    info["oedemas_t0"] = float(lesions_t0["count"])
+    info["oedemas_t1"] = float(lesions_t1["count"])
+    info["max_diameter_t0"] = lesions_t0["max_diameter"] / MM_PER_CM
+    info["max_diameter_t1"] = lesions_t1["max_diameter"] / MM_PER_CM
+    # Exact (Feret) diameter of each lesion, used for the severity grading
+    info["lesion_diameters_t0"] = [lesion["diameter"] / MM_PER_CM for lesion in lesions_t0["lesions"]]
+    info["lesion_diameters_t1"] = [lesion["diameter"] / MM_PER_CM for lesion in lesions_t1["lesions"]]
+    # Sites matched between the two latest scans (new, resolved, growing, shrinking, stable)
+    info["lesion_changes"] = [site_in_report_units(site) for site in changes["lesions"]]
+    info["lesion_change_summary"] = changes["summary"]
+    # Every scan of the patient, oldest first
+    info["timeline"] = [timeline_point(point) for point in points]
+
+    info["severity"], info["severity_reason"] = measure("severity", run_analysis, info)
 
     return info
 
+LESION_ROW = """            <tr><td>{site}</td><td class="status-{status}">{status}</td><td>{slice}</td><td>{volume_t1:.2f}</td><td>{volume_change:+.2f}</td><td>{diameter_t1:.1f}</td><td>{diameter_change:+.1f}</td></tr>"""
+
+def lesion_rows(lesion_changes):
+    """Rows of the lesion changes table, one per tracked site"""
+    return "\n".join(LESION_ROW.format(site=i, **site) for i, site in enumerate(lesion_changes, start=1))
+
+CHANGE_FIGURE = """        <figure><img src="/mri/difference/slice_{slice:03d}.jpg" alt="Slice {slice}"><figcaption>Slice {slice}: +{new} / -{resolved} voxels</figcaption></figure>"""
+
+def change_gallery(change_slices):
+    """Figures of the most changed slices (new / resolved voxels)"""
+    return "\n".join(CHANGE_FIGURE.format(**change) for change in change_slices)
+
+LOCATION_SOURCES = {"atlas": "atlas", "geometric_atlas": "approximate, geometric atlas", "medgemma": "MedGemma"}
+
+def location_label(info_json):
+    """Lobe of the lesions with the source of the answer, undetermined when no source could locate them"""
+    lobe, source = info_json.get("rmi_location"), info_json.get("location_source")
+    if lobe is None:
+        return "Undetermined" if source == "fallback" else "No lesion"
+    return f"{lobe.capitalize()} ({LOCATION_SOURCES.get(source, source)})"
+
 def generate_html(info_json):
     out = REPORT_TEMPLATE.format(
         patient_name=info_json["client_name"],
@@ -418,9 +563,9 @@ def generate_html(info_json):
         patient_id="123456789",
         date_tp1=info_json["time1"],
         date_tp0=info_json["time0"],
-        date_previous=list(info_json["previous_volumes"].keys())[0],
-        img_tp0=f"/mri/0.seg/slice_{str(info_json['biggest_diff_slice']).zfill(3)}.jpg",
-        img_tp1=f"/mri/1.seg/slice_{str(info_json['biggest_diff_slice']).zfill(3)}.jpg",
+        date_previous=info_json["baseline_date"],
+        img_tp0=f"/mri/{info_json['scan_t0']}.seg/slice_{str(info_json['biggest_diff_slice']).zfill(3)}.jpg",
+        img_tp1=f"/mri/{info_json['scan_t1']}.seg/slice_{str(info_json['biggest_diff_slice']).zfill(3)}.jpg",
         difference=f"/mri/difference/slice_{str(info_json['biggest_diff_slice']).zfill(3)}.jpg",
         diameter=info_json["max_diameter_t1"],
         diameter_change=info_json["max_diameter_t1"] - info_json["max_diameter_t0"],
@@ -429,27 +574,38 @@ def generate_html(info_json):
         num_lesions_tp1=int(info_json["oedemas_t1"]),
         num_lesions_diff=int(info_json["oedemas_t1"] - info_json["oedemas_t0"]),
         radiographic_grading=info_json["severity"],
-        previous_diameter=info_json["max_diameter_t0"],
-        tp0_diameter=info_json["max_diameter_t0"],
-        tp1_diameter=info_json["max_diameter_t1"]
+        location=location_label(info_json),
+        chart_dates=json.dumps([point["date"] for point in info_json["timeline"]]),
+        chart_diameters=json.dumps([round(point["max_diameter"], 2) for point in info_json["timeline"]]),
+        chart_volumes=json.dumps([round(point["volume"], 2) for point in info_json["timeline"]]),
+        lesion_rows=lesion_rows(info_json.get("lesion_changes", [])),
+        change_gallery=change_gallery(info_json.get("change_slices", [])),
     )
     return out
 
 # HTML and JSON ##################
-def save_html(html):
-    save_path = f"{REPORT_FOLDER}/report.html"
+def save_html(html, folder=REPORT_FOLDER):
+    save_path = f"{folder}/report.html"
     with open(save_path, "w") as f:
         f.write(html)
     return save_path
 
-def save_json(info_json):
-    save_path = f"{REPORT_FOLDER}/report.json"
+def save_json(info_json, folder=REPORT_FOLDER):
+    save_path = f"{folder}/report.json"
     with open(save_path, "w") as f:
         json.dump(info_json, f, indent=4)
     return save_path
 
-def load_json():
-    save_path = f"{REPORT_FOLDER}/report.json"
+def client_folder_name(client_name):
+    """Folder name of a client (also used by the front end to fetch the report)"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", client_name).strip("._") or "patient"
+
+def client_report_folder(client_name):
+    """Folder of the current report of a client"""
+    return os.path.join(REPORT_FOLDER, client_folder_name(client_name))
+
+def load_json(folder=REPORT_FOLDER):
+    save_path = f"{folder}/report.json"
     with open(save_path, "r") as f:
         try:
             info_json = json.load(f)
@@ -474,7 +630,9 @@ def generate_pdf_from_html(html_content, output_path=None):
         ImportError: If weasyprint is not installed
         Exception: If PDF generation fails
     """
-    if not WEASYPRINT_AVAILABLE:
+    try:
+        from weasyprint import HTML, CSS
+    except ImportError:
         raise ImportError("weasyprint is not installed. Install with: pip install weasyprint")
     
     try:
@@ -541,24 +699,108 @@ def save_pdf(html_content, output_path=None):
     return generate_pdf_from_html(html_content, output_path)
 
 
+# FULL PIPELINE ##################
+def render_report(info_json, folder=REPORT_FOLDER, pdf=True):
+    """
+    Write report.json, report.html and report.pdf for already computed report information.
+
+    Args:
+        info_json (dict): Output of generate_client_report
+        folder (str): Output folder
+        pdf (bool): Also render the PDF
+    """
+    os.makedirs(folder, exist_ok=True)
+    save_json(info_json, folder)
+    with REPORT_RENDER_SECONDS.time(format="html"):
+        html_content = generate_html(info_json)
+        save_html(html_content, folder)
+    if pdf:
+        with REPORT_RENDER_SECONDS.time(format="pdf"):
+            save_pdf(html_content, f"{folder}/report.pdf")
+
+def report_cache_key(client_name, timeline_file=TIMELINE_FILE):
+    """Cache key of a report: pipeline version, client name, timeline, content of its segmentations and lobe atlas"""
+    files = [timeline_file] + [scan["segmentation"] for scan in load_timeline(timeline_file)]
+    if os.path.exists(LOBE_ATLAS_FILE):
+        files.append(LOBE_ATLAS_FILE)
+    return cache_key(PIPELINE_VERSION, client_name, files=files)
+
+def restore_cached_report(client_name, key):
+    """
+    Copy a cached report of the client to its report folder if the segmentations did not change.
+
+    Args:
+        client_name (str): Name of the client
+        key (str): report_cache_key of the client, computed before reading its scans
+
+    Returns:
+        dict: The report information on a hit, None on a miss
+    """
+    folder = client_report_folder(client_name)
+    if ArtifactCache().restore(key, REPORT_FILES, folder):
+        print(f"Report cache hit for client: {client_name}")
+        CACHE_REQUESTS.inc(cache="report", result="hit")
+        return load_json(folder)
+    CACHE_REQUESTS.inc(cache="report", result="miss")
+    return None
+
+def cache_report(client_name, key, timeline_file=TIMELINE_FILE):
+    """
+    Store the report just rendered in the report folder of the client in the cache, under
+    the key computed before it was generated. Nothing is stored if the timeline or a
+    segmentation changed meanwhile (the report may mix old and new scans).
+
+    Returns:
+        bool: Whether the report was stored
+    """
+    if report_cache_key(client_name, timeline_file) != key:
+        print(f"Inputs of the report of {client_name} changed while it was generated, not cached")
+        return False
+    ArtifactCache().store(key, REPORT_FILES, client_report_folder(client_name))
+    return True
+
+def build_report(client_name):
+    """
+    Compute the report of a client and write report.json, report.html and report.pdf
+    to its report folder. Reuses the cached artifacts when the segmentations did not change.
+    Module level so it can run in a worker process (see back_executor).
+
+    Args:
+        client_name (str): Name of the client
+
+    Returns:
+        dict: The report information
+    """
+    key = report_cache_key(client_name)
+    info_json = restore_cached_report(client_name, key)
+    if info_json is not None:
+        return info_json
+
+    info_json = generate_client_report(client_name)
+    render_report(info_json, client_report_folder(client_name))
+    cache_report(client_name, key)
+    return info_json
+
 
 if __name__ == "__main__":
     client_name = "John Doe"
+    folder = client_report_folder(client_name)
+    os.makedirs(folder, exist_ok=True)
     info_json = generate_client_report(client_name)
     html_content = generate_html(info_json)
     
     # Save HTML
-    save_html(html_content)
+    save_html(html_content, folder)
     
     # Save JSON
-    save_json(info_json)
+    save_json(info_json, folder)
     
     # Generate PDF
     try:
-        pdf_path = save_pdf(html_content)
+        pdf_path = save_pdf(html_content, f"{folder}/report.pdf")
         print(f"Report generated successfully!")
-        print(f"HTML: {REPORT_FOLDER}/report.html")
-        print(f"JSON: {REPORT_FOLDER}/report.json")
+        print(f"HTML: {folder}/report.html")
+        print(f"JSON: {folder}/report.json")
         print(f"PDF: {pdf_path}")
     except ImportError as e:
         print(f"PDF generation skipped: {e}")
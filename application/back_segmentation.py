@@ -3,18 +3,22 @@ Code to handle segmentation tasks
 '''
 
 import subprocess
-import os
-import nibabel as nib
-import numpy as np
-import glob
-import shutil
 
-def run_segmentation(id):
+# Lines printed by test_remote_endpoint.py when it enters each stage
+STAGE_MARKERS = {
+    "Uploading": "upload",
+    "Sending prediction request": "inference",
+    "Downloading": "download",
+}
+
+def run_segmentation(id, on_stage=None):
     """
     Run segmentation using the remote nnU-Net endpoint
     
     Args:
         id (str): The MRI ID (e.g., "0" or "1")
+        on_stage (callable, optional): Called with the stage name ("upload", "inference", "download")
+            as the remote script reaches it
     """
     # Define input and output file paths
     input_file = f"../application/front/public/mri/{id}/mri_file.nii"
@@ -23,9 +27,10 @@ def run_segmentation(id):
     # Path to the test_remote_endpoint script
     script_path = "../nnunet-inference/test_remote_endpoint.py"
     
-    # Construct the command
+    # Construct the command (-u: unbuffered output, so each stage line arrives as it is printed)
     command = [
         "python", 
+        "-u",
         script_path,
         "--input_file", input_file,
         "--output_file", output_file
@@ -36,14 +41,23 @@ def run_segmentation(id):
         print(f"Input: {input_file}")
         print(f"Output: {output_file}")
         
-        # Run the command
-        result = subprocess.run(command, 
-                              capture_output=True, 
-                              text=True, 
-                              check=True)
+        # Run the command, following its output to report the current stage
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   text=True)
+        output = []
+        for line in process.stdout:
+            output.append(line)
+            if on_stage is not None:
+                for marker, stage in STAGE_MARKERS.items():
+                    if line.startswith(marker):
+                        on_stage(stage)
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, "".join(output), "".join(output))
         
         print("Segmentation completed successfully!")
-        print(result.stdout)
+        print("".join(output))
         
         return True
         
@@ -0,0 +1,125 @@
+'''
+Chat session store keyed by patient and user.
+The shared state store (back_storage) holds the sessions; this store keeps the
+warm Vertex chat objects of one worker process.
+'''
+# Dependencies
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configuration ---
+SESSION_MAX_ENTRIES = 64 # Maximum number of live chat sessions kept in memory
+SESSION_TTL_SECONDS = 60 * 60 # Idle time after which a session is dropped
+DEFAULT_USER = "default"
+
+
+class ChatSession:
+    '''
+    State of one chat between a user and the assistant about one patient.
+    The Vertex chat object is kept warm so that switching back to a patient
+    does not need a new model nor a new first message.
+    '''
+
+    def __init__(self, client_name, user_id, chat, report_hash=None, model=None):
+        self.client_name = client_name
+        self.user_id = user_id
+        self.chat = chat
+        self.model = model # Model the chat was started from (to rebuild a compacted chat)
+        self.report_hash = report_hash # Report the chat is grounded on
+        self.history = []
+        # Rolling summary of history[1:summarized_upto] (history[0], the greeting, stays pinned)
+        self.summary = ""
+        self.summarized_upto = 1
+        self.last_used = time.monotonic()
+        self.version = 0 # Version of the stored state this object matches (see back_storage)
+        self.saved_turns = 0 # Messages of history already in the stored state (the rest are this worker's new turns)
+        # Serialises turns on the same session (the Vertex chat object is not thread safe)
+        self.lock = asyncio.Lock()
+
+    @property
+    def key(self):
+        return session_key(self.client_name, self.user_id)
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+def session_key(client_name, user_id=DEFAULT_USER):
+    return (client_name, user_id or DEFAULT_USER)
+
+
+class SessionStore:
+    '''
+    In-memory LRU + TTL store of ChatSession objects.
+
+    Args:
+        max_entries (int): Number of sessions kept before the least recently used is evicted
+        ttl_seconds (float): Idle time after which a session expires
+    '''
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _expired(self, session, now):
+        return self.ttl_seconds is not None and now - session.last_used > self.ttl_seconds
+
+    def _evict(self, now):
+        # Drop expired sessions, then the least recently used ones above capacity
+        for key in [k for k, s in self._sessions.items() if self._expired(s, now)]:
+            del self._sessions[key]
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+
+    def get(self, client_name, user_id=DEFAULT_USER):
+        '''
+        Return the live session for (client_name, user_id), or None if absent or expired.
+        '''
+        key = session_key(client_name, user_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            if self._expired(session, now):
+                del self._sessions[key]
+                return None
+            session.touch()
+            self._sessions.move_to_end(key)
+            return session
+
+    def put(self, session):
+        '''
+        Insert (or replace) a session and evict idle ones.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            session.touch()
+            self._sessions[session.key] = session
+            self._sessions.move_to_end(session.key)
+            self._evict(now)
+        return session
+
+    def remove(self, client_name, user_id=DEFAULT_USER):
+        with self._lock:
+            return self._sessions.pop(session_key(client_name, user_id), None)
+
+    def remove_client(self, client_name):
+        '''
+        Drop every session about a given patient (e.g. after a new report).
+        '''
+        with self._lock:
+            for key in [k for k in self._sessions if k[0] == client_name]:
+                del self._sessions[key]
+
+    def evict_expired(self):
+        with self._lock:
+            self._evict(time.monotonic())
@@ -0,0 +1,143 @@
+'''
+Per-slice statistics of a volume, written once as a JSON sidecar next to the
+NIfTI file when the scan arrives: intensity range and percentiles of every slice
+for images, lesion area per label for segmentations, and non-empty flags.
+Slice selection, jump-to-lesion and display normalisation read the index
+instead of scanning the volume
+'''
+# Dependencies
+import json
+import os
+import threading
+
+import numpy as np
+
+from back_volumes import load_image, load_labels
+
+# --- Configuration ---
+INDEX_SUFFIX = ".slices.json"
+INDEX_VERSION = 1
+PERCENTILES = (0.5, 99.5) # Display window of a slice (as the fine-tuning dataset)
+
+
+def index_path(nifti_path):
+    base = nifti_path[:-len(".nii.gz")] if nifti_path.endswith(".nii.gz") else os.path.splitext(nifti_path)[0]
+    return base + INDEX_SUFFIX
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_slice_index(path, segmentation=False):
+    '''
+    Statistics of every slice (first axis) of a volume.
+
+    Args:
+        path (str): NIfTI file
+        segmentation (bool): Label map (lesion area per label) instead of an image (intensities)
+    Returns:
+        dict: shape, nonempty flags and, per slice, min / max / percentiles (image) or
+            the area in voxels of each label (segmentation)
+    '''
+    index = {"version": INDEX_VERSION, "source_stat": _stat(path), "segmentation": segmentation}
+    if segmentation:
+        data = load_labels(path).data
+        slices = data.reshape(data.shape[0], -1)
+        counts = np.stack([np.bincount(row, minlength=256) for row in slices])
+        present = np.flatnonzero(counts[:, 1:].any(axis=0)) + 1
+        index["labels"] = {str(label): counts[:, label].tolist() for label in present}
+        index["nonempty"] = (counts[:, 1:].sum(axis=1) > 0).tolist()
+    else:
+        data = load_image(path).data
+        slices = data.reshape(data.shape[0], -1)
+        low, high = np.percentile(slices, PERCENTILES, axis=1)
+        minimum, maximum = slices.min(axis=1), slices.max(axis=1)
+        index["min"] = minimum.tolist()
+        index["max"] = maximum.tolist()
+        index["percentiles"] = {str(PERCENTILES[0]): low.tolist(), str(PERCENTILES[1]): high.tolist()}
+        index["nonempty"] = (maximum > minimum).tolist()
+    index["shape"] = list(data.shape)
+    return index
+
+
+def read_slice_index(path):
+    '''
+    Slice index of a volume from its sidecar, None when there is none or it was
+    built from another version of the NIfTI file (size and modification time).
+    '''
+    try:
+        with open(index_path(path), "r") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if index.get("version") == INDEX_VERSION and index.get("source_stat") == _stat(path):
+        return index
+    return None
+
+
+def load_slice_index(path, segmentation=False):
+    '''
+    Slice index of a volume, from its sidecar; built and written on first use, or
+    when the NIfTI file changed.
+    '''
+    index = read_slice_index(path)
+    if index is not None:
+        return index
+
+    sidecar = index_path(path)
+    index = build_slice_index(path, segmentation)
+    tmp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, sidecar)
+    except OSError as e:
+        print(f"Slice index not saved for {path}: {e}")
+    return index
+
+
+def lesion_areas(index, label=None):
+    '''
+    Lesion voxels of every slice, for one label or all of them.
+    '''
+    labels = index.get("labels", {})
+    if label is not None:
+        return labels.get(str(label), [0] * index["shape"][0])
+    return [sum(areas) for areas in zip(*labels.values())] if labels else [0] * index["shape"][0]
+
+
+def lesion_slices(index, label=None):
+    '''
+    Slices holding lesion voxels (of one label, or any label).
+    '''
+    return [i for i, area in enumerate(lesion_areas(index, label)) if area > 0]
+
+
+def largest_lesion_slice(index, label=None):
+    '''
+    Slice with the largest lesion area, None when there is no lesion.
+    '''
+    areas = lesion_areas(index, label)
+    best = int(np.argmax(areas))
+    return best if areas[best] > 0 else None
+
+
+def slice_window(index, slice_index, percentiles=False):
+    '''
+    Intensity window of a slice for display: its (min, max), or its percentiles (PERCENTILES).
+    '''
+    if percentiles:
+        low, high = (index["percentiles"][str(p)][slice_index] for p in PERCENTILES)
+        return low, high
+    return index["min"][slice_index], index["max"][slice_index]
+
+
+def index_scan(scan):
+    '''
+    Write the slice indexes of a new scan (segmentation, and image when known).
+    '''
+    load_slice_index(scan["segmentation"], segmentation=True)
+    if "image" in scan:
+        load_slice_index(scan["image"])
@@ -0,0 +1,423 @@
+'''
+On-demand slice rendering for the viewer (/mri/{patient}/{scan}/{layer}/{slice}.jpg):
+a slice is rendered the first time it is asked for, from a normalised uint8 copy
+of the scan memory-mapped from cache/slices/ (C order, so one slice is one
+contiguous read) at the pyramid level of the requested size, and its JPEG
+bytes are kept in a size-bounded LRU. Coronal
+and sagittal slices are resliced from a copy normalised over the whole volume
+(no band between the axial slices), and a whole series can
+also be fetched as one sprite sheet. Nothing is rendered when a patient is added
+'''
+# Dependencies
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from back_cache import cache_key
+from back_metrics import CACHE_REQUESTS, SLICE_RENDER_SECONDS
+from back_planes import VIEWS, orient_slice, plane_transform, to_plane, volume_orientation, voxel_slice
+from back_slice_index import load_slice_index
+from back_slices import (JPEG_QUALITY, LESION_COLOR, NEW_COLOR, RESOLVED_COLOR, downscale, level_shape,
+                         normalize_volume, overlay_volume, pyramid_level)
+from back_timeline import MRI_FOLDER, TIMELINE_FILE, ScanMetricsStore, build_timeline, load_timeline, timeline_patients
+from back_volumes import load_affine, load_image, load_sparse_mask
+# cv2 is imported on first use (fast server startup)
+
+# --- Configuration ---
+SLICE_CACHE_FOLDER = "./cache/slices" # Normalised volumes (.npy) memory-mapped by the renderer
+SLICE_VOLUMES_MAX_BYTES = 1024 * 1024 * 1024 # Size cap of that folder (~110 volumes of 155x240x240), least recently opened deleted above it
+SLICE_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Encoded slices kept in memory (~3000 slices of 20 KB)
+SLICE_MAX_AGE = 3600 # Cache-Control max-age of a slice (s), revalidated with its ETag afterwards
+LAYERS = ("image", "seg", "difference")
+SHEET_FORMAT = ".webp" # Sprite sheets of a series (".jpg" when OpenCV is built without WebP)
+SHEET_QUALITY = 90
+MEDIA_TYPES = {".jpg": "image/jpeg", ".webp": "image/webp"}
+# Bump when the rendering changes, so ETags and cached volumes are not reused
+RENDER_VERSION = "1.1.0"
+
+
+def timeline_file(patient):
+    '''
+    Timeline of a patient: {MRI_FOLDER}/{patient}/timeline.json when it exists, otherwise
+    the default timeline if it lists the patient (single patient set up).
+
+    Raises:
+        KeyError: Invalid or unknown patient
+    '''
+    if patient in ("", ".", "..") or os.sep in patient or (os.altsep and os.altsep in patient):
+        raise KeyError(f"Invalid patient: {patient}")
+    path = os.path.join(MRI_FOLDER, patient, "timeline.json")
+    if os.path.exists(path):
+        return path
+    if patient.lower() in timeline_patients(TIMELINE_FILE):
+        return TIMELINE_FILE
+    raise KeyError(f"Unknown patient: {patient}")
+
+
+def encode(image, ext, quality):
+    '''
+    Encoded bytes of an image (".jpg" or ".webp").
+    '''
+    import cv2
+    flag = cv2.IMWRITE_WEBP_QUALITY if ext == ".webp" else cv2.IMWRITE_JPEG_QUALITY
+    ok, encoded = cv2.imencode(ext, image, [flag, quality])
+    if not ok:
+        raise RuntimeError(f"{ext} encoding failed for an image of shape {image.shape}")
+    return encoded.tobytes()
+
+
+def sheet_grid(slices):
+    '''
+    (columns, rows) of the sprite sheet of a series: the squarest grid holding every slice.
+    '''
+    columns = math.ceil(math.sqrt(slices))
+    return columns, math.ceil(slices / columns)
+
+
+def pack_sheet(volume):
+    '''
+    Tile the slices (first axis) of a volume row by row in one image (empty tiles are black).
+    '''
+    slices, height, width = volume.shape[:3]
+    columns, rows = sheet_grid(slices)
+    tiles = np.zeros((rows * columns, *volume.shape[1:]), dtype=volume.dtype)
+    tiles[:slices] = volume
+    grid = tiles.reshape(rows, columns, *volume.shape[1:]).swapaxes(1, 2)
+    return grid.reshape(rows * height, columns * width, *volume.shape[3:])
+
+
+class SliceCache:
+    '''
+    In-memory LRU of encoded slices, bounded by the total size of the bytes.
+
+    Args:
+        max_bytes (int): Size above which the least recently used slices are evicted
+    '''
+
+    def __init__(self, max_bytes=SLICE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class SliceRenderer:
+    '''
+    Renders the slices of the scans of each patient timeline, on demand.
+
+    Args:
+        folder (str): Folder of the normalised volumes
+        cache (SliceCache): Encoded slices
+        store (ScanMetricsStore): Stored scan metrics and change maps (difference layer)
+        max_bytes (int): Size cap of the normalised volumes on disk
+    '''
+
+    def __init__(self, folder=SLICE_CACHE_FOLDER, cache=None, store=None, max_bytes=SLICE_VOLUMES_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.cache = cache if cache is not None else SliceCache()
+        self.store = store or ScanMetricsStore()
+        self._timelines = {} # timeline path -> (mtime_ns, scans, scan hashes)
+        self._volumes = {}   # volume key -> (memory-mapped uint8 volume, orientation)
+        self._masks = {}     # segmentation key -> SparseMask
+        self._overlay_volumes = {} # overlay key -> memory-mapped decoded masks (stacked, one per overlay color)
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock() # Serialises the first open of volumes (not the cached slices)
+        os.makedirs(folder, exist_ok=True)
+
+    def _timeline(self, patient):
+        # Scans of the patient, reloaded when the timeline file changes
+        path = timeline_file(patient)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._timelines.get(path)
+        if entry is None or entry[0] != mtime:
+            scans = load_timeline(path)
+            entry = (mtime, scans, None)
+            with self._lock:
+                self._timelines[path] = entry
+        return entry[1]
+
+    def _hashes(self, patient):
+        # Scan hashes of the timeline (measures the scans not stored yet): only the difference layer needs them
+        path = timeline_file(patient)
+        with self._lock:
+            mtime, scans, hashes = self._timelines[path]
+        if hashes is None:
+            hashes = [point["hash"] for point in build_timeline(scans, self.store)["points"]]
+            with self._lock:
+                self._timelines[path] = (mtime, scans, hashes)
+        return hashes
+
+    def _stored(self, key, build):
+        # Array written once to the cache folder then memory-mapped (called under _open_lock)
+        path = os.path.join(self.folder, f"{key}.npy")
+        if os.path.exists(path):
+            # Last use, for the eviction
+            os.utime(path)
+        else:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, np.ascontiguousarray(build()))
+            os.replace(tmp_path, path)
+            self._evict_volumes(keep=path)
+        return np.load(path, mmap_mode="r")
+
+    def _volume(self, scan, view="axial"):
+        # Normalised uint8 volume of a scan image (written once then memory-mapped) and its orientation.
+        # Views slicing along voxel axis 0 use the per slice normalisation of the export; the other
+        # views are resliced across those slices, so they use a normalisation over the whole volume
+        orientation = volume_orientation(load_affine(scan["image"]))
+        per_slice = plane_transform(orientation, view)[0][0] == 0
+        key = cache_key(RENDER_VERSION, "slice" if per_slice else "volume", files=[scan["image"]])
+        with self._open_lock:
+            entry = self._volumes.get(key)
+            if entry is None:
+                volume = self._stored(key, lambda: normalize_volume(load_image(scan["image"]).data,
+                                                                    load_slice_index(scan["image"]), per_slice))
+                entry = self._volumes[key] = (volume, orientation)
+        return entry
+
+    def _decoded(self, key, decode):
+        # Decoded overlay masks of a whole volume (resliced views and sheets), stored as the volumes
+        with self._open_lock:
+            masks = self._overlay_volumes.get(key)
+            if masks is None:
+                masks = self._overlay_volumes[key] = self._stored(key, decode)
+        return masks
+
+    def _evict_volumes(self, keep=None):
+        # Delete the least recently opened volumes above max_bytes (called under _open_lock).
+        # A deleted file stays readable through the memory maps already open on it (in any
+        # worker); this worker drops its own map so the space is freed once it is unused
+        entries = []
+        total = 0
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if not name.endswith(".npy") or name.endswith(".tmp.npy"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # Evicted by another worker
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                key = os.path.basename(path)[:-len(".npy")]
+                self._volumes.pop(key, None)
+                self._overlay_volumes.pop(key, None)
+                print(f"Evicted slice volume {os.path.basename(path)}")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _mask(self, scan):
+        key = cache_key(RENDER_VERSION, files=[scan["segmentation"]])
+        with self._open_lock:
+            sparse = self._masks.get(key)
+            if sparse is None:
+                sparse = self._masks[key] = load_sparse_mask(scan["segmentation"])
+        return key, sparse
+
+    def _position(self, scans, scan_id):
+        position = next((k for k, scan in enumerate(scans) if scan["id"] == scan_id), None)
+        if position is None:
+            raise KeyError(f"Unknown scan: {scan_id}")
+        return position
+
+    def _level(self, scan, view, size):
+        # Pyramid level of the slices of a view for a displayed size (see back_slices.pyramid_level)
+        if not size:
+            return 0
+        volume, orientation = self._volume(scan, view)
+        return pyramid_level(to_plane(volume, orientation, view).shape[1:3], size)
+
+    def slice_key(self, patient, scan_id, layer, index, view="axial", size=None):
+        '''
+        Cache key (and ETag) of a slice (index "sheet": of the sprite sheet of the series),
+        from the content of the files it is rendered from and the request parameters only
+        (no volume is opened, so a 304 costs a digest lookup).
+
+        Raises:
+            KeyError: Unknown patient, scan, layer or view (or no previous scan for the difference layer)
+        '''
+        if layer not in LAYERS:
+            raise KeyError(f"Unknown layer: {layer}")
+        if view not in VIEWS:
+            raise KeyError(f"Unknown view: {view}")
+        scans = self._timeline(patient)
+        position = self._position(scans, scan_id)
+        if layer == "difference" and position == 0:
+            raise KeyError(f"No scan before {scan_id}")
+        files = [scans[position]["image"]]
+        if layer != "image":
+            files += [scans[k]["segmentation"] for k in range(position - (layer == "difference"), position + 1)]
+        return cache_key(RENDER_VERSION, layer, view, index, size or 0, JPEG_QUALITY, SHEET_FORMAT, SHEET_QUALITY, files=files)
+
+    def sheet_key(self, patient, scan_id, layer, view="axial", size=None):
+        '''Cache key (and ETag) of the sprite sheet of a series'''
+        return self.slice_key(patient, scan_id, layer, "sheet", view, size)
+
+    def _change_map(self, hashes, position):
+        # Change map between a scan and the previous one (none when their labels were not readable)
+        change_map = self.store.change_map(hashes[position - 1], hashes[position])
+        if change_map is None:
+            raise KeyError(f"No change map for scan {position} of the timeline")
+        return change_map
+
+    def _overlays(self, patient, scans, position, layer, index=None):
+        # (mask, color) layers of one slice (voxel axis 0), or of the whole volume when index is None
+        if layer == "seg":
+            key, sparse = self._mask(scans[position])
+            if index is not None:
+                return [(sparse.slice(index), LESION_COLOR)]
+            masks = self._decoded(cache_key(key, "mask"), lambda: sparse.to_mask()[None])
+            return [(masks[0], LESION_COLOR)]
+        if layer == "difference":
+            hashes = self._hashes(patient)
+            if index is not None:
+                change_map = self._change_map(hashes, position)
+                return [(change_map.new_slice(index), NEW_COLOR), (change_map.resolved_slice(index), RESOLVED_COLOR)]
+
+            def decode():
+                change_map = self._change_map(hashes, position)
+                return np.stack([change_map.new_mask(), change_map.resolved_mask()])
+            masks = self._decoded(cache_key(RENDER_VERSION, "changes", hashes[position - 1], hashes[position]), decode)
+            return [(masks[0], NEW_COLOR), (masks[1], RESOLVED_COLOR)]
+        return []
+
+    def _cached(self, key, layer, render):
+        # Encoded bytes of a cache entry, rendered (and timed) on a miss
+        data = self.cache.get(key)
+        if data is not None:
+            CACHE_REQUESTS.inc(cache="slices", result="hit")
+            return data
+        CACHE_REQUESTS.inc(cache="slices", result="miss")
+        start = time.perf_counter()
+        data = render()
+        self.cache.put(key, data)
+        SLICE_RENDER_SECONDS.observe(time.perf_counter() - start, layer=layer)
+        return data
+
+    def render(self, patient, scan_id, layer, index, view="axial", size=None):
+        '''
+        JPEG of one slice of a scan.
+
+        Args:
+            patient (str): Patient (timeline) name
+            scan_id (str): Scan id in the timeline
+            layer (str): "image", "seg" (lesions in red) or "difference" (new lesion voxels
+                since the previous scan in red, resolved ones in green)
+            index (int): Slice index in the view
+            view (str): "axial", "coronal" or "sagittal" (see back_planes)
+            size (int, optional): Displayed size (pixels): the smallest pyramid level at least
+                that large is rendered (full resolution by default)
+        Returns:
+            tuple: (JPEG bytes, cache key)
+        Raises:
+            KeyError: Unknown patient, scan, layer or view
+            IndexError: Slice out of range
+        '''
+        key = self.slice_key(patient, scan_id, layer, index, view, size)
+
+        def render():
+            scans = self._timeline(patient)
+            position = self._position(scans, scan_id)
+            volume, orientation = self._volume(scans[position], view)
+            planes = to_plane(volume, orientation, view)
+            if not 0 <= index < planes.shape[0]:
+                raise IndexError(f"Slice {index} out of range (0-{planes.shape[0] - 1})")
+            voxel_index = voxel_slice(orientation, view, index, volume.shape)
+            if voxel_index is not None:
+                # The view slices along the stored axis: read one slice of the volume and of the masks
+                gray = np.asarray(volume[voxel_index])
+                overlays = self._overlays(patient, scans, position, layer, voxel_index)
+                image = orient_slice(overlay_volume(gray, overlays) if overlays else gray, orientation, view)
+            else:
+                gray = np.asarray(planes[index])
+                overlays = [(to_plane(mask, orientation, view)[index], color)
+                            for mask, color in self._overlays(patient, scans, position, layer)]
+                image = overlay_volume(gray, overlays) if overlays else gray
+            level = self._level(scans[position], view, size)
+            return encode(downscale(np.ascontiguousarray(image), level), ".jpg", JPEG_QUALITY)
+
+        return self._cached(key, layer, render), key
+
+    def sheet_index(self, patient, scan_id, layer, view="axial", size=None):
+        '''
+        Layout of the sprite sheet of a series: slice count, grid, pyramid level and tile size
+        (for the viewer).
+
+        Raises:
+            KeyError: Unknown patient, scan, layer or view
+        '''
+        self.sheet_key(patient, scan_id, layer, view)
+        scans = self._timeline(patient)
+        scan = scans[self._position(scans, scan_id)]
+        volume, orientation = self._volume(scan, view)
+        planes = to_plane(volume, orientation, view)
+        level = self._level(scan, view, size)
+        columns, rows = sheet_grid(planes.shape[0])
+        return {"slices": planes.shape[0], "columns": columns, "rows": rows, "level": level,
+                "tile": list(level_shape(planes.shape[1:3], level)), "format": SHEET_FORMAT.lstrip(".")}
+
+    def render_sheet(self, patient, scan_id, layer, view="axial", size=None):
+        '''
+        Every slice of a series packed in one image (row by row, see sheet_index), so the
+        viewer loads the series in one request.
+
+        Returns:
+            tuple: (encoded bytes, cache key)
+        Raises:
+            KeyError: Unknown patient, scan, layer or view
+        '''
+        key = self.sheet_key(patient, scan_id, layer, view, size)
+
+        def render():
+            scans = self._timeline(patient)
+            position = self._position(scans, scan_id)
+            volume, orientation = self._volume(scans[position], view)
+            gray = to_plane(volume, orientation, view)
+            overlays = [(to_plane(mask, orientation, view), color)
+                        for mask, color in self._overlays(patient, scans, position, layer)]
+            planes = overlay_volume(gray, overlays) if overlays else gray
+            level = self._level(scans[position], view, size)
+            if level:
+                planes = np.stack([downscale(np.ascontiguousarray(plane), level) for plane in planes])
+            return encode(pack_sheet(planes), SHEET_FORMAT, SHEET_QUALITY)
+
+        return self._cached(key, f"{layer}-sheet", render), key
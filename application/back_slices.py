@@ -0,0 +1,170 @@
+'''
+Slice export of a study for the viewer: each volume is loaded once, normalised
+in one vectorized pass (per-slice range from the slice index), the segmentation
+and difference layers are painted with array masks on the whole volume, and the
+JPEGs are encoded on a thread pool (OpenCV releases the GIL while encoding).
+The smaller pyramid levels are only built by the on-demand renderer (back_slice_render)
+'''
+# Dependencies
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from back_slice_index import load_slice_index
+from back_timeline import MRI_FOLDER, load_timeline, latest_change_map
+from back_volumes import load_image, load_mask
+# cv2 is imported on first use (fast server startup)
+
+# --- Configuration ---
+EXPORT_THREADS = os.cpu_count() or 4
+JPEG_QUALITY = 95 # OpenCV default
+PYRAMID_LEVELS = 3 # Resolutions of each slice: full, 1/2 and 1/4 (level k is downscaled by 2**k)
+# Overlay colors (BGR)
+LESION_COLOR = (0, 0, 255)      # red
+NEW_COLOR = (0, 0, 255)         # red
+RESOLVED_COLOR = (0, 255, 0)    # green
+
+
+def normalize_volume(data, index=None, per_slice=True):
+    '''
+    Stretch every slice (first axis) to 0-255 from its own intensity range.
+
+    Args:
+        data (np.ndarray): Image volume
+        index (dict, optional): Slice index of the volume (see back_slice_index), to skip the range pass
+        per_slice (bool): False to stretch the whole volume from its intensity range instead, so planes
+            resliced across the first axis have no band at the slice boundaries
+    Returns:
+        np.ndarray: uint8 volume
+    '''
+    if index is not None:
+        low, high = np.asarray(index["min"], dtype=np.float32), np.asarray(index["max"], dtype=np.float32)
+    else:
+        low, high = data.min(axis=(1, 2)), data.max(axis=(1, 2))
+    if not per_slice:
+        low, high = np.full_like(low, low.min()), np.full_like(high, high.max())
+    span = high - low
+    # Constant slices are exported black
+    scale = np.divide(255.0, span, out=np.zeros_like(span, dtype=np.float32), where=span > 0)
+    out = (data - low[:, None, None]) * scale[:, None, None]
+    return np.clip(out, 0, 255, out=out).astype(np.uint8)
+
+
+def overlay_volume(gray, layers):
+    '''
+    Color volume (BGR) of a grayscale volume with masks painted on top.
+
+    Args:
+        gray (np.ndarray): uint8 volume
+        layers (list): (boolean mask, BGR color) pairs, painted in order
+    Returns:
+        np.ndarray: uint8 volume with a last axis of 3 channels
+    '''
+    color = np.repeat(gray[..., None], 3, axis=-1)
+    for mask, bgr in layers:
+        color[mask] = bgr
+    return color
+
+
+def level_shape(shape, level):
+    '''
+    (height, width) of a slice of the given shape at a pyramid level.
+    '''
+    return max(1, shape[0] >> level), max(1, shape[1] >> level)
+
+
+def pyramid_level(shape, size=None):
+    '''
+    Smallest pyramid level whose larger side is at least size pixels (full resolution
+    when size is not given or larger than the slice).
+
+    Args:
+        shape (tuple): (height, width) of the full resolution slice
+        size (int, optional): Displayed size of the slice (pixels)
+    '''
+    if not size:
+        return 0
+    for level in reversed(range(PYRAMID_LEVELS)):
+        if max(level_shape(shape, level)) >= size:
+            return level
+    return 0
+
+
+def downscale(image, level):
+    '''
+    Slice (gray or color) at a pyramid level (area averaging).
+    '''
+    if level == 0:
+        return image
+    import cv2
+    height, width = level_shape(image.shape, level)
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def write_slices(volume, folder, threads=EXPORT_THREADS):
+    '''
+    Write slice_XXX.jpg for every slice (first axis) of a uint8 volume, encoded on a thread pool.
+
+    Returns:
+        int: Number of slices written
+    '''
+    import cv2
+    os.makedirs(folder, exist_ok=True)
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+    def write(i):
+        cv2.imwrite(os.path.join(folder, f"slice_{i:03d}.jpg"), volume[i], params)
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="slice-export") as pool:
+        list(pool.map(write, range(volume.shape[0])))
+    return volume.shape[0]
+
+
+def export_study(scans=None, output=MRI_FOLDER, threads=EXPORT_THREADS):
+    '''
+    Export the image, segmentation and difference slices of a study for the viewer:
+    {output}/{scan id}/, {output}/{scan id}.seg/ and {output}/difference/ (latest two scans,
+    with changes.json).
+
+    Args:
+        scans (list, optional): Scans of the study (default: the timeline file)
+        output (str): Folder served under /mri
+        threads (int): Encoding threads
+    Returns:
+        dict: Seconds spent per stage (load, normalize, overlay, encode) and slices written
+    '''
+    scans = scans or load_timeline()
+    timings = {"load": 0.0, "normalize": 0.0, "overlay": 0.0, "encode": 0.0, "slices": 0}
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[stage] += time.perf_counter() - start
+        return result
+
+    gray = None
+    for scan in scans:
+        image = timed("load", load_image, scan["image"]).data
+        index = timed("load", load_slice_index, scan["image"])
+        mask = timed("load", load_mask, scan["segmentation"]).data
+        gray = timed("normalize", normalize_volume, image, index)
+        timings["slices"] += timed("encode", write_slices, gray, os.path.join(output, scan["id"]), threads)
+        segmentation = timed("overlay", overlay_volume, gray, [(mask, LESION_COLOR)])
+        timings["slices"] += timed("encode", write_slices, segmentation, os.path.join(output, f"{scan['id']}.seg"), threads)
+
+    # Difference layer on the latest scan (gray is still the latest normalised volume)
+    change_map = timed("load", latest_change_map, scans)
+    if change_map is not None:
+        difference_folder = os.path.join(output, "difference")
+        difference = timed("overlay", overlay_volume, gray, [
+            (change_map.new_mask(), NEW_COLOR),
+            (change_map.resolved_mask(), RESOLVED_COLOR),
+        ])
+        timings["slices"] += timed("encode", write_slices, difference, difference_folder, threads)
+        # Per-slice change counts and most changed slices for the viewer
+        with open(os.path.join(difference_folder, "changes.json"), "w") as f:
+            json.dump(change_map.summary(), f)
+    return timings
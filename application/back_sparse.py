@@ -0,0 +1,202 @@
+'''
+Sparse storage of segmentation masks: per-slice run-length encoding of the
+lesion voxels, saved as a small sidecar next to the NIfTI file (a few KB
+instead of a float64 volume). Volume, per-slice areas and bounding box are
+computed on the runs directly, and the mask round-trips to NIfTI
+'''
+# Dependencies
+import os
+import threading
+
+import numpy as np
+# nibabel is imported on first use (fast server startup)
+
+# --- Configuration ---
+SIDECAR_SUFFIX = ".rle.npz"
+
+
+class SparseMask:
+    '''
+    Lesion voxels of a mask as runs along the rows (last axis) of each slice (first axis).
+    Runs never cross a row and are sorted by slice, row and column.
+
+    Args:
+        shape (tuple): Shape of the mask
+        offsets (np.ndarray): Runs of slice i are runs[offsets[i]:offsets[i + 1]] (len: slices + 1)
+        starts (np.ndarray): Index of the first voxel of each run, flattened within its slice
+        lengths (np.ndarray): Voxels of each run
+        spacing (tuple): Voxel size (mm) along each axis
+        affine (np.ndarray): Voxel to world transform of the NIfTI file
+    '''
+
+    def __init__(self, shape, offsets, starts, lengths, spacing=(1.0, 1.0, 1.0), affine=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.offsets = offsets
+        self.starts = starts
+        self.lengths = lengths
+        self.spacing = tuple(float(s) for s in spacing)
+        self.affine = np.eye(4) if affine is None else np.asarray(affine)
+
+    @classmethod
+    def from_mask(cls, mask, spacing=(1.0, 1.0, 1.0), affine=None):
+        '''
+        Encode a 3D mask (lesion where > 0). Only the rows holding lesion voxels are scanned.
+        '''
+        mask = np.asarray(mask) > 0
+        slices, rows, columns = mask.shape
+        row_index = np.flatnonzero(mask.any(axis=2))
+        # Zero column on both sides, so each run has a rising and a falling edge in its row
+        padded = np.zeros((len(row_index), columns + 2), dtype=np.int8)
+        padded[:, 1:-1] = mask.reshape(-1, columns)[row_index]
+        edges = np.diff(padded, axis=1)
+        run_rows, run_starts = np.nonzero(edges == 1)
+        _, run_stops = np.nonzero(edges == -1)
+
+        global_rows = row_index[run_rows]
+        run_slices = global_rows // rows
+        starts = (global_rows % rows) * columns + run_starts
+        return cls(
+            mask.shape,
+            np.searchsorted(run_slices, np.arange(slices + 1)).astype(np.int64),
+            starts.astype(np.uint32),
+            (run_stops - run_starts).astype(np.uint32),
+            spacing,
+            affine,
+        )
+
+    @property
+    def slice_size(self):
+        return self.shape[1] * self.shape[2]
+
+    @property
+    def voxels(self):
+        return int(self.lengths.sum(dtype=np.int64))
+
+    @property
+    def volume(self):
+        '''Lesion volume (mm^3)'''
+        return self.voxels * float(np.prod(self.spacing))
+
+    def _run_slices(self):
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.offsets))
+
+    def slice_areas(self):
+        '''
+        Lesion voxels of each slice.
+        '''
+        return np.bincount(self._run_slices(), weights=self.lengths, minlength=self.shape[0]).astype(np.int64)
+
+    def bbox(self):
+        '''
+        Bounding box of the lesion voxels, None for an empty mask.
+
+        Returns:
+            list: [start, stop] along each axis
+        '''
+        if len(self.starts) == 0:
+            return None
+        run_slices = self._run_slices()
+        starts = self.starts.astype(np.int64)
+        rows, columns = starts // self.shape[2], starts % self.shape[2]
+        return [
+            [int(run_slices[0]), int(run_slices[-1]) + 1],
+            [int(rows.min()), int(rows.max()) + 1],
+            [int(columns.min()), int((columns + self.lengths).max())],
+        ]
+
+    def _voxel_index(self, starts, lengths):
+        # Flat index of every voxel of the runs, without a full-size temporary
+        lengths = lengths.astype(np.int64)
+        first = np.cumsum(lengths) - lengths
+        return np.repeat(starts.astype(np.int64), lengths) + np.arange(int(lengths.sum())) - np.repeat(first, lengths)
+
+    def slice(self, index):
+        '''
+        Boolean mask of one slice.
+        '''
+        runs = slice(self.offsets[index], self.offsets[index + 1])
+        out = np.zeros(self.slice_size, dtype=bool)
+        out[self._voxel_index(self.starts[runs], self.lengths[runs])] = True
+        return out.reshape(self.shape[1:])
+
+    def to_mask(self):
+        '''
+        Dense boolean mask.
+        '''
+        starts = self._run_slices().astype(np.int64) * self.slice_size + self.starts
+        out = np.zeros(int(np.prod(self.shape)), dtype=bool)
+        out[self._voxel_index(starts, self.lengths)] = True
+        return out.reshape(self.shape)
+
+    def save(self, path, source_stat=None):
+        '''
+        Write the sidecar. source_stat (size, mtime_ns) of the NIfTI file marks which file it encodes.
+        '''
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path, shape=np.array(self.shape), offsets=self.offsets, starts=self.starts, lengths=self.lengths,
+            spacing=np.array(self.spacing), affine=self.affine, source_stat=np.array(source_stat or (-1, -1)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Sparse mask of a sidecar.
+
+        Returns:
+            tuple: (SparseMask, source_stat), (None, None) when missing or unreadable
+        '''
+        try:
+            with np.load(path) as data:
+                sparse = cls(data["shape"], data["offsets"], data["starts"], data["lengths"], data["spacing"], data["affine"])
+                return sparse, tuple(int(v) for v in data["source_stat"])
+        except (FileNotFoundError, KeyError, ValueError):
+            return None, None
+
+    def to_nifti(self, path):
+        '''
+        Write the mask as a uint8 NIfTI file with the original affine and spacing.
+        '''
+        import nibabel as nb
+        img = nb.Nifti1Image(self.to_mask().astype(np.uint8), self.affine)
+        img.header.set_zooms(self.spacing)
+        nb.save(img, path)
+        return path
+
+
+def sidecar_path(nifti_path):
+    base = nifti_path[:-len(".nii.gz")] if nifti_path.endswith(".nii.gz") else os.path.splitext(nifti_path)[0]
+    return base + SIDECAR_SUFFIX
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_sidecar(nifti_path):
+    '''
+    Sparse mask of a NIfTI file from its sidecar, None when there is none or it encodes
+    another version of the file. A sidecar without its NIfTI file is not used: the
+    NIfTI file is what scans are keyed and indexed on (see back_cache.file_digest).
+    '''
+    sparse, source_stat = SparseMask.load(sidecar_path(nifti_path))
+    if sparse is None:
+        return None
+    try:
+        if source_stat != _stat(nifti_path):
+            return None
+    except FileNotFoundError:
+        return None
+    return sparse
+
+
+def write_sidecar(nifti_path, sparse):
+    '''
+    Store the sparse mask of a NIfTI file next to it (skipped on a read-only folder).
+    '''
+    try:
+        sparse.save(sidecar_path(nifti_path), _stat(nifti_path))
+    except OSError as e:
+        print(f"Sparse mask not saved for {nifti_path}: {e}")
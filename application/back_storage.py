@@ -0,0 +1,271 @@
+'''
+Shared state of the application (chat sessions, report metadata, jobs) behind a
+storage interface, so several server workers or replicas can serve the same patient
+'''
+# Dependencies
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Configuration ---
+STATE_DB = os.environ.get("MEDGEMMA_STATE_DB", "./state/state.db")
+SQLITE_BUSY_TIMEOUT_MS = 10000
+
+
+class ChatConflict(Exception):
+    '''
+    Raised by save_chat when the stored chat is not at the version the caller loaded
+    (another worker saved a turn in between).
+    '''
+
+
+class JobLeaseLost(Exception):
+    '''
+    Raised by save_job when the job is no longer leased to the owner saving it
+    (its lease expired and another worker claimed it).
+    '''
+
+
+class StateStore:
+    '''
+    Storage interface shared by the server workers.
+
+    Chat state is a JSON serialisable dict (history, summary, ...) with a version
+    number incremented on every save, so a worker can tell whether its warm chat
+    object is still up to date. A save only applies on top of the version it was
+    loaded from, so two workers cannot overwrite each other's turns.
+    Jobs are dicts as built by back_jobs.JobQueue; a job is run by the worker
+    that claimed it, and the claim is a lease renewed while the worker is alive.
+    '''
+
+    # Chats
+    def load_chat(self, client_name, user_id):
+        '''Returns (state, version), or None'''
+        raise NotImplementedError
+
+    def save_chat(self, client_name, user_id, state, expected_version=0):
+        '''
+        Store state on top of expected_version (0 for a new chat).
+        Returns the new version; raises ChatConflict if the stored version differs.
+        '''
+        raise NotImplementedError
+
+    def delete_chat(self, client_name, user_id):
+        raise NotImplementedError
+
+    def count_chats(self):
+        raise NotImplementedError
+
+    # Reports
+    def save_report_meta(self, client_name, meta):
+        raise NotImplementedError
+
+    def load_report_meta(self, client_name):
+        raise NotImplementedError
+
+    # Jobs
+    def save_job(self, job, owner=None):
+        '''
+        Insert or update a job. With an owner, only updates a job still running under
+        the lease of that owner, and raises JobLeaseLost otherwise.
+        '''
+        raise NotImplementedError
+
+    def load_job(self, job_id):
+        raise NotImplementedError
+
+    def list_jobs(self, statuses=None):
+        raise NotImplementedError
+
+    def list_claimable_jobs(self):
+        '''
+        Ids of the jobs a worker may claim: queued, or running with an expired lease.
+        '''
+        raise NotImplementedError
+
+    def claim_job(self, job_id, owner, lease_seconds):
+        '''
+        Mark a queued job (or a running job whose lease expired) as running for owner.
+        Returns the job, or None if another worker holds it.
+        '''
+        raise NotImplementedError
+
+    def renew_job_leases(self, owner, lease_seconds):
+        raise NotImplementedError
+
+
+class SQLiteStateStore(StateStore):
+    '''
+    StateStore in a local SQLite database (WAL mode), usable by every worker
+    process of the host without any outside service.
+
+    Args:
+        path (str): Path of the database file
+    '''
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chats (
+        client_name TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        state TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (client_name, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS reports (
+        client_name TEXT PRIMARY KEY,
+        meta TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        owner TEXT,
+        lease_until REAL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        # One connection per thread (sqlite3 connections are not shared between threads)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            self._local.connection = connection
+        return connection
+
+    # Chats ##################
+    def load_chat(self, client_name, user_id):
+        row = self._connection().execute(
+            "SELECT state, version FROM chats WHERE client_name = ? AND user_id = ?",
+            (client_name, user_id),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save_chat(self, client_name, user_id, state, expected_version=0):
+        version = expected_version + 1
+        if expected_version == 0:
+            cursor = self._connection().execute(
+                "INSERT OR IGNORE INTO chats (client_name, user_id, state, version, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (client_name, user_id, json.dumps(state), version, time.time()),
+            )
+        else:
+            cursor = self._connection().execute(
+                "UPDATE chats SET state = ?, version = ?, updated_at = ? WHERE client_name = ? AND user_id = ? AND version = ?",
+                (json.dumps(state), version, time.time(), client_name, user_id, expected_version),
+            )
+        if cursor.rowcount == 0:
+            raise ChatConflict(f"Chat of {client_name}/{user_id} is no longer at version {expected_version}")
+        return version
+
+    def delete_chat(self, client_name, user_id):
+        self._connection().execute(
+            "DELETE FROM chats WHERE client_name = ? AND user_id = ?", (client_name, user_id)
+        )
+
+    def count_chats(self):
+        return self._connection().execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    # Reports ##################
+    def save_report_meta(self, client_name, meta):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO reports (client_name, meta, updated_at) VALUES (?, ?, ?)",
+            (client_name, json.dumps(meta), time.time()),
+        )
+
+    def load_report_meta(self, client_name):
+        row = self._connection().execute(
+            "SELECT meta FROM reports WHERE client_name = ?", (client_name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Jobs ##################
+    def save_job(self, job, owner=None):
+        job["updated_at"] = time.time()
+        if owner is None:
+            self._connection().execute(
+                """INSERT INTO jobs (id, status, data, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET status = excluded.status, data = excluded.data, updated_at = excluded.updated_at""",
+                (job["id"], job["status"], json.dumps(job), job["updated_at"]),
+            )
+            return job
+
+        cursor = self._connection().execute(
+            """UPDATE jobs SET status = ?, data = ?, updated_at = ?
+               WHERE id = ? AND owner = ? AND status = 'running' AND lease_until >= ?""",
+            (job["status"], json.dumps(job), job["updated_at"], job["id"], owner, job["updated_at"]),
+        )
+        if cursor.rowcount == 0:
+            raise JobLeaseLost(f"Job {job['id']} is no longer leased to {owner}")
+        return job
+
+    def load_job(self, job_id):
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_jobs(self, statuses=None):
+        if statuses:
+            placeholders = ",".join("?" for _ in statuses)
+            rows = self._connection().execute(
+                f"SELECT data FROM jobs WHERE status IN ({placeholders}) ORDER BY updated_at", tuple(statuses)
+            ).fetchall()
+        else:
+            rows = self._connection().execute("SELECT data FROM jobs ORDER BY updated_at").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def list_claimable_jobs(self):
+        rows = self._connection().execute(
+            """SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND COALESCE(lease_until, 0) < ?)
+               ORDER BY updated_at""",
+            (time.time(),),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_job(self, job_id, owner, lease_seconds):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT status, lease_until, data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            claimable = row is not None and (
+                row[0] == "queued" or (row[0] == "running" and (row[1] or 0) < now)
+            )
+            if not claimable:
+                connection.execute("ROLLBACK")
+                return None
+            job = json.loads(row[2])
+            job["status"] = "running"
+            job["updated_at"] = now
+            connection.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, data = ?, updated_at = ? WHERE id = ?",
+                ("running", owner, now + lease_seconds, json.dumps(job), now, job_id),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return job
+
+    def renew_job_leases(self, owner, lease_seconds):
+        self._connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+            (time.time() + lease_seconds, owner),
+        )
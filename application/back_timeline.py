@@ -0,0 +1,234 @@
+'''
+Patient timelines over any number of scans: the lesion metrics of each scan are
+computed once and stored under the hash of the scan, and the tracking between two
+consecutive scans under the pair of hashes, so adding a scan only computes that scan
+'''
+# Dependencies
+import json
+import os
+import threading
+
+import numpy as np
+
+from back_cache import cache_key
+from back_changes import ChangeMap
+from back_lesions import label_lesions, lesion_metrics
+from back_slice_index import index_scan
+from back_metrics import CACHE_REQUESTS
+from back_tracking import track_lesions
+from back_volumes import load_mask
+
+# --- Configuration ---
+MRI_FOLDER = "./front/public/mri"
+TIMELINE_FILE = f"{MRI_FOLDER}/timeline.json" # Scans of the patient (id, date, segmentation)
+SCAN_METRICS_FOLDER = "./cache/scans"
+# Bump when the lesion metrics or the tracking change, so stored scan metrics are not reused
+METRICS_VERSION = "1.1.0"
+
+
+def resolve_scans(scans, folder):
+    '''
+    Scans with their segmentation (and image) paths made relative to folder, oldest first.
+    '''
+    scans = [dict(scan, **{key: os.path.join(folder, scan[key]) for key in ("segmentation", "image") if key in scan})
+             for scan in scans]
+    return sorted(scans, key=lambda scan: scan["date"])
+
+
+def load_timeline(path=TIMELINE_FILE):
+    '''
+    Scans of a timeline file, oldest first. Paths are relative to the file folder.
+
+    Returns:
+        list: dicts with id, date, segmentation and image (paths)
+    '''
+    with open(path, "r") as f:
+        timeline = json.load(f)
+    return resolve_scans(timeline["scans"], os.path.dirname(path))
+
+
+_timeline_patients = {} # timeline path -> (mtime_ns, patients)
+
+
+def timeline_patients(path=TIMELINE_FILE):
+    '''
+    Patients (lower case) a shared timeline file is served for, from its "patients" list,
+    reread only when the file changes. Empty when the file does not exist.
+    '''
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+    entry = _timeline_patients.get(path)
+    if entry is None or entry[0] != mtime:
+        with open(path, "r") as f:
+            patients = frozenset(name.lower() for name in json.load(f).get("patients", []))
+        entry = _timeline_patients[path] = (mtime, patients)
+    return entry[1]
+
+
+def scan_hash(scan):
+    '''
+    Key of the stored metrics of a scan: metrics version and content of its segmentation.
+    '''
+    return cache_key(METRICS_VERSION, files=[scan["segmentation"]])
+
+
+class ScanMetricsStore:
+    '''
+    Lesion metrics (JSON) and lesion labels (compressed npz) of each scan, by scan hash.
+
+    Args:
+        folder (str): Folder holding two files per scan
+    '''
+
+    def __init__(self, folder=SCAN_METRICS_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _write_json(self, name, data):
+        path = self._path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, name):
+        try:
+            with open(self._path(name), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def metrics(self, digest):
+        return self._read_json(f"{digest}.json")
+
+    def has_labels(self, digest):
+        return os.path.exists(self._path(f"{digest}.labels.npz"))
+
+    def labels(self, digest):
+        try:
+            with np.load(self._path(f"{digest}.labels.npz")) as data:
+                return data["labels"]
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def put(self, digest, metrics, labels):
+        # Labels first: a scan with metrics always has its labels
+        path = self._path(f"{digest}.labels.npz")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        dtype = np.uint16 if metrics["count"] < np.iinfo(np.uint16).max else np.int32
+        np.savez_compressed(tmp_path, labels=labels.astype(dtype))
+        os.replace(tmp_path, path)
+        self._write_json(f"{digest}.json", metrics)
+
+    def pair(self, digest_t0, digest_t1):
+        return self._read_json(f"{digest_t0}-{digest_t1}.json")
+
+    def put_pair(self, digest_t0, digest_t1, changes):
+        self._write_json(f"{digest_t0}-{digest_t1}.json", changes)
+
+    def change_map(self, digest_t0, digest_t1):
+        return ChangeMap.load(self._path(f"{digest_t0}-{digest_t1}.changes.npz"))
+
+    def put_change_map(self, digest_t0, digest_t1, change_map):
+        change_map.save(self._path(f"{digest_t0}-{digest_t1}.changes.npz"))
+
+
+def scan_metrics(scan, store):
+    '''
+    Lesion metrics of a scan, computed on the first request only.
+
+    Returns:
+        tuple: (scan hash, metrics)
+    '''
+    digest = scan_hash(scan)
+    metrics = store.metrics(digest)
+    if metrics is not None and not store.has_labels(digest):
+        # Labels file lost: measured again, the changes with the next scans need the labels
+        metrics = None
+    CACHE_REQUESTS.inc(cache="scan_metrics", result="miss" if metrics is None else "hit")
+    if metrics is None:
+        # New scan: write its slice indexes once (see back_slice_index)
+        index_scan(scan)
+        volume = load_mask(scan["segmentation"])
+        labelled = label_lesions(volume.data)
+        metrics = lesion_metrics(volume.data, volume.spacing, labelled)
+        metrics["spacing"] = list(volume.spacing)
+        store.put(digest, metrics, labelled[0])
+    return digest, metrics
+
+
+def empty_changes():
+    '''
+    Change set of a pair without tracking (single scan, or labels not readable).
+    '''
+    return {"lesions": [], "summary": {}, "biggest_diff_slice": 0, "change_slices": []}
+
+
+def scan_changes(digest_t0, metrics_t0, digest_t1, metrics_t1, store):
+    '''
+    Lesion tracking and most changed slices between two scans, from their stored labels.
+    The change map of the pair is stored next to them (see back_changes). The change set
+    is empty, and not stored, when the labels of either scan cannot be read.
+    '''
+    changes = store.pair(digest_t0, digest_t1)
+    if changes is None:
+        labels_t0 = store.labels(digest_t0)
+        labels_t1 = store.labels(digest_t1)
+        if labels_t0 is None or labels_t1 is None:
+            print(f"Lesion labels of {digest_t0 if labels_t0 is None else digest_t1} not readable, no changes tracked")
+            return empty_changes()
+        changes = track_lesions(labels_t0, labels_t1, metrics_t0, metrics_t1)
+        change_map = ChangeMap.from_masks(labels_t0, labels_t1)
+        store.put_change_map(digest_t0, digest_t1, change_map)
+        changes["biggest_diff_slice"] = change_map.biggest_slice()
+        changes["change_slices"] = change_map.top_slices()
+        # Pair last: a stored pair always has its change map
+        store.put_pair(digest_t0, digest_t1, changes)
+    return changes
+
+
+def build_timeline(scans, store=None):
+    '''
+    Metrics of every scan and changes between consecutive scans.
+    Only the scans (and pairs) not stored yet are computed.
+
+    Args:
+        scans (list): Scans as returned by load_timeline, oldest first
+        store (ScanMetricsStore): Where the per-scan metrics are kept
+    Returns:
+        dict: "points" (one per scan: id, date, hash, metrics) and "changes"
+            (one per consecutive pair: from, to, tracking)
+    '''
+    store = store or ScanMetricsStore()
+    points = []
+    for scan in scans:
+        digest, metrics = scan_metrics(scan, store)
+        points.append({"id": scan["id"], "date": scan["date"], "hash": digest, "metrics": metrics})
+
+    changes = []
+    for previous, current in zip(points, points[1:]):
+        changes.append({
+            "from": previous["id"],
+            "to": current["id"],
+            **scan_changes(previous["hash"], previous["metrics"], current["hash"], current["metrics"], store),
+        })
+    return {"points": points, "changes": changes}
+
+
+def latest_change_map(scans, store=None):
+    '''
+    Change map between the two latest scans of a timeline (computed with the timeline if needed).
+
+    Returns:
+        ChangeMap: None when the timeline has a single scan
+    '''
+    store = store or ScanMetricsStore()
+    points = build_timeline(scans, store)["points"]
+    if len(points) < 2:
+        return None
+    return store.change_map(points[-2]["hash"], points[-1]["hash"])
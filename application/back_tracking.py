@@ -0,0 +1,109 @@
+'''
+Lesion tracking between two timepoints: connected lesions are matched through
+their voxel overlap, counted for every pair of labels with a single bincount
+'''
+# Dependencies
+import numpy as np
+
+# --- Configuration ---
+STABLE_RELATIVE_CHANGE = 0.05 # Volume change (fraction) under which a matched lesion is stable
+
+NEW, RESOLVED, GROWING, SHRINKING, STABLE = "new", "resolved", "growing", "shrinking", "stable"
+
+
+def overlap_matrix(labels_t0, count_t0, labels_t1, count_t1):
+    '''
+    Voxels shared by every pair of lesions, in one pass over the volumes.
+
+    Returns:
+        np.ndarray: (count_t0 + 1, count_t1 + 1) matrix; [i, j] is the number of voxels
+            in lesion i at t0 and lesion j at t1 (label 0 is the background)
+    '''
+    pairs = labels_t0.astype(np.int64) * (count_t1 + 1) + labels_t1
+    counts = np.bincount(pairs.ravel(), minlength=(count_t0 + 1) * (count_t1 + 1))
+    return counts.reshape(count_t0 + 1, count_t1 + 1)
+
+
+def _groups(overlap):
+    # Connected groups of overlapping lesions (several lesions can merge or split)
+    count_t0, count_t1 = overlap.shape[0] - 1, overlap.shape[1] - 1
+    parent = list(range(count_t0 + count_t1))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for i, j in np.argwhere(overlap[1:, 1:] > 0):
+        parent[find(int(i))] = find(count_t0 + int(j))
+
+    groups = {}
+    for node in range(count_t0 + count_t1):
+        t0, t1 = groups.setdefault(find(node), ([], []))
+        if node < count_t0:
+            t0.append(node + 1)
+        else:
+            t1.append(node - count_t0 + 1)
+    return list(groups.values())
+
+
+def _status(volume_t0, volume_t1):
+    if volume_t0 == 0:
+        return NEW
+    if volume_t1 == 0:
+        return RESOLVED
+    change = (volume_t1 - volume_t0) / volume_t0
+    if change > STABLE_RELATIVE_CHANGE:
+        return GROWING
+    if change < -STABLE_RELATIVE_CHANGE:
+        return SHRINKING
+    return STABLE
+
+
+def track_lesions(labels_t0, labels_t1, metrics_t0, metrics_t1):
+    '''
+    Match the lesions of two timepoints and classify each one.
+
+    Args:
+        labels_t0, labels_t1 (np.ndarray): Lesion labels of each timepoint (see back_lesions.label_lesions)
+        metrics_t0, metrics_t1 (dict): back_lesions.lesion_metrics of each timepoint (same labels)
+    Returns:
+        dict: "lesions", one entry per tracked site (labels, status, volume, diameter and
+            their changes, centroid, slice), and the number of sites per status
+    '''
+    by_label_t0 = {lesion["label"]: lesion for lesion in metrics_t0["lesions"]}
+    by_label_t1 = {lesion["label"]: lesion for lesion in metrics_t1["lesions"]}
+    overlap = overlap_matrix(labels_t0, metrics_t0["count"], labels_t1, metrics_t1["count"])
+
+    tracked = []
+    for group_t0, group_t1 in _groups(overlap):
+        lesions_t0 = [by_label_t0[label] for label in group_t0]
+        lesions_t1 = [by_label_t1[label] for label in group_t1]
+        volume_t0 = sum(lesion["volume"] for lesion in lesions_t0)
+        volume_t1 = sum(lesion["volume"] for lesion in lesions_t1)
+        diameter_t0 = max((lesion["diameter"] for lesion in lesions_t0), default=0.0)
+        diameter_t1 = max((lesion["diameter"] for lesion in lesions_t1), default=0.0)
+        # Position of the site: its largest lesion at the latest timepoint where it exists
+        largest = max(lesions_t1 or lesions_t0, key=lambda lesion: lesion["voxels"])
+        tracked.append({
+            "labels_t0": group_t0,
+            "labels_t1": group_t1,
+            "status": _status(volume_t0, volume_t1),
+            "volume_t0": volume_t0,
+            "volume_t1": volume_t1,
+            "volume_change": volume_t1 - volume_t0,
+            "diameter_t0": diameter_t0,
+            "diameter_t1": diameter_t1,
+            "diameter_change": diameter_t1 - diameter_t0,
+            "overlap_voxels": int(overlap[np.ix_(group_t0, group_t1)].sum()) if group_t0 and group_t1 else 0,
+            "centroid": largest["centroid"],
+            "slice": int(round(largest["centroid"][0])),
+        })
+
+    # Largest changes first
+    tracked.sort(key=lambda site: -abs(site["volume_change"]))
+    summary = {status: 0 for status in (NEW, RESOLVED, GROWING, SHRINKING, STABLE)}
+    for site in tracked:
+        summary[site["status"]] += 1
+    return {"lesions": tracked, "summary": summary}
@@ -0,0 +1,130 @@
+'''
+NIfTI loading shared by the application: segmentation masks as compact boolean
+arrays read slab by slab from the memory-mapped file, images as float32, and
+the voxel spacing (mm) taken from the header
+'''
+# Dependencies
+import numpy as np
+
+from back_metrics import NIFTI_LOAD_SECONDS
+from back_sparse import SparseMask, load_sidecar, write_sidecar
+# nibabel is imported on first use (fast server startup)
+
+# --- Configuration ---
+MASK_SLAB = 16 # Planes of a mask converted at a time (bounds the temporary memory)
+
+
+class Volume:
+    '''
+    Voxel data of a NIfTI file with its geometry.
+
+    Args:
+        data (np.ndarray): Voxel values (bool for masks, float32 for images)
+        spacing (tuple): Size of a voxel along each data axis (mm)
+        affine (np.ndarray): Voxel to world (RAS, mm) transform
+    '''
+
+    def __init__(self, data, spacing, affine):
+        self.data = data
+        self.spacing = spacing
+        self.affine = affine
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def voxel_volume(self):
+        '''Volume of one voxel (mm^3)'''
+        return float(np.prod(self.spacing))
+
+
+def _open(path):
+    import nibabel as nb
+    # mmap: uncompressed files are read through a memory map instead of in one block
+    return nb.load(path, mmap=True)
+
+
+def voxel_spacing(img):
+    '''
+    Voxel size (mm) along the three spatial axes, from the header zooms.
+    '''
+    return tuple(float(z) for z in img.header.get_zooms()[:3])
+
+
+def load_mask(path):
+    '''
+    Load a segmentation as a boolean mask (lesion where the stored value is > 0).
+    The run-length sidecar of the file is used when up to date (see back_sparse);
+    otherwise the file is read slab by slab, so the float64 volume is never
+    materialised, and the sidecar is written for the next loads.
+
+    Returns:
+        Volume: bool data, spacing and affine
+    '''
+    with NIFTI_LOAD_SECONDS.time():
+        sparse = load_sidecar(path)
+        if sparse is not None:
+            return Volume(sparse.to_mask(), sparse.spacing, sparse.affine)
+        img = _open(path)
+        proxy = img.dataobj
+        mask = np.empty(img.shape, dtype=bool)
+        # NIfTI data is stored in Fortran order: slabs along the last axis are contiguous reads
+        for start in range(0, img.shape[-1], MASK_SLAB):
+            slab = (Ellipsis, slice(start, start + MASK_SLAB))
+            np.greater(np.asarray(proxy[slab]), 0, out=mask[slab])
+        volume = Volume(mask, voxel_spacing(img), img.affine)
+        write_sidecar(path, SparseMask.from_mask(mask, volume.spacing, volume.affine))
+        return volume
+
+
+def load_sparse_mask(path):
+    '''
+    Run-length encoded mask of a segmentation, from its sidecar (created on first use).
+
+    Returns:
+        SparseMask: runs, spacing and affine
+    '''
+    sparse = load_sidecar(path)
+    if sparse is None:
+        volume = load_mask(path)
+        sparse = SparseMask.from_mask(volume.data, volume.spacing, volume.affine)
+    return sparse
+
+
+def load_labels(path):
+    '''
+    Load a segmentation with its label values (uint8: nnU-Net labels are small integers),
+    read slab by slab like load_mask.
+
+    Returns:
+        Volume: uint8 data, spacing and affine
+    '''
+    with NIFTI_LOAD_SECONDS.time():
+        img = _open(path)
+        proxy = img.dataobj
+        labels = np.empty(img.shape, dtype=np.uint8)
+        for start in range(0, img.shape[-1], MASK_SLAB):
+            slab = (Ellipsis, slice(start, start + MASK_SLAB))
+            labels[slab] = np.rint(np.asarray(proxy[slab]))
+        return Volume(labels, voxel_spacing(img), img.affine)
+
+
+def load_affine(path):
+    '''
+    Voxel to world (RAS, mm) transform of a NIfTI file (header only).
+    '''
+    return _open(path).affine
+
+
+def load_image(path):
+    '''
+    Load an MRI as float32 (half the memory of get_fdata's float64).
+
+    Returns:
+        Volume: float32 data, spacing and affine
+    '''
+    with NIFTI_LOAD_SECONDS.time():
+        img = _open(path)
+        data = img.get_fdata(dtype=np.float32, caching="unchanged")
+        return Volume(data, voxel_spacing(img), img.affine)
@@ -0,0 +1,184 @@
+'''
+Batch regeneration of the reports of a cohort (e.g. after a model update).
+Patients are processed on a process pool; the lesion metrics of scans already
+measured are read from the shared scan metrics store (back_timeline), so only
+new scans are computed.
+
+Manifest (JSON, paths relative to the manifest):
+    {"patients": [
+        {"name": "John Doe", "timeline": "mri/timeline.json"},
+        {"name": "Jane Roe", "scans": [{"id": "0", "date": "2025-03-24", "segmentation": "jr/0.seg/mri_file.nii"}, ...]}
+    ]}
+
+Usage:
+    python batch_reports.py manifest.json
+    python batch_reports.py manifest.json --workers 8 --output ./batch --no-pdf
+'''
+# Dependencies
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from back_metrics import REGISTRY, call_with_metrics
+from back_report import client_folder_name, generate_client_report, render_report
+from back_timeline import load_timeline, resolve_scans
+
+# --- Configuration ---
+BATCH_FOLDER = "./batch_reports"
+SUMMARY_FILE = "summary.csv"
+# Stages of a report, as recorded in the report histograms
+STAGES = [
+    ("medgemma_report_metric_seconds", "timeline"),
+    ("medgemma_report_metric_seconds", "location"),
+    ("medgemma_report_metric_seconds", "severity"),
+    ("medgemma_report_render_seconds", "html"),
+    ("medgemma_report_render_seconds", "pdf"),
+]
+SUMMARY_COLUMNS = ["patient", "status", "scans", "computed_scans", "severity", "volume_ml",
+                   "max_diameter_cm", "seconds"] + [f"{stage}_s" for _, stage in STAGES] + ["folder", "error"]
+
+
+def load_manifest(path):
+    '''
+    Patients of a manifest, each with its scans (oldest first).
+
+    Returns:
+        list: dicts with name and scans
+    '''
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    folder = os.path.dirname(os.path.abspath(path))
+    patients = []
+    for patient in manifest["patients"]:
+        if "timeline" in patient:
+            scans = load_timeline(os.path.join(folder, patient["timeline"]))
+        else:
+            scans = resolve_scans(patient["scans"], folder)
+        patients.append({"name": patient["name"], "scans": scans})
+    return patients
+
+
+def patient_folder(output, name):
+    return os.path.join(output, client_folder_name(name))
+
+
+def report_patient(patient, output, pdf=True):
+    '''
+    Compute and render the report of one patient into its own folder.
+    Module level so it can run in a worker process.
+
+    Returns:
+        dict: Summary row of the patient (without the stage timings)
+    '''
+    folder = patient_folder(output, patient["name"])
+    row = {"patient": patient["name"], "scans": len(patient["scans"]), "folder": folder}
+    start = time.perf_counter()
+    try:
+        info_json = generate_client_report(patient["name"], scans=patient["scans"])
+        render_report(info_json, folder, pdf=pdf)
+        row.update(
+            status="ok",
+            severity=info_json["severity"],
+            volume_ml=round(info_json["volume_t1"], 3),
+            max_diameter_cm=round(info_json["max_diameter_t1"], 2),
+        )
+    except Exception as e:
+        row.update(status="failed", error=f"{type(e).__name__}: {e}")
+    row["seconds"] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def stage_seconds(snapshot):
+    '''
+    Seconds spent in each report stage, from a metrics snapshot.
+    '''
+    return {stage: snapshot.get(metric, {}).get((stage,), {}).get("sum", 0.0) for metric, stage in STAGES}
+
+
+def computed_scans(snapshot):
+    '''
+    Scans whose metrics were not in the store, from a metrics snapshot.
+    '''
+    return snapshot.get("medgemma_cache_requests_total", {}).get(("scan_metrics", "miss"), 0)
+
+
+def run_batch(patients, output=BATCH_FOLDER, workers=None, pdf=True):
+    '''
+    Reports of every patient on a pool of worker processes.
+
+    Args:
+        patients (list): Output of load_manifest
+        output (str): Folder receiving one sub-folder per patient and the summary
+        workers (int): Worker processes (default: number of CPUs)
+        pdf (bool): Also render the PDFs
+    Returns:
+        tuple: (summary rows in manifest order, wall clock seconds)
+    '''
+    os.makedirs(output, exist_ok=True)
+    workers = workers or os.cpu_count()
+    rows = [None] * len(patients)
+    start = time.perf_counter()
+    # spawn: same start method as the report pool of the server (back_executor)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(call_with_metrics, report_patient, patient, output, pdf): i
+            for i, patient in enumerate(patients)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            row, snapshot = future.result()
+            REGISTRY.merge(snapshot)
+            row.update({f"{stage}_s": round(seconds, 3) for stage, seconds in stage_seconds(snapshot).items()})
+            row["computed_scans"] = computed_scans(snapshot)
+            rows[futures[future]] = row
+            print(f"[{done}/{len(patients)}] {row['patient']}: {row['status']} ({row['seconds']:.2f} s)")
+    return rows, time.perf_counter() - start
+
+
+def write_summary(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({column: row.get(column, "") for column in SUMMARY_COLUMNS})
+    return path
+
+
+def print_summary(rows, wall_seconds, workers):
+    ok = [row for row in rows if row["status"] == "ok"]
+    print(f"\n{'patient':<24} {'status':<7} {'scans':>5} {'severity':<9} {'volume mL':>9} {'diam cm':>7} {'seconds':>8}")
+    for row in rows:
+        print(f"{row['patient'][:24]:<24} {row['status']:<7} {row['scans']:>5} {row.get('severity', '-'):<9} "
+              f"{row.get('volume_ml', '-'):>9} {row.get('max_diameter_cm', '-'):>7} {row['seconds']:>8.2f}")
+
+    print(f"\n{len(ok)}/{len(rows)} reports in {wall_seconds:.1f} s with {workers} worker(s): "
+          f"{len(ok) / wall_seconds * 60:.1f} patients/min")
+    print(f"Scans measured: {sum(row['computed_scans'] for row in rows)}, "
+          f"reused: {sum(row['scans'] - row['computed_scans'] for row in rows)}")
+    print(f"\n{'stage':<10} {'total s':>8} {'median s':>9} {'max s':>7}")
+    for _, stage in STAGES:
+        values = [row[f"{stage}_s"] for row in ok]
+        if values and any(values):
+            print(f"{stage:<10} {sum(values):>8.2f} {statistics.median(values):>9.3f} {max(values):>7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate the reports of every patient of a manifest")
+    parser.add_argument("manifest", help="JSON manifest of patients and scans")
+    parser.add_argument("--output", default=BATCH_FOLDER, help="Folder of the reports and of the summary")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--no-pdf", action="store_true", help="Only write report.json and report.html")
+    args = parser.parse_args()
+
+    patients = load_manifest(args.manifest)
+    rows, wall_seconds = run_batch(patients, args.output, args.workers, pdf=not args.no_pdf)
+    print_summary(rows, wall_seconds, args.workers)
+    print(f"\nSummary: {write_summary(rows, os.path.join(args.output, SUMMARY_FILE))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+'''
+Benchmark of the lesion metrics engine (back_lesions) against the previous
+full-volume metrics, on synthetic 240x240x155 segmentations. The engine runs with
+the voxel size implied by the previous constants and both outputs are compared in
+mm and mm^3: volume and count must match; the previous diameter (twice the largest
+inscribed radius) is a lower bound of the engine's Feret diameter.
+
+Usage:
+    python bench_lesions.py                     # 12 lesions, 3 runs
+    python bench_lesions.py --lesions 40 --repeat 5
+'''
+# Dependencies
+import argparse
+import statistics
+import time
+
+import numpy as np
+from scipy.ndimage import label, center_of_mass, distance_transform_edt
+
+from back_lesions import lesion_metrics
+
+SHAPE = (155, 240, 240)
+# Constants of the previous metrics (the engine uses the NIfTI spacing instead)
+PIXEL_AREA_ON_MRI = 0.004 # in cm^2
+DISTANCE_BETWEEN_SLICES = 0.1 # in cm
+MM_PER_CM = 10
+# Voxel size (mm) of those constants: slice distance, then the side of a square pixel
+LEGACY_SPACING = (DISTANCE_BETWEEN_SLICES * MM_PER_CM,) + (PIXEL_AREA_ON_MRI ** 0.5 * MM_PER_CM,) * 2
+REL_TOLERANCE = 1e-6
+
+
+def synthetic_segmentation(lesions, seed=0):
+    '''
+    float64 volume (as returned by get_fdata) with random ellipsoidal lesions.
+    '''
+    rng = np.random.default_rng(seed)
+    segmentation = np.zeros(SHAPE)
+    for _ in range(lesions):
+        radii = rng.uniform(2, 12, size=3)
+        center = [rng.uniform(r, n - r) for r, n in zip(radii, SHAPE)]
+        box = tuple(slice(int(max(c - r - 1, 0)), int(min(c + r + 2, n))) for c, r, n in zip(center, radii, SHAPE))
+        grid = np.ogrid[box]
+        inside = sum(((g - c) / r) ** 2 for g, c, r in zip(grid, center, radii)) <= 1
+        segmentation[box][inside] = 1
+    return segmentation
+
+
+def legacy_metrics(segmentation):
+    '''
+    Metrics as computed before the engine: one full-volume pass per metric.
+    '''
+    volume = np.sum(segmentation > 0) * PIXEL_AREA_ON_MRI * DISTANCE_BETWEEN_SLICES
+    _, count = label(segmentation > 0)
+    coords = np.argwhere(segmentation > 0)
+    center_of_mass(segmentation)
+    max_distance = np.max(distance_transform_edt(segmentation > 0)[tuple(coords.T)]) if coords.size else 0.0
+    return {"volume": float(volume), "count": count, "max_diameter": float(max_distance * 2 * PIXEL_AREA_ON_MRI**0.5)}
+
+
+def legacy_in_mm(legacy):
+    '''
+    Previous metrics converted from cm^3 and cm to mm^3 and mm.
+    '''
+    return {
+        "volume": legacy["volume"] * MM_PER_CM ** 3,
+        "count": legacy["count"],
+        "max_diameter": legacy["max_diameter"] * MM_PER_CM,
+    }
+
+
+def check_agreement(legacy, engine):
+    '''
+    Raise AssertionError if the engine disagrees with the previous metrics (both in mm).
+    '''
+    assert engine["count"] == legacy["count"], f"count: {engine['count']} != {legacy['count']}"
+    assert np.isclose(engine["volume"], legacy["volume"], rtol=REL_TOLERANCE), \
+        f"volume: {engine['volume']} != {legacy['volume']} mm^3"
+    assert engine["max_diameter"] >= legacy["max_diameter"] * (1 - REL_TOLERANCE), \
+        f"max_diameter: Feret {engine['max_diameter']} < inscribed {legacy['max_diameter']} mm"
+
+
+def timed(fn, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lesion metrics engine benchmark")
+    parser.add_argument("--lesions", type=int, default=12, help="Lesions per synthetic volume")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per implementation (median is reported)")
+    args = parser.parse_args()
+
+    segmentation = synthetic_segmentation(args.lesions)
+    print(f"Volume {SHAPE}, {args.lesions} lesions, {np.count_nonzero(segmentation)} lesion voxels")
+
+    legacy, legacy_time = timed(legacy_metrics, segmentation, repeat=args.repeat)
+    engine, engine_time = timed(lambda s: lesion_metrics(s > 0, LEGACY_SPACING), segmentation, repeat=args.repeat)
+
+    legacy = legacy_in_mm(legacy)
+    for name, unit in (("volume", "mm^3"), ("count", ""), ("max_diameter", "mm")):
+        print(f"  {name:<14} legacy {legacy[name]:12.4f}   engine {engine[name]:12.4f} {unit}")
+    check_agreement(legacy, engine)
+    print("volume and count match, Feret diameter >= inscribed diameter")
+    print(f"legacy {legacy_time * 1000:8.1f} ms")
+    print(f"engine {engine_time * 1000:8.1f} ms  (x{legacy_time / engine_time:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+'''
+Benchmark of the atlas lobe localization (back_localization) against the
+per-slice MedGemma localization: latency, share of ambiguous cases (sent to
+MedGemma) and agreement, on synthetic lesions and on the scans of the timeline.
+
+The synthetic lesions are placed with the atlas under test, so they only check
+that the bincount path returns the lobe it was given (self-consistency), not that
+the atlas is right. Accuracy is only reported against labelled cases (--labels,
+e.g. lobes read by a radiologist) or MedGemma answers (--medgemma).
+
+Labels (JSON, paths relative to the file):
+    {"cases": [{"segmentation": "lumiere/001.seg/mri_file.nii", "lobe": "frontal"}, ...]}
+
+Usage:
+    python bench_localization.py                  # atlas only, 40 synthetic cases
+    python bench_localization.py --medgemma       # also query the fine-tuned endpoint
+    python bench_localization.py --labels labels.json
+'''
+# Dependencies
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from back_localization import LOBES, load_atlas, localize_lesions
+from back_timeline import load_timeline
+
+
+def synthetic_case(atlas, lobe, rng, lesions=3):
+    '''
+    Segmentation (float64, as stored by nnU-Net) with a few ellipsoidal lesions centered in one lobe.
+    '''
+    segmentation = np.zeros(atlas.shape)
+    candidates = np.argwhere(atlas == LOBES.index(lobe) + 1)
+    for center in candidates[rng.integers(len(candidates), size=lesions)]:
+        radii = rng.uniform(2, 8, size=3)
+        box = tuple(slice(int(max(c - r - 1, 0)), int(min(c + r + 2, n))) for c, r, n in zip(center, radii, atlas.shape))
+        grid = np.ogrid[box]
+        inside = sum(((g - c) / r) ** 2 for g, c, r in zip(grid, center, radii)) <= 1
+        segmentation[box][inside] = 1
+    return segmentation
+
+
+def write_cases(folder, cases, seed=0):
+    '''
+    Synthetic segmentations, cycling through the lobes.
+
+    Returns:
+        list: (path, expected lobe)
+    '''
+    import nibabel as nb
+    atlas = load_atlas()
+    rng = np.random.default_rng(seed)
+    written = []
+    for i in range(cases):
+        lobe = LOBES[i % len(LOBES)]
+        path = os.path.join(folder, f"case_{i:03d}.nii")
+        nb.save(nb.Nifti1Image(synthetic_case(atlas, lobe, rng), np.eye(4)), path)
+        written.append((path, lobe))
+    return written
+
+
+def labelled_cases(path):
+    '''
+    Returns:
+        list: (segmentation path, labelled lobe) of a labels file
+    '''
+    with open(path, "r") as f:
+        cases = json.load(f)["cases"]
+    folder = os.path.dirname(os.path.abspath(path))
+    return [(os.path.join(folder, case["segmentation"]), case["lobe"]) for case in cases]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atlas vs. MedGemma lobe localization")
+    parser.add_argument("--cases", type=int, default=40, help="Synthetic cases")
+    parser.add_argument("--medgemma", action="store_true", help="Also run the MedGemma localization on every case")
+    parser.add_argument("--labels", help="JSON file of segmentations with a labelled lobe")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cases = [(path, lobe, "synthetic") for path, lobe in write_cases(folder, args.cases)]
+        if args.labels:
+            cases += [(path, lobe, "labelled") for path, lobe in labelled_cases(args.labels)]
+        cases += [(scan["segmentation"], None, "timeline") for scan in load_timeline()]
+        load_atlas()  # read once, as in a running worker
+
+        rows = []
+        for path, expected, kind in cases:
+            location, seconds = timed(localize_lesions, path)
+            row = {"kind": kind, "expected": expected, "atlas": location["lobe"], "ambiguous": location["ambiguous"],
+                   "atlas_s": seconds}
+            if args.medgemma:
+                from back_irm_analysis import run_medgemma_location
+                row["medgemma"], row["medgemma_s"] = timed(run_medgemma_location, path)
+            rows.append(row)
+
+    synthetic = [row for row in rows if row["kind"] == "synthetic" and not row["ambiguous"]]
+    labelled = [row for row in rows if row["kind"] == "labelled"]
+    print(f"{len(rows)} cases ({args.cases} synthetic, {len(labelled)} labelled)")
+    print(f"Atlas latency: median {statistics.median(r['atlas_s'] for r in rows) * 1000:.1f} ms, "
+          f"max {max(r['atlas_s'] for r in rows) * 1000:.1f} ms (including the mask load)")
+    print(f"Ambiguous (sent to MedGemma): {sum(r['ambiguous'] for r in rows)}/{len(rows)}")
+    if synthetic:
+        # Lesions placed with the same atlas: a self-consistency check, not an accuracy
+        consistent = sum(r["atlas"] == r["expected"] for r in synthetic)
+        print(f"Self-consistency (synthetic cases placed with the atlas): {consistent}/{len(synthetic)}")
+    if labelled:
+        confident = [r for r in labelled if not r["ambiguous"]]
+        correct = sum(r["atlas"] == r["expected"] for r in confident)
+        print(f"Atlas accuracy (non ambiguous labelled cases): {correct}/{len(confident)}")
+    if args.medgemma:
+        real = [r for r in rows if r["kind"] != "synthetic" and not r["ambiguous"]]
+        agree = sum(r["atlas"] == r["medgemma"] for r in real)
+        print(f"MedGemma latency: median {statistics.median(r['medgemma_s'] for r in rows):.1f} s")
+        print(f"Atlas vs. MedGemma agreement (non ambiguous labelled and timeline cases): {agree}/{len(real)}")
+        if labelled:
+            correct = sum(r["medgemma"] == r["expected"] for r in labelled)
+            print(f"MedGemma accuracy (labelled cases): {correct}/{len(labelled)}")
+
+
+if __name__ == "__main__":
+    main()
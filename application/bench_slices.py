@@ -0,0 +1,102 @@
+'''
+Benchmark of the slice export (back_slices.export_study) against the previous
+per-slice loop of slice.extract_files, on the scans of the timeline: wall time
+per study (image, segmentation and difference layers of every scan).
+
+Usage:
+    python bench_slices.py                    # 3 runs, default thread count
+    python bench_slices.py --threads 1 4 8 --repeat 5
+'''
+# Dependencies
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from back_slices import EXPORT_THREADS, export_study
+from back_timeline import load_timeline, latest_change_map
+from back_volumes import load_image, load_mask
+
+
+def legacy_export(scans, output):
+    '''
+    Previous export: every slice normalised, colored and written one by one, volumes reloaded per layer.
+    '''
+    for scan in scans:
+        data = load_image(scan["image"]).data
+        folder = os.path.join(output, scan["id"])
+        os.makedirs(folder, exist_ok=True)
+        for i in range(data.shape[0]):
+            slice = data[i]
+            min_val, max_val = np.min(slice), np.max(slice)
+            slice = ((slice - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+            cv2.imwrite(os.path.join(folder, f"slice_{i:03d}.jpg"), slice)
+
+    for scan in scans:
+        segmentation = load_mask(scan["segmentation"]).data
+        orig_data = load_image(scan["image"]).data
+        folder = os.path.join(output, f"{scan['id']}.seg")
+        os.makedirs(folder, exist_ok=True)
+        for i in range(orig_data.shape[0]):
+            orig_slice = orig_data[i]
+            min_val, max_val = np.min(orig_slice), np.max(orig_slice)
+            orig_slice = ((orig_slice - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+            color_image = cv2.cvtColor(orig_slice, cv2.COLOR_GRAY2BGR)
+            color_image[segmentation[i] > 0] = [0, 0, 255]
+            cv2.imwrite(os.path.join(folder, f"slice_{i:03d}.jpg"), color_image)
+
+    folder = os.path.join(output, "difference")
+    os.makedirs(folder, exist_ok=True)
+    seg_0 = load_mask(scans[-2]["segmentation"]).data
+    seg_1 = load_mask(scans[-1]["segmentation"]).data
+    diff = seg_1 != seg_0
+    orig_data = load_image(scans[-1]["image"]).data
+    for i in range(orig_data.shape[0]):
+        orig_slice = orig_data[i]
+        min_val, max_val = np.min(orig_slice), np.max(orig_slice)
+        orig_slice = ((orig_slice - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+        color_image = cv2.cvtColor(orig_slice, cv2.COLOR_GRAY2BGR)
+        color_image[diff[i]] = [0, 0, 255]
+        cv2.imwrite(os.path.join(folder, f"slice_{i:03d}.jpg"), color_image)
+
+
+def timed_runs(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as output:
+            start = time.perf_counter()
+            fn(output)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slice export: pipeline vs. per-slice loop")
+    parser.add_argument("--threads", nargs="+", type=int, default=[EXPORT_THREADS], help="Encoding threads to compare")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    scans = load_timeline()
+    # Warm the per-scan caches (metrics, change map, slice index, mask sidecars) as in the server
+    latest_change_map(scans)
+    with tempfile.TemporaryDirectory() as output:
+        export_study(scans, output)
+
+    print(f"{len(scans)} scans, {load_image(scans[0]['image']).shape[0]} slices each, {os.cpu_count()} CPUs")
+    legacy = timed_runs(lambda output: legacy_export(scans, output), args.repeat)
+    print(f"per-slice loop:      {legacy:6.2f} s per study")
+    for threads in args.threads:
+        seconds = timed_runs(lambda output: export_study(scans, output, threads), args.repeat)
+        print(f"pipeline {threads:>2} thread(s): {seconds:6.2f} s per study  x{legacy / seconds:4.1f}")
+
+    with tempfile.TemporaryDirectory() as output:
+        timings = export_study(scans, output)
+    print("stages: " + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in timings.items() if stage != "slices"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+'''
+Import-time benchmark of the backend modules, to keep server startup fast.
+
+Usage:
+    python bench_startup.py                          # back.py, top 15 imports
+    python bench_startup.py --modules back back_report --repeat 5
+    python bench_startup.py --save startup.json      # record a baseline
+    python bench_startup.py --baseline startup.json  # exit 1 if startup regressed
+'''
+# Dependencies
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["back", "back_report", "back_chat", "back_irm_analysis", "back_segmentation"]
+TOLERANCE = 0.25 # Allowed slowdown against the baseline before failing
+
+
+def import_profile(module):
+    '''
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: top-level package -> cumulative import time (ms)
+    '''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, raw_name = line[len("import time:"):].split("|")
+        # Indentation is one space for the module itself, three for its direct imports
+        indent = len(raw_name) - len(raw_name.lstrip(" "))
+        if indent <= 3 and raw_name.strip() != "site":
+            profile[raw_name.strip()] = int(cumulative_us) / 1000
+    return profile
+
+
+def import_wall_time(module):
+    '''
+    Wall time (ms) of `import module` in a fresh interpreter.
+    '''
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - t) * 1000)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the backend")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports shown for the first module")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a JSON file written with --save")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        results[module] = statistics.median(import_wall_time(module) for _ in range(args.repeat))
+        print(f"{module:<24} {results[module]:8.1f} ms")
+
+    profile = import_profile(args.modules[0])
+    print(f"\nSlowest imports of {args.modules[0]} (cumulative):")
+    for name, ms in sorted(profile.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<40} {ms:8.1f} ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"\nSaved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = [
+            module for module, ms in results.items()
+            if module in baseline and ms > baseline[module] * (1 + TOLERANCE)
+        ]
+        for module in regressions:
+            print(f"REGRESSION {module}: {baseline[module]:.1f} ms -> {results[module]:.1f} ms")
+        if regressions:
+            sys.exit(1)
+        print("\nNo startup regression.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+'''
+Throughput benchmark of the API against the number of uvicorn workers.
+Every worker reads the same shared state store, so the requests of one patient
+can be served by any of them.
+
+Usage:
+    python bench_workers.py                         # 1, 2 and 4 workers, 10 s each
+    python bench_workers.py --workers 1 4 --clients 16 --duration 20
+'''
+# Dependencies
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from back_storage import SQLiteStateStore
+
+BENCH_CLIENT = "bench"
+BENCH_MESSAGES = 20 # Messages of the seeded chat
+START_TIMEOUT_SECONDS = 60
+
+
+def seed_state(path):
+    '''
+    Store a chat, a report and a finished job for the benchmark requests.
+
+    Returns:
+        list: Paths requested by the clients
+    '''
+    store = SQLiteStateStore(path)
+    history = [{"role": "assistant" if i % 2 else "user", "content": f"Message {i} " + "lorem ipsum " * 40}
+               for i in range(BENCH_MESSAGES)]
+    store.save_chat(BENCH_CLIENT, "default", {
+        "report_hash": "0" * 64, "history": history, "summary": "", "summarized_upto": 1,
+    })
+    store.save_report_meta(BENCH_CLIENT, {"report_hash": "0" * 64, "generated_at": time.time(), "cached": False})
+    store.save_job({
+        "id": "benchjob", "kind": "report", "params": {"client_name": BENCH_CLIENT}, "status": "done",
+        "stage": None, "stages": {"metrics": "done", "render": "done"}, "progress": 1.0, "detail": None,
+        "result": {"response": "ok"}, "error": None, "attempts": 1, "created_at": time.time(),
+    })
+    return [
+        f"/chat/history?client_name={BENCH_CLIENT}",
+        f"/report/{BENCH_CLIENT}",
+        "/jobs/benchjob",
+    ]
+
+
+def start_server(workers, port, state_db):
+    env = dict(os.environ, MEDGEMMA_STATE_DB=state_db)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "back:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + START_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"Server with {workers} worker(s) did not start")
+
+
+def client_loop(args):
+    '''
+    Send requests over one keep-alive connection until the deadline.
+
+    Returns:
+        tuple: (successful requests, failed requests)
+    '''
+    port, paths, deadline = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    ok = failed = 0
+    i = 0
+    while time.time() < deadline:
+        try:
+            connection.request("GET", paths[i % len(paths)])
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                ok += 1
+            else:
+                failed += 1
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        i += 1
+    return ok, failed
+
+
+def run(workers, clients, duration, port, state_db, paths):
+    server = start_server(workers, port, state_db)
+    try:
+        # Warm-up so every worker has opened its database connection
+        with multiprocessing.Pool(clients) as pool:
+            pool.map(client_loop, [(port, paths, time.time() + 1)] * clients)
+            deadline = time.time() + duration
+            results = pool.map(client_loop, [(port, paths, deadline)] * clients)
+    finally:
+        server.terminate()
+        server.wait()
+    ok = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return ok / duration, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the API per number of workers")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per worker count")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        state_db = os.path.join(folder, "state.db")
+        paths = seed_state(state_db)
+
+        print(f"{args.clients} clients, {args.duration:.0f} s per run, {os.cpu_count()} CPUs")
+        baseline = None
+        for workers in args.workers:
+            throughput, failed = run(workers, args.clients, args.duration, args.port, state_db, paths)
+            baseline = baseline or throughput
+            print(f"{workers:>2} worker(s): {throughput:8.0f} req/s  x{throughput / baseline:4.2f}  ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -68,17 +68,47 @@ export default function ChatPage({ params }: { params: { patient: string } }) {
     setSending(true);
 
     try {
-      const response = await fetch("http://localhost:8000/chat/send", {
+      const response = await fetch("http://localhost:8000/chat/send/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ message: userMessage.content }),
+        body: JSON.stringify({ client_name: capitalizedName, message: userMessage.content }),
       });
 
-      if (response.ok) {
-        const assistantMessage = await response.json();
-        setMessages(prev => [...prev, assistantMessage]);
+      if (response.ok && response.body) {
+        // Append an empty assistant message and grow it as tokens arrive
+        setMessages(prev => [...prev, { role: "assistant", content: "" }]);
+        const updateLast = (content: string) =>
+          setMessages(prev => [...prev.slice(0, -1), { role: "assistant", content }]);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let content = "";
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+
+          // Server-Sent Events are separated by a blank line
+          const events = buffer.split("\n\n");
+          buffer = events.pop() || "";
+          for (const raw of events) {
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const data = raw.match(/^data: (.*)$/m)?.[1];
+            if (!event || !data) continue;
+            const payload = JSON.parse(data);
+            if (event === "token") {
+              content += payload.content;
+              updateLast(content);
+            } else if (event === "done") {
+              updateLast(payload.content);
+            } else if (event === "error") {
+              updateLast("There was an error. Please start a new chat session.");
+            }
+          }
+        }
       }
     } catch (error) {
       console.error("Error sending message:", error);
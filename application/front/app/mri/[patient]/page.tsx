@@ -1,71 +1,204 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef, SyntheticEvent } from "react";
 import Link from "next/link";
 
+// Most changed slice between the two scans (written with the difference slices)
+type ChangeSlice = { slice: number; new: number; resolved: number };
+
+// Sprite sheet of a series: every slice in one image, row by row (see sheet.json)
+type Sheet = { url: string; slices: number; columns: number; rows: number; level: number };
+
+// Displayed size (pixels) asked for while scrubbing: the backend answers with its 1/4 resolution level
+const PREVIEW_SIZE = 64;
+
+// Slice drawn from the sprite sheet of its series once loaded, from the single slice endpoint before
+function SliceImage({ sheet, src, slice, alt, onLoad, onError }: {
+  sheet?: Sheet;
+  src: string;
+  slice: number;
+  alt: string;
+  onLoad?: () => void;
+  onError: (e: SyntheticEvent<HTMLImageElement>) => void;
+}) {
+  if (sheet) {
+    const column = slice % sheet.columns;
+    const row = Math.floor(slice / sheet.columns);
+    return (
+      <div
+        role="img"
+        aria-label={alt}
+        className="w-full h-full"
+        style={{
+          backgroundImage: `url(${sheet.url})`,
+          backgroundSize: `${sheet.columns * 100}% ${sheet.rows * 100}%`,
+          backgroundPosition: `${sheet.columns > 1 ? (column / (sheet.columns - 1)) * 100 : 0}% ${sheet.rows > 1 ? (row / (sheet.rows - 1)) * 100 : 0}%`,
+        }}
+      />
+    );
+  }
+  return <img src={src} alt={alt} className="w-full h-full object-contain" onLoad={onLoad} onError={onError} />;
+}
+
 export default function MRIViewer({ params }: { params: { patient: string } }) {
   const patientName = params.patient.replace("-", " ");
   const [currentSlice, setCurrentSlice] = useState(77); // Middle slice (154/2)
   const [showSegmentation, setShowSegmentation] = useState(false);
   const [showProgression, setShowProgression] = useState(false);
   const [imagesLoaded, setImagesLoaded] = useState(true);
-
-  const totalSlices = 154;
+  const [changeSlices, setChangeSlices] = useState<ChangeSlice[]>([]);
+  const [largestLesionSlice, setLargestLesionSlice] = useState<number | null>(null);
+  // Plane of the slices (the change and lesion slice indexes are axial)
+  const [view, setView] = useState<"axial" | "coronal" | "sagittal">("axial");
+  // Slice count of the current view (from its sprite sheet layout)
+  const [totalSlices, setTotalSlices] = useState(155);
+  // Loaded sprite sheets, by series and view ("scan/layer?view=...")
+  const [sheets, setSheets] = useState<Record<string, Sheet>>({});
+  // Slider being dragged: slices are loaded at preview size until it rests
+  const [scrubbing, setScrubbing] = useState(false);
+  const scrubTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
   const leftDate = "2025-03-24";
   const rightDate = "2025-04-18";
 
-  // Format slice number with leading zeros
-  const formatSliceNumber = (slice: number) => {
-    return slice.toString().padStart(3, '0');
-  };
+  // Slices are rendered on demand by the backend: /mri/{patient}/{scan}/{layer}/...
+  const seriesUrl = (series: string) => `http://localhost:8000/mri/${params.patient}/${series}`;
 
-  // Get image paths based on segmentation or progression toggle
-  const getImagePaths = () => {
-    const basePath = "/mri/";
-    let leftFolder = "0";
-    let rightFolder;
+  // Series ("scan/layer") shown based on segmentation or progression toggle
+  const getSeries = () => {
     if (showProgression) {
-      rightFolder = "difference";
-    } else if (showSegmentation) {
-      leftFolder = "0.seg";
-      rightFolder = "1.seg";
-    } else {
-      rightFolder = "1";
+      return { left: "0/image", right: "1/difference" };
     }
-    const sliceFile = `slice_${formatSliceNumber(currentSlice)}.jpg`;
+    const layer = showSegmentation ? "seg" : "image";
+    return { left: `0/${layer}`, right: `1/${layer}` };
+  };
+
+  const series = getSeries();
+  const sheetKey = (name: string) => `${name}?view=${view}`;
+  const getImagePaths = (slice: number, preview = false) => {
+    const query = preview ? `?view=${view}&size=${PREVIEW_SIZE}` : `?view=${view}`;
     return {
-      left: `${basePath}${leftFolder}/${sliceFile}`,
-      right: `${basePath}${rightFolder}/${sliceFile}`
+      left: `${seriesUrl(series.left)}/${slice}.jpg${query}`,
+      right: `${seriesUrl(series.right)}/${slice}.jpg${query}`,
     };
   };
 
-  const imagePaths = getImagePaths();
+  const imagePaths = getImagePaths(currentSlice, scrubbing);
+
+  const scrubTo = (slice: number) => {
+    setCurrentSlice(slice);
+    setScrubbing(true);
+    if (scrubTimer.current) {
+      clearTimeout(scrubTimer.current);
+    }
+    scrubTimer.current = setTimeout(() => setScrubbing(false), 250);
+  };
 
   useEffect(() => {
-    // Preload some images around current slice for smoother navigation
-    const preloadImages = () => {
-      const range = 5; // Preload 5 slices before and after
-      for (let i = Math.max(0, currentSlice - range); i <= Math.min(totalSlices - 1, currentSlice + range); i++) {
-        // Preload left image
-        let leftSrc = `/mri/0/slice_${formatSliceNumber(i)}.jpg`;
-        let rightSrc;
-        if (showProgression) {
-          rightSrc = `/mri/difference/slice_${formatSliceNumber(i)}.jpg`;
-        } else if (showSegmentation) {
-          leftSrc = `/mri/0.seg/slice_${formatSliceNumber(i)}.jpg`;
-          rightSrc = `/mri/1.seg/slice_${formatSliceNumber(i)}.jpg`;
-        } else {
-          rightSrc = `/mri/1/slice_${formatSliceNumber(i)}.jpg`;
+    // Slices with the most new / resolved voxels, from the change map of the two scans
+    const loadChanges = async () => {
+      try {
+        const response = await fetch("/mri/difference/changes.json");
+        if (response.ok) {
+          const changes = await response.json();
+          setChangeSlices(changes.top_slices || []);
         }
-        const leftImg = new Image();
-        leftImg.src = leftSrc;
-        const rightImg = new Image();
-        rightImg.src = rightSrc;
+      } catch (error) {
+        console.error("Error loading slice changes:", error);
       }
     };
 
-    preloadImages();
-  }, [currentSlice, showSegmentation, showProgression]);
+    // Slice with the largest lesion area of the latest scan, from its slice index
+    const loadSliceIndex = async () => {
+      try {
+        const response = await fetch("/mri/1.seg/mri_file.slices.json");
+        if (response.ok) {
+          const index = await response.json();
+          const labels: number[][] = Object.values(index.labels || {});
+          const areas = index.shape ? Array.from({ length: index.shape[0] }, (_, i) => labels.reduce((sum, area) => sum + area[i], 0)) : [];
+          const largest = areas.reduce((best, area, i) => (area > areas[best] ? i : best), 0);
+          setLargestLesionSlice(areas[largest] > 0 ? largest : null);
+        }
+      } catch (error) {
+        console.error("Error loading slice index:", error);
+      }
+    };
+
+    loadChanges();
+    loadSliceIndex();
+  }, []);
+
+  useEffect(() => {
+    // One sprite sheet per series shown: the whole series in one request, then scrolled from memory.
+    // The 1/4 resolution sheet comes first (a few hundred KB), then the full resolution one replaces it.
+    const loadLevel = async (name: string, query: string) => {
+      const response = await fetch(`${seriesUrl(name)}/sheet.json?${query}`);
+      if (!response.ok) {
+        return;
+      }
+      const layout = await response.json();
+      const sheet = { ...layout, url: `${seriesUrl(name)}/sheet?${query}` };
+      await new Promise<void>((resolve) => {
+        const img = new Image();
+        img.onload = () => {
+          setSheets((loaded) => {
+            const current = loaded[sheetKey(name)];
+            return current && current.level <= sheet.level ? loaded : { ...loaded, [sheetKey(name)]: sheet };
+          });
+          resolve();
+        };
+        img.onerror = () => resolve();
+        img.src = sheet.url;
+      });
+    };
+
+    const loadSheet = async (name: string) => {
+      if (sheets[sheetKey(name)]?.level === 0) {
+        return;
+      }
+      try {
+        await loadLevel(name, `view=${view}&size=${PREVIEW_SIZE}`);
+        await loadLevel(name, `view=${view}`);
+      } catch (error) {
+        console.error("Error loading sprite sheet:", error);
+      }
+    };
+
+    loadSheet(series.left);
+    loadSheet(series.right);
+  }, [showSegmentation, showProgression, view]);
+
+  useEffect(() => {
+    // Slice count of the view, from its sheet layout; a new view starts from its middle slice
+    const loadLayout = async () => {
+      try {
+        const response = await fetch(`${seriesUrl(series.left)}/sheet.json?view=${view}`);
+        if (response.ok) {
+          const layout = await response.json();
+          setTotalSlices(layout.slices);
+          setCurrentSlice(Math.floor(layout.slices / 2));
+        }
+      } catch (error) {
+        console.error("Error loading slice count:", error);
+      }
+    };
+
+    loadLayout();
+  }, [view]);
+
+  useEffect(() => {
+    // Until the sheets are loaded, preload some slices around the current one
+    if (sheets[sheetKey(series.left)] && sheets[sheetKey(series.right)]) {
+      return;
+    }
+    const range = 5; // Preload 5 slices before and after
+    for (let i = Math.max(0, currentSlice - range); i <= Math.min(totalSlices - 1, currentSlice + range); i++) {
+      const { left: leftSrc, right: rightSrc } = getImagePaths(i, true);
+      const leftImg = new Image();
+      leftImg.src = leftSrc;
+      const rightImg = new Image();
+      rightImg.src = rightSrc;
+    }
+  }, [currentSlice, showSegmentation, showProgression, view, sheets]);
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-[#181028] via-[#1a1333] to-black">
@@ -118,9 +251,51 @@ export default function MRIViewer({ params }: { params: { patient: string } }) {
               >
                 {showProgression ? "Hide Progression" : "Show Progression"}
               </button>
+              {(["axial", "coronal", "sagittal"] as const).map((plane) => (
+                <button
+                  key={plane}
+                  onClick={() => setView(plane)}
+                  className={`px-3 py-2 rounded-xl font-semibold capitalize transition-colors border border-[#A259F7]/40 shadow-md ${
+                    view === plane
+                      ? "bg-gradient-to-r from-[#A259F7] to-[#3B1E6D] text-white"
+                      : "bg-[#221a36] text-[#A259F7] hover:bg-[#2a1a4d]"
+                  }`}
+                >
+                  {plane}
+                </button>
+              ))}
+              {view === "axial" && largestLesionSlice !== null && (
+                <button
+                  onClick={() => setCurrentSlice(largestLesionSlice)}
+                  className="px-4 py-2 rounded-xl font-semibold transition-colors border border-[#A259F7]/40 shadow-md bg-[#221a36] text-[#A259F7] hover:bg-[#2a1a4d]"
+                >
+                  Jump to Lesion
+                </button>
+              )}
             </div>
           </div>
 
+          {/* Most changed slices */}
+          {view === "axial" && changeSlices.length > 0 && (
+            <div className="flex flex-wrap items-center gap-2 mb-6">
+              <span className="text-[#E0D7F7] font-medium mr-2">Most changed slices:</span>
+              {changeSlices.map((change) => (
+                <button
+                  key={change.slice}
+                  onClick={() => setCurrentSlice(change.slice)}
+                  title={`+${change.new} / -${change.resolved} voxels`}
+                  className={`px-3 py-1 rounded-lg text-sm font-semibold border border-[#F76B1C]/40 transition-colors ${
+                    currentSlice === change.slice
+                      ? "bg-gradient-to-r from-[#F76B1C] to-[#A259F7] text-white"
+                      : "bg-[#221a36] text-[#F76B1C] hover:bg-[#2a1a4d]"
+                  }`}
+                >
+                  {change.slice + 1}
+                </button>
+              ))}
+            </div>
+          )}
+
           {/* Slice Slider */}
           <div className="w-full">
             <input
@@ -128,7 +303,7 @@ export default function MRIViewer({ params }: { params: { patient: string } }) {
               min="0"
               max={totalSlices - 1}
               value={currentSlice}
-              onChange={(e) => setCurrentSlice(parseInt(e.target.value))}
+              onChange={(e) => scrubTo(parseInt(e.target.value))}
               className="w-full h-2 bg-[#2a1a4d] rounded-lg appearance-none cursor-pointer slider"
               style={{
                 background: `linear-gradient(to right, #A259F7 0%, #A259F7 ${(currentSlice / (totalSlices - 1)) * 100}%, #221a36 ${(currentSlice / (totalSlices - 1)) * 100}%, #221a36 100%)`
@@ -153,10 +328,11 @@ export default function MRIViewer({ params }: { params: { patient: string } }) {
                 </p>
               </div>
               <div className="relative bg-[#221a36] rounded-2xl overflow-hidden border border-[#A259F7]/20" style={{ aspectRatio: "1/1" }}>
-                <img
+                <SliceImage
+                  sheet={sheets[sheetKey(series.left)]}
                   src={imagePaths.left}
+                  slice={currentSlice}
                   alt={`Left MRI - Slice ${currentSlice + 1}`}
-                  className="w-full h-full object-contain"
                   onLoad={() => setImagesLoaded(true)}
                   onError={(e) => {
                     console.error("Failed to load left image:", imagePaths.left);
@@ -184,10 +360,11 @@ export default function MRIViewer({ params }: { params: { patient: string } }) {
                 </p>
               </div>
               <div className="relative bg-[#221a36] rounded-2xl overflow-hidden border border-[#A259F7]/20" style={{ aspectRatio: "1/1" }}>
-                <img
+                <SliceImage
+                  sheet={sheets[sheetKey(series.right)]}
                   src={imagePaths.right}
+                  slice={currentSlice}
                   alt={`Right MRI - Slice ${currentSlice + 1}`}
-                  className="w-full h-full object-contain"
                   onError={(e) => {
                     console.error("Failed to load right image:", imagePaths.right);
                     (e.target as HTMLImageElement).src = "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNDAwIiBoZWlnaHQ9IjQwMCIgeG1zbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj48cmVjdCB3aWR0aD0iMTAwJSIgaGVpZ2h0PSIxMDAlIiBmaWxsPSIjZjNmNGY2Ii8+PHRleHQgeD0iNTAlIiB5PSI1MCUiIGZvbnQtZmFtaWx5PSJBcmlhbCwgc2Fucy1zZXJpZiIgZm9udC1zaXplPSIxNiIgZmlsbD0iIzlDQTNBRiIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZHk9Ii4zZW0iPkltYWdlIG5vdCBmb3VuZDwvdGV4dD48L3N2Zz4=";
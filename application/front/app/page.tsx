@@ -38,10 +38,25 @@ export default function Home() {
     setExpandedPatient(expandedPatient === patientId ? null : patientId);
   };
 
+  // Poll a backend job until it is done (true) or failed (false)
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const response = await fetch(`http://localhost:8000/jobs/${jobId}`);
+      if (!response.ok) return false;
+      const job = await response.json();
+      if (job.status === "done") return true;
+      if (job.status === "failed") {
+        console.error(`Job ${jobId} failed at stage ${job.stage}:`, job.error);
+        return false;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleViewReport = async (patientName: string, patientId: string) => {
     setLoading("report");
     try {
-      const response = await fetch("http://localhost:8000/report", {
+      const response = await fetch("http://localhost:8000/jobs/report", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -49,7 +64,7 @@ export default function Home() {
         body: JSON.stringify({ client_name: patientName }),
       });
       
-      if (response.ok) {
+      if (response.ok && (await waitForJob((await response.json()).job_id))) {
         // Navigate to the report page
         window.location.href = `/report/${patientId}?clientName=${encodeURIComponent(patientName)}`;
       }
@@ -13,6 +13,10 @@ import { useEffect, useState } from "react";
 import { useParams, useSearchParams } from "next/navigation";
 import Link from "next/link";
 
+// Folder of the client report under /report (same rule as client_folder_name in back_report.py)
+const reportFolder = (clientName: string) =>
+  clientName.replace(/[^A-Za-z0-9_.-]+/g, "_").replace(/^[._]+|[._]+$/g, "") || "patient";
+
 export default function ReportPage() {
   const params = useParams();
   const searchParams = useSearchParams();
@@ -26,7 +30,7 @@ export default function ReportPage() {
     // Load the report HTML from the server
     const loadReport = async () => {
       try {
-        const response = await fetch('/report/report.html');
+        const response = await fetch(`/report/${reportFolder(clientName)}/report.html`);
         if (response.ok) {
           const html = await response.text();
           setReportHtml(html);
@@ -42,7 +46,7 @@ export default function ReportPage() {
     };
 
     loadReport();
-  }, []);
+  }, [clientName]);
 
   // Effet pour exécuter le script Chart.js après l'injection du HTML
   useEffect(() => {
@@ -139,7 +143,7 @@ export default function ReportPage() {
       // Create a link to download the HTML file as PDF
       // You might want to implement a backend endpoint that converts HTML to PDF
       const link = document.createElement("a");
-      link.href = "/report/report.html";
+      link.href = `/report/${reportFolder(clientName)}/report.html`;
       link.download = `${clientName}_report.html`;
       document.body.appendChild(link);
       link.click();
@@ -0,0 +1,8 @@
+'''
+Tests run from the application folder: the back_* modules are imported as the server does
+'''
+# Dependencies
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+'''
+Report artifact cache: concurrent stores of one key, restore, eviction
+'''
+# Dependencies
+import os
+import threading
+
+from back_cache import ArtifactCache
+
+NAMES = ["report.json", "report.html"]
+
+
+def write_artifacts(folder, content):
+    os.makedirs(folder, exist_ok=True)
+    for name in NAMES:
+        with open(os.path.join(folder, name), "w") as f:
+            f.write(content)
+
+
+def test_concurrent_stores_publish_one_complete_entry(tmp_path):
+    source = str(tmp_path / "source")
+    write_artifacts(source, "report")
+    folder = str(tmp_path / "cache")
+    barrier = threading.Barrier(8)
+
+    def store():
+        barrier.wait()
+        ArtifactCache(folder).store("key", NAMES, source)
+
+    threads = [threading.Thread(target=store) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert os.listdir(folder) == ["key"]
+    destination = str(tmp_path / "destination")
+    assert ArtifactCache(folder).restore("key", NAMES, destination)
+    assert sorted(os.listdir(destination)) == sorted(NAMES)
+    with open(os.path.join(destination, "report.html")) as f:
+        assert f.read() == "report"
+
+
+def test_eviction_keeps_recent_entries(tmp_path):
+    folder = str(tmp_path / "cache")
+    cache = ArtifactCache(folder, max_bytes=3 * len(NAMES) * len("report 0"))
+    for i in range(5):
+        source = str(tmp_path / f"source{i}")
+        write_artifacts(source, f"report {i}")
+        cache.store(f"key{i}", NAMES, source)
+        os.utime(os.path.join(folder, f"key{i}"), (i, i))
+
+    assert sorted(os.listdir(folder)) == ["key2", "key3", "key4"]
+    assert not cache.restore("key0", NAMES, str(tmp_path / "destination"))
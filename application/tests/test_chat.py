@@ -0,0 +1,29 @@
+'''
+Chat endpoints: a client without a report is a 404, greetings are written atomically
+'''
+# Dependencies
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import back
+from back_greeting import GreetingCache
+
+
+@pytest.mark.parametrize("endpoint", ["/chat/start", "/chat/start/stream"])
+def test_chat_start_without_report_is_404(tmp_path, monkeypatch, endpoint):
+    monkeypatch.setattr(back, "client_report_folder", lambda client_name: str(tmp_path / client_name))
+    response = TestClient(back.app).post(endpoint, json={"client_name": "Nobody"})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "No report for client: Nobody"
+
+
+def test_greeting_put_leaves_no_temporary_file(tmp_path):
+    cache = GreetingCache(str(tmp_path))
+    cache.put("Alice", "digest", "Hello")
+    cache.put("Alice", "digest", "Hello again")
+
+    assert [name for name in os.listdir(tmp_path) if not name.endswith(".json")] == []
+    assert GreetingCache(str(tmp_path)).get("Alice", "digest") == "Hello again"
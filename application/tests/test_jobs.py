@@ -0,0 +1,92 @@
+'''
+Job queue: jobs left running by a stopped worker are taken over once their lease expires
+'''
+# Dependencies
+import time
+
+import pytest
+
+from back_jobs import DONE, RUNNING, JobQueue
+from back_storage import JobLeaseLost, SQLiteStateStore
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def queued_job(job_id):
+    return {
+        "id": job_id, "kind": "report", "params": {}, "status": "queued", "stage": None,
+        "stages": {}, "progress": 0.0, "detail": None, "result": None, "error": None,
+        "attempts": 0, "created_at": time.time(), "updated_at": time.time(),
+    }
+
+
+def test_restart_inside_lease_window_finishes_job(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    handlers = {"report": lambda ctx: {"ok": True}}
+
+    # A worker claims the job then stops without finishing it
+    store.save_job(queued_job("job-1"))
+    assert store.claim_job("job-1", "crashed-worker", lease_seconds=0.5)["status"] == RUNNING
+
+    # Restart right away: the lease has not expired yet, the heartbeat picks the job up later
+    queue = JobQueue(handlers, store=store, lease_seconds=0.5, heartbeat_seconds=0.1)
+    try:
+        assert queue.start() == []
+        assert wait_for(lambda: store.load_job("job-1")["status"] == DONE)
+        assert store.load_job("job-1")["result"] == {"ok": True}
+    finally:
+        queue.shutdown()
+
+
+def test_running_job_is_not_resumed_twice(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    calls = []
+    queue = JobQueue({"report": lambda ctx: calls.append(time.sleep(0.5))}, store=store,
+                     lease_seconds=0.5, heartbeat_seconds=0.1)
+    try:
+        queue.start()
+        job = queue.submit("report")
+        assert wait_for(lambda: store.load_job(job["id"])["status"] == DONE)
+        time.sleep(0.3)
+        assert len(calls) == 1
+    finally:
+        queue.shutdown()
+
+
+def test_save_after_takeover_is_rejected(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    store.save_job(queued_job("job-1"))
+    job = store.claim_job("job-1", "stalled-worker", lease_seconds=0.1)
+    time.sleep(0.2)
+    assert store.claim_job("job-1", "other-worker", lease_seconds=60) is not None
+
+    job["status"] = DONE
+    with pytest.raises(JobLeaseLost):
+        store.save_job(job, "stalled-worker")
+    assert store.load_job("job-1")["status"] == RUNNING
+
+
+def test_stalled_worker_does_not_overwrite_new_run(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+
+    def stall(ctx):
+        # No heartbeat renews the lease: another worker takes the job over meanwhile
+        time.sleep(0.3)
+        store.claim_job(ctx.job["id"], "other-worker", lease_seconds=60)
+        return {"ok": True}
+
+    queue = JobQueue({"report": stall}, store=store, lease_seconds=0.1, heartbeat_seconds=60)
+    try:
+        job = queue.submit("report")
+        assert wait_for(lambda: not queue._pending)
+        stored = store.load_job(job["id"])
+        assert stored["status"] == RUNNING and stored["result"] is None
+    finally:
+        queue.shutdown()
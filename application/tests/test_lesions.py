@@ -0,0 +1,54 @@
+'''
+Lesion metrics: one labelling pass gives the count, volumes, centroids and exact
+Feret diameters of known synthetic shapes
+'''
+# Dependencies
+import math
+
+import numpy as np
+import pytest
+
+from back_diameter import feret_diameter
+from back_lesions import lesion_metrics
+
+
+def box(shape, corner, size):
+    mask = np.zeros(shape, dtype=bool)
+    mask[tuple(slice(c, c + s) for c, s in zip(corner, size))] = True
+    return mask
+
+
+@pytest.mark.parametrize("size, spacing, expected", [
+    ((3, 4, 12), (1.0, 1.0, 1.0), 13.0),                # 3-4-12 box: diagonal of 13 between outer corners
+    ((3, 4, 12), (2.0, 1.0, 0.5), math.sqrt(6 ** 2 + 4 ** 2 + 6 ** 2)),
+    ((1, 3, 4), (1.0, 1.0, 1.0), math.sqrt(1 + 9 + 16)), # One slice thick: no 3D hull
+    ((1, 1, 1), (1.0, 1.0, 1.0), math.sqrt(3)),
+])
+def test_feret_diameter_of_a_box(size, spacing, expected):
+    assert feret_diameter(box((16, 16, 16), (2, 2, 2), size), spacing) == pytest.approx(expected)
+
+
+def test_feret_diameter_of_a_sphere():
+    grid = np.indices((21, 21, 21)) - 10
+    sphere = (grid ** 2).sum(axis=0) <= 8 ** 2
+    # Outer voxel corners of a digital sphere of radius 8: 17 along an axis, at most 16 + sqrt(3)
+    assert 17.0 <= feret_diameter(sphere) <= 16.0 + math.sqrt(3)
+    assert feret_diameter(np.zeros((4, 4, 4), dtype=bool)) == 0.0
+
+
+def test_lesion_metrics_of_two_lesions():
+    mask = box((20, 20, 20), (1, 1, 1), (3, 4, 12)) | box((20, 20, 20), (10, 10, 10), (2, 2, 2))
+    metrics = lesion_metrics(mask.astype(np.float64), spacing=(2.0, 1.0, 1.0))
+
+    assert metrics["count"] == 2
+    assert metrics["volume"] == pytest.approx((3 * 4 * 12 + 8) * 2.0)
+    assert metrics["max_diameter"] == pytest.approx(math.sqrt(6 ** 2 + 4 ** 2 + 12 ** 2))
+    first, second = metrics["lesions"]
+    assert first["voxels"] == 144 and second["voxels"] == 8
+    assert first["centroid"] == pytest.approx([2.0, 2.5, 6.5])
+    assert second["bbox"] == [[10, 12], [10, 12], [10, 12]]
+
+
+def test_lesion_metrics_without_lesion():
+    metrics = lesion_metrics(np.zeros((5, 5, 5)))
+    assert metrics == {"volume": 0.0, "count": 0, "max_diameter": 0.0, "lesions": []}
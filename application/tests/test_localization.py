@@ -0,0 +1,84 @@
+'''
+Lobe localization: a segmentation without lesion has no location and never reaches MedGemma
+'''
+# Dependencies
+import nibabel as nb
+import numpy as np
+
+import back_irm_analysis
+from back_localization import GEOMETRIC_ATLAS_DESCRIP, LOBES, geometric_lobe_atlas, localize_lesions
+from back_report import location_label
+
+SHAPE = (32, 40, 40)
+
+
+def save_nifti(path, data, descrip=""):
+    image = nb.Nifti1Image(data, np.eye(4))
+    image.header["descrip"] = descrip
+    nb.save(image, str(path))
+    return str(path)
+
+
+def failing_medgemma(path):
+    raise RuntimeError("endpoint unavailable")
+
+
+def test_empty_mask_has_no_location(tmp_path, monkeypatch):
+    atlas = save_nifti(tmp_path / "lobes.nii.gz", geometric_lobe_atlas(SHAPE))
+    segmentation = save_nifti(tmp_path / "seg.nii", np.zeros(SHAPE, dtype=np.uint8))
+
+    assert localize_lesions(segmentation, atlas) == {"lobe": None, "fractions": {}, "ambiguous": False}
+
+    def medgemma(path):
+        raise AssertionError("MedGemma queried for an empty mask")
+    monkeypatch.setattr(back_irm_analysis, "run_medgemma_location", medgemma)
+    location = back_irm_analysis.run_analysis_location("0", segmentation, atlas)
+    assert location["lobe"] is None
+    assert location_label({"rmi_location": None, "location_source": location["source"]}) == "No lesion"
+
+
+def test_lesion_in_one_lobe(tmp_path):
+    labels = geometric_lobe_atlas(SHAPE)
+    atlas = save_nifti(tmp_path / "lobes.nii.gz", labels)
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[labels == LOBES.index("occipital") + 1] = 1
+    segmentation = save_nifti(tmp_path / "seg.nii", mask)
+
+    location = localize_lesions(segmentation, atlas)
+    assert location["lobe"] == "occipital" and not location["ambiguous"]
+
+
+def test_atlas_of_another_space_is_ambiguous(tmp_path):
+    atlas = save_nifti(tmp_path / "lobes.nii.gz", geometric_lobe_atlas((16, 20, 20)))
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[10:12, 10:12, 10:12] = 1
+    segmentation = save_nifti(tmp_path / "seg.nii", mask)
+
+    assert localize_lesions(segmentation, atlas)["ambiguous"]
+
+
+def test_no_atlas_and_no_medgemma_is_undetermined(tmp_path, monkeypatch):
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[10:12, 10:12, 10:12] = 1
+    segmentation = save_nifti(tmp_path / "seg.nii", mask)
+    monkeypatch.setattr(back_irm_analysis, "run_medgemma_location", failing_medgemma)
+
+    location = back_irm_analysis.run_analysis_location("0", segmentation, str(tmp_path / "missing.nii.gz"))
+    assert location["lobe"] is None and location["source"] == "fallback"
+    assert location_label({"rmi_location": None, "location_source": "fallback"}) == "Undetermined"
+
+
+def test_geometric_atlas_answer_is_approximate(tmp_path, monkeypatch):
+    labels = geometric_lobe_atlas(SHAPE)
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[labels == LOBES.index("parietal") + 1] = 1
+    segmentation = save_nifti(tmp_path / "seg.nii", mask)
+    geometric = save_nifti(tmp_path / "geometric.nii.gz", labels, GEOMETRIC_ATLAS_DESCRIP)
+    registered = save_nifti(tmp_path / "registered.nii.gz", labels)
+    monkeypatch.setattr(back_irm_analysis, "run_medgemma_location", failing_medgemma)
+
+    location = back_irm_analysis.run_analysis_location("0", segmentation, geometric)
+    assert (location["lobe"], location["source"]) == ("parietal", "geometric_atlas")
+    assert location_label({"rmi_location": "parietal", "location_source": "geometric_atlas"}) == \
+        "Parietal (approximate, geometric atlas)"
+    assert back_irm_analysis.run_analysis_location("0", segmentation, registered)["source"] == "atlas"
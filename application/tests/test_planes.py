@@ -0,0 +1,58 @@
+'''
+Plane reslicing: on an asymmetric volume every view has the radiological orientation,
+whatever the voxel order of the file
+'''
+# Dependencies
+import numpy as np
+import pytest
+
+from back_planes import VIEWS, orient_slice, to_plane, volume_orientation, voxel_slice
+
+# Inferior-superior, anterior-posterior, right-left voxel axes (as the bundled scans)
+SHAPE = (4, 5, 6)
+DATA = np.arange(np.prod(SHAPE)).reshape(SHAPE)
+
+
+def test_default_orientation():
+    orientation = volume_orientation(np.eye(4))
+    S, A, W = SHAPE
+
+    axial = to_plane(DATA, orientation, "axial")
+    assert axial.shape == (S, A, W) and np.array_equal(axial, DATA)
+
+    # Coronal: slices posterior to anterior, superior at the top, patient right on the left
+    coronal = to_plane(DATA, orientation, "coronal")
+    assert coronal.shape == (A, S, W)
+    assert coronal[0, 0, 0] == DATA[S - 1, A - 1, 0]
+    assert np.array_equal(coronal[2], DATA[::-1, A - 1 - 2, :])
+
+    # Sagittal: superior at the top, anterior on the left
+    sagittal = to_plane(DATA, orientation, "sagittal")
+    assert sagittal.shape == (W, S, A)
+    assert np.array_equal(sagittal[1], DATA[::-1, :, W - 1 - 1])
+
+
+def test_views_do_not_depend_on_the_voxel_order():
+    # Same anatomy stored x (right to left), y (anterior to posterior), z (inferior to superior)
+    stored = DATA.transpose(2, 1, 0)
+    affine = np.diag([-1.0, -1.0, 1.0, 1.0])
+    orientation = volume_orientation(affine)
+    assert orientation.tolist() == [[0, -1], [1, -1], [2, 1]]
+
+    reference = volume_orientation(np.eye(4))
+    for view in VIEWS:
+        assert np.array_equal(to_plane(stored, orientation, view), to_plane(DATA, reference, view))
+
+
+@pytest.mark.parametrize("view", list(VIEWS))
+def test_voxel_slices_match_the_planes(view):
+    # A view along voxel axis 0 is read one stored slice at a time
+    stored = DATA.transpose(2, 1, 0)
+    orientation = volume_orientation(np.diag([-1.0, -1.0, 1.0, 1.0]))
+    planes = to_plane(stored, orientation, view)
+    for index in range(planes.shape[0]):
+        voxel_index = voxel_slice(orientation, view, index, stored.shape)
+        if view != "sagittal":
+            assert voxel_index is None
+            continue
+        assert np.array_equal(orient_slice(stored[voxel_index], orientation, view), planes[index])
@@ -0,0 +1,51 @@
+'''
+Report cache: a report is stored under the key of the inputs it was generated from
+'''
+# Dependencies
+import json
+import os
+
+import pytest
+
+import back_report
+from back_cache import ArtifactCache
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Timeline of two scans, an empty report cache and a report folder per client under tmp_path
+    for scan in ("0", "1"):
+        os.makedirs(tmp_path / f"{scan}.seg")
+        (tmp_path / f"{scan}.seg" / "mri_file.nii").write_bytes(scan.encode() * 100)
+    timeline = tmp_path / "timeline.json"
+    timeline.write_text(json.dumps({"scans": [
+        {"id": scan, "date": f"2025-0{scan}-01", "segmentation": f"{scan}.seg/mri_file.nii", "image": f"{scan}/mri_file.nii"}
+        for scan in ("0", "1")
+    ]}))
+    monkeypatch.setattr(back_report, "REPORT_FOLDER", str(tmp_path / "report"))
+    monkeypatch.setattr(back_report, "ArtifactCache", lambda: ArtifactCache(str(tmp_path / "cache")))
+
+    folder = back_report.client_report_folder("John Doe")
+    os.makedirs(folder)
+    for name in back_report.REPORT_FILES:
+        with open(os.path.join(folder, name), "w") as f:
+            f.write("{}")
+    return str(timeline), tmp_path
+
+
+def test_report_is_cached_under_its_inputs(client):
+    timeline, _ = client
+    key = back_report.report_cache_key("John Doe", timeline)
+    assert back_report.cache_report("John Doe", key, timeline)
+    assert back_report.restore_cached_report("John Doe", key) == {}
+
+
+def test_mask_changed_during_generation_is_not_cached(client):
+    timeline, tmp_path = client
+    key = back_report.report_cache_key("John Doe", timeline)
+    # A new segmentation lands between the key (report generation start) and the store
+    (tmp_path / "1.seg" / "mri_file.nii").write_bytes(b"new segmentation")
+
+    assert not back_report.cache_report("John Doe", key, timeline)
+    assert back_report.restore_cached_report("John Doe", key) is None
+    assert back_report.restore_cached_report("John Doe", back_report.report_cache_key("John Doe", timeline)) is None
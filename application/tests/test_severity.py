@@ -0,0 +1,26 @@
+'''
+ARIA-E severity grading from the Feret diameter of each site of involvement
+'''
+# Dependencies
+import pytest
+
+from back_irm_analysis import grade_severity
+
+
+@pytest.mark.parametrize("diameters_cm, expected", [
+    ([], "NONE"),
+    ([2.0], "MILD"),
+    ([7.5], "MODERATE"),
+    ([2.0, 4.0], "MODERATE"),
+    ([3.0, 12.0], "SEVERE"),
+    ([10.5], "SEVERE"),
+])
+def test_grade(diameters_cm, expected):
+    decision, reason = grade_severity(diameters_cm)
+    assert decision == expected
+    assert decision in reason
+
+
+def test_no_lesion_is_not_graded_mild():
+    decision, reason = grade_severity([])
+    assert decision == "NONE" and "no ARIA-E" in reason
@@ -0,0 +1,132 @@
+'''
+Slice renderer: the normalised volumes on disk stay under their size cap, ETags are
+cheap, resliced views have no bands and do not decode the masks again, unknown
+patients are rejected, and sprite sheets hold every slice of a series
+'''
+# Dependencies
+import json
+import os
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+import back_slice_render
+from back_planes import VIEWS, to_plane
+from back_slice_render import SliceRenderer, pack_sheet, sheet_grid
+from back_sparse import SparseMask
+from back_timeline import ScanMetricsStore
+
+SHAPE = (8, 10, 12)
+
+
+def test_volume_eviction_keeps_recent_volumes(tmp_path):
+    folder = str(tmp_path / "slices")
+    volume = np.zeros((10, 10, 10), dtype=np.uint8)
+    renderer = SliceRenderer(folder=folder, store=object(), max_bytes=3 * 1200)
+    for i in range(5):
+        path = os.path.join(folder, f"volume{i}.npy")
+        np.save(path, volume)
+        os.utime(path, (i, i))
+    renderer._volumes["volume0"] = (np.load(os.path.join(folder, "volume0.npy"), mmap_mode="r"), None)
+
+    renderer._evict_volumes(keep=os.path.join(folder, "volume0.npy"))
+    assert sorted(os.listdir(folder)) == ["volume0.npy", "volume3.npy", "volume4.npy"]
+
+    renderer.max_bytes = 2 * 1200
+    renderer._evict_volumes()
+    assert sorted(os.listdir(folder)) == ["volume3.npy", "volume4.npy"]
+    assert "volume0" not in renderer._volumes
+
+
+def scan_folder(tmp_path, monkeypatch):
+    # Two scans of a patient listed in the default timeline
+    mri = tmp_path / "mri"
+    rng = np.random.default_rng(0)
+    scans = []
+    for i in range(2):
+        (mri / str(i)).mkdir(parents=True)
+        (mri / f"{i}.seg").mkdir()
+        nb.save(nb.Nifti1Image(rng.random(SHAPE, dtype=np.float32), np.eye(4)), str(mri / str(i) / "mri_file.nii"))
+        mask = np.zeros(SHAPE, dtype=np.uint8)
+        mask[2:5, 3:6 + i, 4:8] = 1
+        nb.save(nb.Nifti1Image(mask, np.eye(4)), str(mri / f"{i}.seg" / "mri_file.nii"))
+        scans.append({"id": str(i), "date": f"2025-0{i + 1}-01",
+                      "segmentation": f"{i}.seg/mri_file.nii", "image": f"{i}/mri_file.nii"})
+    with open(mri / "timeline.json", "w") as f:
+        json.dump({"patients": ["alice"], "scans": scans}, f)
+    monkeypatch.setattr(back_slice_render, "MRI_FOLDER", str(mri))
+    monkeypatch.setattr(back_slice_render, "TIMELINE_FILE", str(mri / "timeline.json"))
+    folder = tmp_path / "slices"
+    return SliceRenderer(folder=str(folder), store=ScanMetricsStore(str(tmp_path / "scans"))), folder
+
+
+def test_unknown_patient_is_rejected(tmp_path, monkeypatch):
+    renderer, _ = scan_folder(tmp_path, monkeypatch)
+    assert renderer.slice_key("Alice", "1", "image", 0)
+    with pytest.raises(KeyError):
+        renderer.slice_key("mallory", "1", "image", 0)
+
+
+def test_etag_does_not_open_the_volume(tmp_path, monkeypatch):
+    renderer, folder = scan_folder(tmp_path, monkeypatch)
+    keys = {renderer.slice_key("alice", "1", "seg", 3, view, size) for view in VIEWS for size in (None, 64)}
+    assert len(keys) == 2 * len(VIEWS)
+    assert os.listdir(folder) == [] and renderer._volumes == {}
+
+
+def test_resliced_views_decode_the_mask_once(tmp_path, monkeypatch):
+    renderer, _ = scan_folder(tmp_path, monkeypatch)
+    decoded = []
+    to_mask = SparseMask.to_mask
+    monkeypatch.setattr(SparseMask, "to_mask", lambda self: decoded.append(1) or to_mask(self))
+
+    for index in range(4):
+        data, _ = renderer.render("alice", "1", "seg", index, view="coronal")
+        assert data[:2] == b"\xff\xd8"
+    assert len(decoded) == 1
+
+
+def test_resliced_views_have_no_bands(tmp_path, monkeypatch):
+    renderer, _ = scan_folder(tmp_path, monkeypatch)
+    # Brighter with every axial slice, same ramp along the columns in each slice
+    data = 10 * np.arange(SHAPE[0], dtype=np.float32)[:, None, None] + np.arange(SHAPE[2], dtype=np.float32)
+    image = tmp_path / "mri" / "1" / "mri_file.nii"
+    nb.save(nb.Nifti1Image(np.broadcast_to(data, SHAPE).copy(), np.eye(4)), str(image))
+    scan = {"image": str(image)}
+
+    # Axial slices are each stretched to their own range (as exported)
+    axial, orientation = renderer._volume(scan, "axial")
+    assert all(np.array_equal(axial[0], axial[i]) for i in range(SHAPE[0]))
+
+    # A coronal plane crosses every axial slice: its rows (superior to inferior) darken steadily
+    volume, orientation = renderer._volume(scan, "coronal")
+    rows = to_plane(volume, orientation, "coronal")[0].mean(axis=1)
+    assert np.all(np.diff(rows) < 0)
+
+
+def test_pack_sheet_tiles_row_by_row():
+    volume = np.arange(5 * 2 * 3, dtype=np.uint8).reshape(5, 2, 3)
+    assert sheet_grid(5) == (3, 2) and sheet_grid(9) == (3, 3) and sheet_grid(1) == (1, 1)
+
+    sheet = pack_sheet(volume)
+    assert sheet.shape == (2 * 2, 3 * 3)
+    for i in range(5):
+        row, column = divmod(i, 3)
+        assert np.array_equal(sheet[row * 2:(row + 1) * 2, column * 3:(column + 1) * 3], volume[i])
+    assert not sheet[2:, 6:].any() # Empty last tile
+    assert pack_sheet(np.zeros((4, 2, 3, 3), dtype=np.uint8)).shape == (4, 6, 3) # Color tiles
+
+
+def test_sheet_holds_every_slice_of_the_series(tmp_path, monkeypatch):
+    import cv2
+    renderer, _ = scan_folder(tmp_path, monkeypatch)
+    for view in VIEWS:
+        layout = renderer.sheet_index("alice", "1", "seg", view)
+        data, key = renderer.render_sheet("alice", "1", "seg", view)
+        sheet = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        tile = layout["tile"]
+        assert (layout["columns"], layout["rows"]) == sheet_grid(layout["slices"])
+        assert sheet.shape[:2] == (layout["rows"] * tile[0], layout["columns"] * tile[1])
+        assert key == renderer.sheet_key("alice", "1", "seg", view)
+    assert renderer.sheet_index("alice", "1", "image", "axial")["slices"] == SHAPE[0]
@@ -0,0 +1,85 @@
+'''
+Slice export: every slice of every layer is written, normalised per slice and
+painted with the lesion and change masks; pyramid levels halve the slices
+'''
+# Dependencies
+import os
+
+import cv2
+import nibabel as nb
+import numpy as np
+
+import back_slices
+from back_slices import (LESION_COLOR, PYRAMID_LEVELS, downscale, export_study, level_shape, normalize_volume,
+                         overlay_volume, pyramid_level)
+from back_timeline import ScanMetricsStore, latest_change_map
+
+SHAPE = (7, 32, 48)
+
+
+def save_nifti(path, data):
+    nb.save(nb.Nifti1Image(data, np.eye(4)), str(path))
+    return str(path)
+
+
+def test_normalize_and_overlay():
+    data = np.stack([np.full((4, 4), 5.0), np.arange(16.0).reshape(4, 4)])
+    gray = normalize_volume(data)
+    assert gray.dtype == np.uint8
+    assert not gray[0].any() # Constant slice: black
+    assert gray[1].min() == 0 and gray[1].max() == 255
+
+    mask = np.zeros(gray.shape, dtype=bool)
+    mask[1, 0, 0] = True
+    color = overlay_volume(gray, [(mask, LESION_COLOR)])
+    assert color.shape == gray.shape + (3,)
+    assert tuple(color[1, 0, 0]) == LESION_COLOR and tuple(color[1, 3, 3]) == (255, 255, 255)
+
+
+def test_export_writes_every_slice(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    scans = []
+    for i in range(2):
+        mask = np.zeros(SHAPE, dtype=np.uint8)
+        mask[2:5, 8:24, 8:24 + 16 * i] = 1
+        scans.append({
+            "id": str(i), "date": f"2025-0{i + 1}-01",
+            "image": save_nifti(tmp_path / f"image{i}.nii", rng.random(SHAPE, dtype=np.float32)),
+            "segmentation": save_nifti(tmp_path / f"seg{i}.nii", mask),
+        })
+    store = ScanMetricsStore(str(tmp_path / "store"))
+    monkeypatch.setattr(back_slices, "latest_change_map", lambda scans: latest_change_map(scans, store))
+    output = tmp_path / "mri"
+
+    timings = export_study(scans, str(output), threads=2)
+    assert timings["slices"] == 5 * SHAPE[0]
+    for folder in ("0", "0.seg", "1", "1.seg", "difference"):
+        jpegs = sorted(name for name in os.listdir(output / folder) if name.endswith(".jpg"))
+        assert jpegs == [f"slice_{i:03d}.jpg" for i in range(SHAPE[0])]
+    assert (output / "difference" / "changes.json").exists()
+
+    # Lesion in red (BGR) on the segmentation layer, new voxels in red on the difference layer
+    seg = cv2.imread(str(output / "1.seg" / "slice_003.jpg")).astype(int)
+    assert seg[16, 16, 2] > 200 and seg[16, 16, :2].max() < 60
+    difference = cv2.imread(str(output / "difference" / "slice_003.jpg")).astype(int)
+    assert difference[16, 32, 2] > 200 and difference[16, 32, :2].max() < 60
+    assert not (difference[16, 16, 2] > 200 and difference[16, 16, :2].max() < 60)
+
+
+def test_pyramid_levels():
+    assert [level_shape((240, 155), level) for level in range(PYRAMID_LEVELS)] == [(240, 155), (120, 77), (60, 38)]
+    assert level_shape((3, 1), 2) == (1, 1)
+
+    # Smallest level at least as large as the displayed size
+    assert pyramid_level((240, 240)) == 0 and pyramid_level((240, 240), 0) == 0
+    assert pyramid_level((240, 240), 60) == 2 and pyramid_level((240, 240), 32) == 2
+    assert pyramid_level((240, 240), 64) == 1 and pyramid_level((240, 240), 120) == 1
+    assert pyramid_level((240, 240), 121) == 0 and pyramid_level((240, 240), 1000) == 0
+
+
+def test_downscale_averages_areas():
+    image = np.kron(np.arange(12, dtype=np.uint8).reshape(3, 4) * 20, np.ones((4, 4), dtype=np.uint8))
+    assert downscale(image, 0) is image
+    assert np.array_equal(downscale(image, 2), np.arange(12, dtype=np.uint8).reshape(3, 4) * 20)
+    color = np.repeat(image[..., None], 3, axis=-1)
+    assert downscale(color, 1).shape == (6, 8, 3)
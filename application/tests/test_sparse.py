@@ -0,0 +1,71 @@
+'''
+Run-length masks: exact round trips (dense, sidecar, NIfTI), measures on the runs, and
+sidecars only used next to the NIfTI file they encode
+'''
+# Dependencies
+import os
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+from back_sparse import SparseMask, load_sidecar, sidecar_path
+from back_volumes import load_mask
+
+SHAPE = (6, 8, 10)
+
+
+def save_mask(path, mask):
+    nb.save(nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)), str(path))
+    return str(path)
+
+
+def random_mask(seed=0):
+    mask = np.random.default_rng(seed).random(SHAPE) > 0.6
+    mask[:, :, 0] = mask[:, :, -1] = True # Runs touching both ends of the rows
+    mask[3] = False                       # Empty slice
+    return mask
+
+
+def test_round_trip(tmp_path):
+    mask = random_mask()
+    affine = np.diag([0.5, 1.5, 2.0, 1.0])
+    sparse = SparseMask.from_mask(mask, spacing=(0.5, 1.5, 2.0), affine=affine)
+    assert np.array_equal(sparse.to_mask(), mask)
+    assert all(np.array_equal(sparse.slice(i), mask[i]) for i in range(SHAPE[0]))
+
+    sparse.save(str(tmp_path / "mask.rle.npz"), (1, 2))
+    loaded, source_stat = SparseMask.load(str(tmp_path / "mask.rle.npz"))
+    assert source_stat == (1, 2)
+    assert np.array_equal(loaded.to_mask(), mask) and loaded.spacing == (0.5, 1.5, 2.0)
+
+    image = nb.load(sparse.to_nifti(str(tmp_path / "mask.nii.gz")))
+    assert np.array_equal(np.asarray(image.dataobj) > 0, mask)
+    assert np.allclose(image.affine, affine) and image.header.get_zooms() == (0.5, 1.5, 2.0)
+
+
+def test_measures_on_the_runs():
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[1:3, 2:5, 4:9] = True
+    mask[4, 7, 0] = True
+    sparse = SparseMask.from_mask(mask, spacing=(2.0, 1.0, 1.0))
+
+    assert sparse.voxels == mask.sum() and sparse.volume == 2.0 * mask.sum()
+    assert sparse.slice_areas().tolist() == mask.sum(axis=(1, 2)).tolist()
+    assert sparse.bbox() == [[1, 5], [2, 8], [0, 9]]
+    assert SparseMask.from_mask(np.zeros(SHAPE)).bbox() is None
+    assert not SparseMask.from_mask(np.zeros(SHAPE)).to_mask().any()
+
+
+def test_sidecar_without_its_nifti_is_not_used(tmp_path):
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[2:4, 1:5, 3:9] = True
+    path = save_mask(tmp_path / "seg.nii", mask)
+    assert load_mask(path).data.sum() == mask.sum() # Writes the sidecar
+    assert load_sidecar(path) is not None
+
+    os.remove(path)
+    assert os.path.exists(sidecar_path(path))
+    assert load_sidecar(path) is None
+    with pytest.raises(FileNotFoundError):
+        load_mask(path)
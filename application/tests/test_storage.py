@@ -0,0 +1,64 @@
+'''
+Shared state store: concurrent chat saves do not overwrite each other
+'''
+# Dependencies
+import threading
+
+import pytest
+
+import back
+from back_sessions import ChatSession
+from back_storage import ChatConflict, SQLiteStateStore
+
+
+def chat_state(history):
+    return {"report_hash": "0" * 64, "history": history, "summary": "", "summarized_upto": 1}
+
+
+def test_stale_save_conflicts(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    version = store.save_chat("patient", "default", chat_state(["greeting"]))
+    with pytest.raises(ChatConflict):
+        store.save_chat("patient", "default", chat_state(["greeting"]))
+
+    # Two workers load the same version, the second save is rejected
+    store.save_chat("patient", "default", chat_state(["greeting", "a"]), version)
+    with pytest.raises(ChatConflict):
+        store.save_chat("patient", "default", chat_state(["greeting", "b"]), version)
+    assert store.load_chat("patient", "default") == (chat_state(["greeting", "a"]), version + 1)
+
+
+def test_concurrent_saves_keep_every_turn(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(back, "state", SQLiteStateStore(path))
+    monkeypatch.setattr(back, "start_chat_from", lambda model, turns: None) # No Vertex chat to rebuild
+    greeting = back.ChatMessage(role="assistant", content="greeting")
+    back.state.save_chat("patient", "default", {
+        "report_hash": "0" * 64, "history": [greeting.model_dump()], "summary": "", "summarized_upto": 1,
+    })
+    barrier = threading.Barrier(8)
+    sessions = []
+
+    def worker(i):
+        # One warm session per worker, all loaded at the same version
+        saved_state, version = back.state.load_chat("patient", "default")
+        session = ChatSession("patient", "default", None, report_hash=saved_state["report_hash"])
+        session.history = [back.ChatMessage(**m) for m in saved_state["history"]]
+        session.version = version
+        session.saved_turns = len(session.history)
+        session.history.append(back.ChatMessage(role="user", content=f"turn {i}"))
+        barrier.wait()
+        back.save_session(session)
+        sessions.append(session)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    saved_state, version = SQLiteStateStore(path).load_chat("patient", "default")
+    assert saved_state["history"][0] == greeting.model_dump()
+    assert sorted(m["content"] for m in saved_state["history"][1:]) == sorted(f"turn {i}" for i in range(8))
+    assert version == 9
+    assert all(session.saved_turns == len(session.history) for session in sessions) and len(sessions) == 8
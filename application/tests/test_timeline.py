@@ -0,0 +1,79 @@
+'''
+Patient timelines: only new scans are measured, the change map of each pair is stored,
+and a scan whose stored labels were lost is measured again
+'''
+# Dependencies
+import os
+
+import nibabel as nb
+import numpy as np
+
+import back_timeline
+from back_timeline import ScanMetricsStore, build_timeline, empty_changes, latest_change_map, scan_changes
+
+SHAPE = (6, 12, 12)
+
+
+def save_mask(path, mask):
+    nb.save(nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)), str(path))
+    return str(path)
+
+
+def two_scans(tmp_path):
+    mask_t0 = np.zeros(SHAPE, dtype=bool)
+    mask_t0[1:3, 2:5, 2:5] = True
+    mask_t1 = mask_t0.copy()
+    mask_t1[3:5, 7:10, 7:10] = True
+    return [
+        {"id": "0", "date": "2025-01-01", "segmentation": save_mask(tmp_path / "t0.nii", mask_t0)},
+        {"id": "1", "date": "2025-02-01", "segmentation": save_mask(tmp_path / "t1.nii", mask_t1)},
+    ]
+
+
+def test_missing_labels_give_no_changes(tmp_path):
+    store = ScanMetricsStore(str(tmp_path / "store"))
+    previous, current = build_timeline(two_scans(tmp_path), store)["points"]
+    os.remove(os.path.join(store.folder, f"{previous['hash']}.labels.npz"))
+    os.remove(os.path.join(store.folder, f"{previous['hash']}-{current['hash']}.json"))
+
+    changes = scan_changes(previous["hash"], previous["metrics"], current["hash"], current["metrics"], store)
+    assert changes == empty_changes()
+    assert store.pair(previous["hash"], current["hash"]) is None
+
+
+def test_scan_without_labels_is_measured_again(tmp_path):
+    store = ScanMetricsStore(str(tmp_path / "store"))
+    scans = two_scans(tmp_path)
+    points = build_timeline(scans, store)["points"]
+    for name in os.listdir(store.folder):
+        if name.startswith(points[0]["hash"]):
+            os.remove(os.path.join(store.folder, name)) # Labels, and the pair stored under both hashes
+    store._write_json(f"{points[0]['hash']}.json", points[0]["metrics"]) # Metrics kept
+
+    changes = build_timeline(scans, store)["changes"][0]
+    assert store.has_labels(points[0]["hash"])
+    assert changes["summary"]["new"] == 1 and changes["summary"]["stable"] == 1
+
+
+def test_adding_a_scan_only_measures_that_scan(tmp_path, monkeypatch):
+    store = ScanMetricsStore(str(tmp_path / "store"))
+    scans = two_scans(tmp_path)
+    measured = []
+    lesion_metrics = back_timeline.lesion_metrics
+    monkeypatch.setattr(back_timeline, "lesion_metrics", lambda *args: measured.append(1) or lesion_metrics(*args))
+    assert len(build_timeline(scans, store)["changes"]) == 1 and len(measured) == 2
+
+    # Third scan: the first lesion grows by one column, the second is gone
+    mask_t2 = np.zeros(SHAPE, dtype=bool)
+    mask_t2[1:3, 2:5, 2:6] = True
+    scans.append({"id": "2", "date": "2025-03-01", "segmentation": save_mask(tmp_path / "t2.nii", mask_t2)})
+    timeline = build_timeline(scans, store)
+    assert len(measured) == 3
+    assert [point["metrics"]["count"] for point in timeline["points"]] == [1, 2, 1]
+    assert [(change["from"], change["to"], change["summary"]["resolved"]) for change in timeline["changes"]] == \
+        [("0", "1", 0), ("1", "2", 1)]
+
+    change_map = latest_change_map(scans, store)
+    assert len(measured) == 3
+    assert change_map.new_mask().sum() == 2 * 3 and change_map.resolved_mask().sum() == 2 * 3 * 3
+    assert timeline["changes"][-1]["biggest_diff_slice"] in (3, 4)
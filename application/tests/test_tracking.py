@@ -0,0 +1,65 @@
+'''
+Lesion tracking: lesions of two synthetic scans are matched through their overlap
+and classified (new, resolved, growing, shrinking, stable, merged)
+'''
+# Dependencies
+import numpy as np
+
+from back_lesions import label_lesions, lesion_metrics
+from back_tracking import GROWING, NEW, RESOLVED, SHRINKING, STABLE, overlap_matrix, track_lesions
+
+SHAPE = (20, 40, 40)
+
+
+def scan(*boxes):
+    mask = np.zeros(SHAPE, dtype=bool)
+    for corner, size in boxes:
+        mask[tuple(slice(c, c + s) for c, s in zip(corner, size))] = True
+    labelled = label_lesions(mask)
+    return labelled[0], lesion_metrics(mask, labelled=labelled)
+
+
+def by_status(tracking):
+    return {site["status"]: site for site in tracking["lesions"]}
+
+
+def test_sites_are_matched_and_classified():
+    labels_t0, metrics_t0 = scan(
+        ((1, 1, 1), (3, 3, 3)),      # stable
+        ((1, 10, 10), (3, 3, 3)),    # grows
+        ((1, 20, 20), (4, 4, 4)),    # shrinks
+        ((10, 30, 30), (2, 2, 2)),   # resolves
+    )
+    labels_t1, metrics_t1 = scan(
+        ((1, 1, 1), (3, 3, 3)),
+        ((1, 10, 10), (3, 3, 6)),
+        ((1, 20, 20), (2, 2, 2)),
+        ((15, 1, 30), (3, 2, 2)),    # new
+    )
+    tracking = track_lesions(labels_t0, labels_t1, metrics_t0, metrics_t1)
+
+    assert tracking["summary"] == {NEW: 1, RESOLVED: 1, GROWING: 1, SHRINKING: 1, STABLE: 1}
+    sites = by_status(tracking)
+    assert sites[GROWING]["volume_change"] == 27.0 and sites[GROWING]["overlap_voxels"] == 27
+    assert sites[SHRINKING]["volume_t0"] == 64.0 and sites[SHRINKING]["volume_t1"] == 8.0
+    assert sites[NEW]["labels_t0"] == [] and sites[NEW]["slice"] == 16
+    assert sites[RESOLVED]["labels_t1"] == [] and sites[RESOLVED]["volume_t1"] == 0
+    # Largest volume changes first
+    changes = [abs(site["volume_change"]) for site in tracking["lesions"]]
+    assert changes == sorted(changes, reverse=True)
+
+
+def test_merged_lesions_form_one_site():
+    labels_t0, metrics_t0 = scan(((1, 1, 1), (3, 3, 3)), ((1, 1, 6), (3, 3, 3)))
+    labels_t1, metrics_t1 = scan(((1, 1, 1), (3, 3, 8)))
+    tracking = track_lesions(labels_t0, labels_t1, metrics_t0, metrics_t1)
+
+    (site,) = tracking["lesions"]
+    assert sorted(site["labels_t0"]) == [1, 2] and site["labels_t1"] == [1]
+    assert site["status"] == GROWING and site["volume_t1"] == 72.0
+
+
+def test_overlap_matrix_counts_shared_voxels():
+    labels_t0 = np.array([[0, 1, 1, 2]])
+    labels_t1 = np.array([[1, 1, 0, 1]])
+    assert overlap_matrix(labels_t0, 2, labels_t1, 1).tolist() == [[0, 1], [1, 1], [0, 1]]
@@ -0,0 +1,48 @@
+'''
+NIfTI loading: masks read slab by slab match a full read, with the spacing and
+affine of the header
+'''
+# Dependencies
+import nibabel as nb
+import numpy as np
+import pytest
+
+import back_volumes
+from back_volumes import load_affine, load_image, load_labels, load_mask
+
+SHAPE = (7, 9, 40) # Last axis longer than a slab
+
+
+@pytest.fixture
+def segmentation(tmp_path):
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 4, SHAPE) * (rng.random(SHAPE) > 0.7)
+    affine = np.diag([0.9, 1.2, 3.0, 1.0])
+    affine[:3, 3] = [-10.0, 5.0, 2.0]
+    path = tmp_path / "seg.nii.gz"
+    nb.save(nb.Nifti1Image(labels.astype(np.float64), affine), str(path))
+    return str(path), labels, affine
+
+
+def test_mask_matches_a_full_read(segmentation, monkeypatch):
+    path, labels, affine = segmentation
+    monkeypatch.setattr(back_volumes, "MASK_SLAB", 16)
+    volume = load_mask(path)
+
+    assert volume.data.dtype == np.bool_
+    assert np.array_equal(volume.data, labels > 0)
+    assert volume.spacing == pytest.approx((0.9, 1.2, 3.0))
+    assert volume.voxel_volume == pytest.approx(0.9 * 1.2 * 3.0)
+    assert np.allclose(volume.affine, affine) and np.allclose(load_affine(path), affine)
+    # Second load from the run-length sidecar: same mask and geometry
+    again = load_mask(path)
+    assert np.array_equal(again.data, volume.data) and again.spacing == pytest.approx(volume.spacing)
+
+
+def test_labels_and_image(segmentation):
+    path, labels, _ = segmentation
+    loaded = load_labels(path)
+    assert loaded.data.dtype == np.uint8 and np.array_equal(loaded.data, labels)
+
+    image = load_image(path)
+    assert image.data.dtype == np.float32 and np.array_equal(image.data, labels.astype(np.float32))
@@ -1,4 +1,5 @@
 import os
+import json
 import nibabel as nib
 import numpy as np
 from PIL import Image
@@ -6,9 +7,27 @@ import random
 import argparse
 from pathlib import Path
 
-def normalize_image(image_slice):
-    """Normalize image slice to 0-255 range for JPG conversion"""
-    p_low, p_high = np.percentile(image_slice, [0.5, 99.5])
+# Per-slice statistics written next to the volumes by the application (format of application/back_slice_index.py)
+SLICE_INDEX_SUFFIX = ".slices.json"
+SLICE_INDEX_VERSION = 1
+
+def read_slice_index(nifti_path):
+    """Slice index of a volume, None if absent or out of date (the volume is then scanned)"""
+    nifti_path = str(nifti_path)
+    base = nifti_path[:-len(".nii.gz")] if nifti_path.endswith(".nii.gz") else os.path.splitext(nifti_path)[0]
+    try:
+        with open(base + SLICE_INDEX_SUFFIX, "r") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    stat = os.stat(nifti_path)
+    if index.get("version") == SLICE_INDEX_VERSION and index.get("source_stat") == [stat.st_size, stat.st_mtime_ns]:
+        return index
+    return None
+
+def normalize_image(image_slice, window=None):
+    """Normalize image slice to 0-255 range for JPG conversion (window: precomputed 0.5/99.5 percentiles)"""
+    p_low, p_high = window if window is not None else np.percentile(image_slice, [0.5, 99.5])
     image_slice = np.clip(image_slice, p_low, p_high)
 
     if image_slice.max() > image_slice.min():
@@ -19,13 +38,13 @@ def normalize_image(image_slice):
 
     return normalized
 
-def find_valid_slices(seg_data, target_label=1):
-    """Find axial slices that contain the target segmentation label"""
-    valid_slices = []
-    for slice_idx in range(seg_data.shape[0]):
-        if target_label in seg_data[slice_idx]:
-            valid_slices.append(slice_idx)
-    return valid_slices
+def find_valid_slices(seg_data, target_label=1, index=None):
+    """Find axial slices that contain the target segmentation label (from the slice index when available)"""
+    if index is not None:
+        areas = index.get("labels", {}).get(str(target_label), [])
+        return [slice_idx for slice_idx, area in enumerate(areas) if area > 0]
+    areas = np.count_nonzero(seg_data.reshape(seg_data.shape[0], -1) == target_label, axis=1)
+    return np.flatnonzero(areas).tolist()
 
 def extract_random_slice(image_path, seg_path, output_folder):
     """Extract a random slice from image that has segmentation"""
@@ -33,18 +52,23 @@ def extract_random_slice(image_path, seg_path, output_folder):
         img_nib = nib.load(image_path)
         seg_nib = nib.load(seg_path)
 
-        img_data = img_nib.get_fdata()
-        seg_data = seg_nib.get_fdata()
+        img_index = read_slice_index(image_path)
+        seg_index = read_slice_index(seg_path)
 
-        valid_slices = find_valid_slices(seg_data, target_label=1)
+        # With a slice index only the selected slice is read
+        seg_data = None if seg_index is not None else seg_nib.get_fdata()
+        valid_slices = find_valid_slices(seg_data, target_label=1, index=seg_index)
 
         if not valid_slices:
             print(f"Warning: No slices with label 1 found in {seg_path}")
             return False
 
         selected_slice = random.choice(valid_slices)
-        image_slice = img_data[selected_slice, :, :]
-        normalized_slice = normalize_image(image_slice)
+        image_slice = np.asarray(img_nib.dataobj[selected_slice, :, :], dtype=np.float64)
+        window = None
+        if img_index is not None:
+            window = tuple(img_index["percentiles"][p][selected_slice] for p in ("0.5", "99.5"))
+        normalized_slice = normalize_image(image_slice, window)
 
         pil_image = Image.fromarray(normalized_slice, mode='L')
         base_name = Path(image_path).stem.replace('.nii', '')
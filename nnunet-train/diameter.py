@@ -0,0 +1,33 @@
+"""
+Exact maximum (Feret) diameter of a lesion, as measured by the application report.
+Kept in sync with application/back_diameter.py (the training scripts run without the
+application on their path).
+"""
+import numpy as np
+from scipy.ndimage import binary_erosion
+from scipy.spatial import ConvexHull, QhullError
+from scipy.spatial.distance import pdist
+
+# Corners of a voxel around its center, in voxel units
+VOXEL_CORNERS = np.array([[dz, dy, dx] for dz in (-0.5, 0.5) for dy in (-0.5, 0.5) for dx in (-0.5, 0.5)])
+
+
+def hull_points(points):
+    """Vertices of the convex hull of points (all the points when they are coplanar or too few)"""
+    if len(points) < 5:
+        return points
+    try:
+        return points[ConvexHull(points).vertices]
+    except QhullError:
+        # Flat lesion (one slice thick, or a line): no 3D hull
+        return points
+
+
+def feret_diameter(lesion, spacing=(1.0, 1.0, 1.0)):
+    """Maximum extent of a lesion mask (mm) between the outer corners of its voxels, 0.0 when empty"""
+    voxels = np.argwhere(lesion & ~binary_erosion(lesion, border_value=0))
+    if len(voxels) == 0:
+        return 0.0
+    centers = hull_points(voxels.astype(float))
+    corners = (centers[:, None, :] + VOXEL_CORNERS[None, :, :]).reshape(-1, 3) * np.asarray(spacing)
+    return float(pdist(hull_points(corners)).max())
@@ -4,6 +4,9 @@ from scipy.ndimage import label
 from skimage.measure import regionprops
 import argparse
 
+# Same exact diameter as the application report (see diameter.py)
+from diameter import feret_diameter
+
 
 def analyze_lesions(mask_path, timepoint, slice_number=None):
     """
@@ -51,12 +54,12 @@ def analyze_lesions(mask_path, timepoint, slice_number=None):
     # Find largest lesion by area
     largest_region = max(regions, key=lambda r: r.area)
     
-    # Fast approximate diameter using equivalent diameter
-    max_diameter = largest_region.equivalent_diameter * min(voxel_dims)  # Approximate scaling
+    # Exact maximum diameter of each lesion (a small elongated lesion can be the widest)
+    max_diameter = max(feret_diameter(region.image, voxel_dims[:3]) for region in regions)
     
     # Find slice with biggest lesion (if not provided)
     if slice_number is None:
-        max_lesion_slice = find_slice_with_largest_lesion_fast(labeled_array, largest_region.label)
+        max_lesion_slice = find_slice_with_largest_lesion_fast(largest_region)
     else:
         max_lesion_slice = slice_number
     
@@ -69,14 +72,10 @@ def analyze_lesions(mask_path, timepoint, slice_number=None):
     }
 
 
-def find_slice_with_largest_lesion_fast(labeled_array, largest_lesion_label):
-    lesion_mask = (labeled_array == largest_lesion_label)
-    
-    # Sum lesion voxels in each axial slice: sum over axes 1 (rows) and 2 (columns)
-    slice_areas = np.sum(lesion_mask, axis=(1, 2))
-    
-    max_slice = np.argmax(slice_areas)
-    return int(max_slice)
+def find_slice_with_largest_lesion_fast(region):
+    # Lesion voxels of each axial slice, counted inside the bounding box of the lesion only
+    slice_areas = np.count_nonzero(region.image, axis=(1, 2))
+    return int(region.bbox[0] + np.argmax(slice_areas))
 
 
 
@@ -132,12 +131,12 @@ def analyze_lesions_downsampled(mask_path, timepoint, slice_number=None, downsam
     regions = regionprops(labeled_array)
     largest_region = max(regions, key=lambda r: r.area)
     
-    # Fast approximate diameter
-    max_diameter = largest_region.equivalent_diameter * min(voxel_dims)
+    # Exact maximum diameter of each lesion
+    max_diameter = max(feret_diameter(region.image, voxel_dims[:3]) for region in regions)
     
     # Find slice with biggest lesion (adjust for downsampling)
     if slice_number is None:
-        max_lesion_slice = find_slice_with_largest_lesion_fast(labeled_array, largest_region.label)
+        max_lesion_slice = find_slice_with_largest_lesion_fast(largest_region)
         if downsample_factor > 1:
             max_lesion_slice *= downsample_factor  # Scale back up
     else: